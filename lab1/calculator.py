@@ -1,5 +1,12 @@
+import keyword
+import math
+import operator
+import time
 import unittest
 from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
 
 
 class Todo(Exception):
@@ -65,27 +72,133 @@ class Par(Expr):
     def __str__(self):
         return f"({self.inner})"
 
+@dataclass
+class Var(Expr):
+    name: str
+
+    def __str__(self):
+        return self.name
+
 
 
 # Exercise 3: finish the interpreter by filling in the missing
 # code in the `eval_value()` function. 
 # Don't forget to test your code using unit tests 3&4.
-def eval_value(e: Expr) -> [int| float]:
+def eval_value(e: Expr, env: dict | None = None) -> [int| float]:
     match e:
         case Num(value):
             return value
+        case Var(name):
+            return env[name]
         case Add(left, right):
-            return eval_value(left) + eval_value(right)
+            return eval_value(left, env) + eval_value(right, env)
         case Minus(left, right):
-            return eval_value(left) - eval_value(right)
+            return eval_value(left, env) - eval_value(right, env)
         case Multi(left, right):
-            return eval_value(left) * eval_value(right)
+            return eval_value(left, env) * eval_value(right, env)
         case Div(left, right):
-            return eval_value(left) / eval_value(right)
+            return eval_value(left, env) / eval_value(right, env)
         case Par(inner):
-            return eval_value(inner)
+            return eval_value(inner, env)
     raise NotImplementedError('TODO: Your code here!') 
 
+
+_OPERATORS = {Add: (" + ", operator.add), Minus: (" - ", operator.sub),
+              Multi: (" * ", operator.mul), Div: (" / ", operator.truediv)}
+
+
+def fold_constants(e: Expr) -> Expr:
+    """`e` with its subterms without variables replaced by their values.
+
+    A division by zero is left as it is, to fail when it is evaluated.
+    """
+    match e:
+        case Par(inner):
+            inner = fold_constants(inner)
+            return inner if isinstance(inner, Num) else Par(inner)
+        case Add(left, right) | Minus(left, right) | Multi(left, right) | Div(left, right):
+            left, right = fold_constants(left), fold_constants(right)
+            if isinstance(left, Num) and isinstance(right, Num) and \
+                    not (isinstance(e, Div) and right.value == 0):
+                return Num(_OPERATORS[type(e)][1](left.value, right.value))
+            return type(e)(left, right)
+    return e
+
+
+def compile_expr(e: Expr, leaves: bool = False) -> Callable:
+    """Compile `e` to a Python function, to evaluate it many times.
+
+    The parameters of the function are the variables of `e`, by first
+    occurrence, then with `leaves` one for each `Num` leaf, left to
+    right, defaulting to its value. Without `leaves`, the constants are
+    folded first. The function computes `eval_value(e, env)` with one
+    line per operation, without dispatching on the nodes.
+    """
+    params, leaf_params, constants, lines = [], [], {}, []
+
+    def operand(e: Expr) -> str:
+        match e:
+            case Num(value):
+                if leaves:
+                    leaf_params.append(f"_x{len(leaf_params)}")
+                    constants[leaf_params[-1]] = value
+                    return leaf_params[-1]
+                if isinstance(value, int) or math.isfinite(value):
+                    return repr(value)
+                # inf and nan have no literals
+                name = f"_c{len(constants)}"
+                constants[name] = value
+                return name
+            case Var(name):
+                if not name.isidentifier() or keyword.iskeyword(name) or name.startswith("_"):
+                    raise ValueError(f"compile_expr: bad variable name: {name!r}")
+                if name not in params:
+                    params.append(name)
+                return name
+            case Par(inner):
+                return operand(inner)
+            case Add(left, right) | Minus(left, right) | Multi(left, right) | Div(left, right):
+                left, right = operand(left), operand(right)
+                lines.append(f"    _t{len(lines)} = {left}{_OPERATORS[type(e)][0]}{right}")
+                return f"_t{len(lines) - 1}"
+        raise TypeError(f"compile_expr: not an expression: {e!r}")
+
+    result = operand(e if leaves else fold_constants(e))
+    source = "\n".join([f"def _compiled({', '.join(params + leaf_params)}):", *lines,
+                        f"    return {result}"])
+    namespace = {} if leaves else dict(constants)
+    exec(compile(source, f"<compile_expr {e}>", "exec"), namespace)
+    function = namespace["_compiled"]
+    function.__defaults__ = tuple(constants[name] for name in leaf_params) or None
+    function.__doc__ = str(e)
+    return function
+
+
+_UFUNCS = {Add: np.add, Minus: np.subtract, Multi: np.multiply}
+
+
+def eval_batch(e: Expr, env: dict | None = None, fill: float = math.nan) -> np.ndarray:
+    """Evaluate `e` once over NumPy arrays, bound to its `Var`s by `env` or as `Num` values.
+
+    The operations are elementwise, with broadcasting. Where a divisor
+    is 0, the quotient is `fill` rather than an error.
+    """
+    match e:
+        case Num(value):
+            return np.asarray(value)
+        case Var(name):
+            return np.asarray(env[name])
+        case Par(inner):
+            return eval_batch(inner, env, fill)
+        case Add(left, right) | Minus(left, right) | Multi(left, right):
+            return _UFUNCS[type(e)](eval_batch(left, env, fill), eval_batch(right, env, fill))
+        case Div(left, right):
+            left, right = eval_batch(left, env, fill), eval_batch(right, env, fill)
+            out = np.full(np.broadcast_shapes(left.shape, right.shape), fill,
+                          dtype=np.result_type(left, right, 1.0))
+            return np.divide(left, right, out=out, where=right != 0)
+    raise TypeError(f"eval_batch: not an expression: {e!r}")
+
 # 3 * 4 + 10 / 2
 test_case_1 = Add(
     Multi(
@@ -104,6 +217,37 @@ test_case_2 = Minus(
     ), Num(621)
 )
 
+# (x + 217) * y - z / 2
+test_case_3 = Minus(
+    Multi(
+        Par(
+            Add(Var("x"), Num(217))
+        ), Var("y")
+    ), Div(
+        Var("z"), Num(2)
+    )
+)
+
+
+def benchmark_compile(e: Expr = test_case_3, n: int = 100000):
+    """Time `n` evaluations of `e` by `eval_value`, `compile_expr` and `eval_batch`."""
+    envs = [{"x": i, "y": i % 7, "z": i / 3} for i in range(n)]
+    f = compile_expr(e)
+    start = time.perf_counter()
+    expected = [eval_value(e, env) for env in envs]
+    middle = time.perf_counter()
+    results = [f(**env) for env in envs]
+    end = time.perf_counter()
+    assert results == expected
+    columns = {name: np.array([env[name] for env in envs]) for name in envs[0]}
+    batch_start = time.perf_counter()
+    batch = eval_batch(e, columns)
+    batch_end = time.perf_counter()
+    assert np.allclose(batch, expected)
+    print(f"{n} evaluations of {e}: eval_value {middle - start:.3f}s, "
+          f"compile_expr {end - middle:.3f}s, eval_batch {batch_end - batch_start:.3f}s")
+
+
 class TestCalculator(unittest.TestCase):
 
     def test_print_1(self):
@@ -118,6 +262,34 @@ class TestCalculator(unittest.TestCase):
     def test_eval_2(self):
         self.assertEqual(eval_value(test_case_2), 66)
 
+    def test_compile(self):
+        f = compile_expr(test_case_3)
+        for x, y, z in ((0, 0, 0), (1, 2, 3), (-5, 0.5, 7)):
+            env = {"x": x, "y": y, "z": z}
+            self.assertEqual(f(**env), eval_value(test_case_3, env))
+            self.assertEqual(f(x, y, z), eval_value(test_case_3, env))
+        self.assertEqual(compile_expr(test_case_1)(), 17)
+        g = compile_expr(test_case_2, leaves=True)
+        self.assertEqual(g(), 66)
+        self.assertEqual(g(1, 2, 3), -612)
+        self.assertEqual(fold_constants(test_case_2), Num(66))
+        self.assertEqual(fold_constants(Add(Var("x"), Par(Multi(Num(2), Num(3))))),
+                         Add(Var("x"), Num(6)))
+        with self.assertRaises(ZeroDivisionError):
+            compile_expr(Div(Num(1), Num(0)))()
+
+    def test_batch(self):
+        x, y, z = np.arange(-3, 3), np.linspace(0, 1, 6), np.array([4, 0, 2, 0, -1, 3])
+        result = eval_batch(test_case_3, {"x": x, "y": y, "z": z})
+        for i in range(6):
+            env = {"x": x[i], "y": y[i], "z": z[i]}
+            self.assertAlmostEqual(result[i], eval_value(test_case_3, env))
+        result = eval_batch(Div(Var("x"), Add(Var("z"), Num(0))), {"x": x, "z": z}, fill=-1)
+        np.testing.assert_array_equal(result, [-0.75, -1, -0.5, -1, -1, 2 / 3])
+        np.testing.assert_array_equal(eval_batch(Div(Num(x), Var("x")), {"x": x}),
+                                      [1, 1, 1, math.nan, 1, 1])
+        self.assertEqual(eval_batch(test_case_2), 66)
+
 
 if __name__ == '__main__':
     unittest.main()
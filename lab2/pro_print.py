@@ -1,94 +1,386 @@
+import io
+import itertools
+import sys
+import tracemalloc
+import unittest
+from typing import NamedTuple
+
 from z3 import *
 
+# characters written to the file at a time
+_CHUNK_SIZE = 1 << 16
+
+
+def pretty_print(expr, file=None, max_width=None, max_depth=None, let=False, cache=None):
+    """Print `expr` to `file`, the standard output by default, as it is produced.
+
+    The text is never held whole: its fragments are written in chunks.
+    With `max_width`, lines are broken between fragments to keep them
+    that wide, unless a single name is wider. With `max_depth`, the
+    subterms below that depth are written "...". `let` names the shared
+    subterms, see `write_pretty`.
+    """
+    fragments = iter_pretty(expr, let=let, max_depth=max_depth, cache=cache)
+    if max_width is not None:
+        fragments = _wrap(fragments, max_width)
+    _write_fragments(itertools.chain(fragments, ["\n"]), sys.stdout if file is None else file)
+
+
+def trans_pretty(expr, var_mapping=None, depth=0, top_level=True, cache=None):
+    return "".join(iter_pretty(expr, var_mapping=var_mapping, depth=depth, top_level=top_level,
+                               cache=cache))
+
+
+def write_pretty(expr, file, let=False, var_mapping=None, depth=0, top_level=True, cache=None):
+    """Write the text of `expr` to the stream `file`, like `trans_pretty`.
+
+    With `let`, each subterm occurring several times outside of the
+    quantifiers is written once as a line "let $1 = ... in" before the
+    formula, which refers to it as $1.
+    """
+    _write_fragments(iter_pretty(expr, let=let, var_mapping=var_mapping, depth=depth,
+                                 top_level=top_level, cache=cache), file)
+
+
+def iter_pretty(expr, let=False, max_depth=None, var_mapping=None, depth=0, top_level=True,
+                cache=None):
+    """Yield the fragments of the text of `expr`, see `write_pretty` and `pretty_print`.
+
+    The formula is walked with an explicit stack, so its depth is not
+    bounded by the recursion limit, and the nodes are classified by
+    `cache`, a `NodeCache` which may be shared with other walks. With
+    `let`, the pieces of the text of each subterm are kept under its Z3
+    AST id, so shared subterms are only taken apart once. Otherwise
+    nothing is kept past its last use, unless `cache` is given: only
+    the nodes waiting on the stack are held.
+    """
+    if cache is None:
+        cache = NodeCache() if let else _Classifier()
+    printer = _Printer({} if var_mapping is None else var_mapping, depth, cache, let)
+    root = (expr, 0)
+    names = {}
+    if let:
+        for node in printer.shared(root):
+            name = f"${len(names) + 1}"
+            yield f"let {name} = "
+            yield from printer.fragments(node, True, max_depth, names)
+            yield " in\n"
+            names[printer.key(node)] = name
+    yield from printer.fragments(root, top_level, max_depth, names)
+
+
+def _write_fragments(fragments, file):
+    chunk = []
+    size = 0
+    for fragment in fragments:
+        chunk.append(fragment)
+        size += len(fragment)
+        if size >= _CHUNK_SIZE:
+            file.write("".join(chunk))
+            chunk.clear()
+            size = 0
+    file.write("".join(chunk))
+
+
+def _wrap(fragments, max_width):
+    """Break the lines of `fragments` between them, to keep them within `max_width`."""
+    column = 0
+    for fragment in fragments:
+        if column and column + len(fragment) > max_width:
+            yield "\n"
+            fragment = fragment.lstrip(" ")
+            column = 0
+        yield fragment
+        newline = fragment.rfind("\n")
+        column = len(fragment) - newline - 1 if newline >= 0 else column + len(fragment)
+
+
+class _Printer:
+    """The pieces of the text of subterms, in the contexts of the quantifiers.
+
+    A context is an index into `contexts`, of the depth of the bound
+    variables and of their names, and a subterm is keyed by its AST id
+    and its context.
+    """
+
+    def __init__(self, var_mapping, depth, cache, memoize=True):
+        self.cache = cache
+        self.contexts = [(depth, var_mapping)]
+        # (quantifier key) -> context of its body
+        self.bodies = {}
+        # key -> pieces, when not at the top level, if `memoize`
+        self.pieces = {}
+        self.memoize = memoize
+
+    def key(self, node):
+        expr, ctx = node
+        return expr.get_id(), ctx
+
+    def _pieces(self, node, top):
+        """The text of `node`: strings, and (subterm, context) nodes in place of theirs."""
+        expr, ctx = node
+        depth, var_mapping = self.contexts[ctx]
+        info = self.cache.node(expr)
+
+        def wrap(pieces):
+            return pieces if top else ["(", *pieces, ")"]
+
+        def join(sep, children):
+            pieces = []
+            for i, child in enumerate(children):
+                if i:
+                    pieces.append(sep)
+                pieces.append((child, ctx))
+            return pieces
+
+        match info.kind:
+            case "quantifier":
+                key = self.key(node)
+                if key not in self.bodies:
+                    new_var_mapping = var_mapping.copy()
+                    for i, var in enumerate(info.bound):
+                        new_var_mapping[f'Var({depth + i})'] = var
+                    self.bodies[key] = len(self.contexts)
+                    self.contexts.append((depth + len(info.bound), new_var_mapping))
+                (body,) = info.children
+                quantifier_str = f"{info.name}{', '.join(info.bound)}."
+                if self.cache.node(body).kind == "not" and depth == 0:
+                    return [quantifier_str + "(", (body, self.bodies[key]), ")"]
+                return [quantifier_str, (body, self.bodies[key])]
+            case "iff":
+                antecedent, consequent = self.cache.node(info.children[0]).children
+                return wrap([(antecedent, ctx), " <-> ", (consequent, ctx)])
+            case "implies":
+                return wrap(join(" -> ", info.children))
+            case "and":
+                return wrap(join(" /\\ ", info.children))
+            case "or":
+                return wrap(join(" \\/ ", info.children))
+            case "not":
+                (operand,) = info.children
+                if self.cache.node(operand).kind == "quantifier":
+                    return ["¬(", (operand, ctx), ")"]
+                return ["¬", (operand, ctx)]
+            case "app":
+                if "=" == info.name or "<" == info.name or ">" == info.name:
+                    return join(f" {info.name} ", info.children[:2])
+                return [f"{info.name}(", *join(", ", info.children), ")"]
+            case "var":
+                return [var_mapping.get(info.name, info.name)]
+            case _:
+                return [info.name]
+
+    def _cached_pieces(self, node):
+        if not self.memoize:
+            return self._pieces(node, False)
+        key = self.key(node)
+        pieces = self.pieces.get(key)
+        if pieces is None:
+            pieces = self.pieces[key] = self._pieces(node, False)
+        return pieces
 
-def pretty_print(expr):
-    print(trans_pretty(expr))
-
-
-def trans_pretty(expr, var_mapping=None, depth=0, top_level=True):
-    if var_mapping is None:
-        var_mapping = {}
-    if is_quantifier(expr):
-        num_vars = expr.num_vars()
-        bound_vars = [expr.var_name(i) for i in range(num_vars)]
-        body = expr.body()
-        new_var_mapping = var_mapping.copy()
-        for i, var in enumerate(bound_vars):
-            new_var_mapping[f'Var({depth + i})'] = var
-        body_str = trans_pretty(body, new_var_mapping, depth + num_vars, False)
-        quantifier_str = "∀" if expr.is_forall() else "∃"
-        return f"{quantifier_str}{', '.join(bound_vars)}.({body_str})" if body_str.startswith("¬") and depth == 0 else \
-            f"{quantifier_str}{', '.join(bound_vars)}.{body_str}"
-    elif is_iff(expr):
-        left, right = expr.children()
-        if is_implies(left) and is_implies(right) and is_implies_equivalent(left, right):
-            antecedent, consequent = left.children()
-            antecedent_str = trans_pretty(
-                antecedent, var_mapping, depth, False)
-            consequent_str = trans_pretty(
-                consequent, var_mapping, depth, False)
-            if (top_level == True):
-                return f"{antecedent_str} <-> {consequent_str}"
+    def shared(self, root):
+        """The subterms occurring several times below `root` outside of the
+        quantifiers, each after those it contains."""
+        occurrences = {}
+        order = []
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                order.append(node)
+                continue
+            key = self.key(node)
+            occurrences[key] = occurrences.get(key, 0) + 1
+            if occurrences[key] > 1:
+                continue
+            pieces = self._cached_pieces(node)
+            stack.append((node, True))
+            stack.extend((piece, False) for piece in reversed(pieces) if not isinstance(piece, str))
+        keys = [self.key(node) for node in order]
+        return [node for node, key in zip(order, keys)
+                if key[1] == 0 and occurrences[key] > 1 and len(self.pieces[key]) > 1]
+
+    def fragments(self, root, top_level, max_depth, names):
+        """Yield the text of `root`, with the subterms in `names` by their names."""
+        stack = [(root, top_level, 0)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                yield item
+                continue
+            node, top, level = item
+            if max_depth is not None and level > max_depth:
+                yield "..."
+                continue
+            if top:
+                pieces = self._pieces(node, True)
             else:
-                return f"({antecedent_str} <-> {consequent_str})"
-    elif is_implies(expr):
-        antecedent, consequent = expr.children()
-        antecedent_str = trans_pretty(antecedent, var_mapping, depth, False)
-        consequent_str = trans_pretty(consequent, var_mapping, depth, False)
-        if (top_level == True):
-            return f"{antecedent_str} -> {consequent_str}"
-        else:
-            return f"({antecedent_str} -> {consequent_str})"
-    elif is_and(expr):
-        conjuncts = expr.children()
-        conjuncts_str = " /\ ".join(trans_pretty(c,
-                                    var_mapping, depth, False) for c in conjuncts)
-        if (top_level == True):
-            return f"{conjuncts_str}"
-        else:
-            return f"({conjuncts_str})"
-    elif is_or(expr):
-        disjuncts = expr.children()
-        disjuncts_str = " \/ ".join(trans_pretty(c,
-                                    var_mapping, depth, False) for c in disjuncts)
-        if (top_level == True):
-            return f"{disjuncts_str}"
-        else:
-            return f"({disjuncts_str})"
-    elif is_not(expr):
-        operand = expr.children()[0]
-        operand_str = trans_pretty(operand, var_mapping, depth, False) if not isinstance(operand, QuantifierRef) else \
-            f"({trans_pretty(operand, var_mapping, depth, False)})"
-        return f"¬{operand_str}"
-    elif is_app(expr) and expr.num_args() > 0:
-        decl_name = expr.decl().name()
-        if "=" == decl_name or "<" == decl_name or ">" == decl_name:
-            arg_1_str = trans_pretty(
-                expr.children()[0], var_mapping, depth, False)
-            arg_2_str = trans_pretty(
-                expr.children()[1], var_mapping, depth, False)
-            return f"{arg_1_str} {decl_name} {arg_2_str}"
-        args_str = ", ".join(trans_pretty(arg, var_mapping, depth, False)
-                             for arg in expr.children())
-        return f"{decl_name}({args_str})"
-    elif is_var(expr):
-        var_name = var_mapping.get(str(expr), str(expr))
-        return var_name
-    else:
-        return str(expr)
+                name = names.get(self.key(node))
+                if name is not None:
+                    yield name
+                    continue
+                pieces = self._cached_pieces(node)
+            stack.extend(piece if isinstance(piece, str) else (piece, False, level + 1)
+                         for piece in reversed(pieces))
+
+
+class Node(NamedTuple):
+    """What the printers need of a Z3 expression, fetched once.
+
+    `kind` is "quantifier", "iff", "implies", "and", "or", "not", "app"
+    (with arguments), "var" or "leaf". `name` is the quantifier symbol,
+    the name of the function, the "Var(i)" of a bound variable or the
+    text of a leaf, and `bound` the names bound by a quantifier.
+    """
+    kind: str
+    name: str
+    children: tuple
+    bound: tuple
+    expr: ExprRef
+
+
+_CONNECTIVES = {Z3_OP_AND: "and", Z3_OP_OR: "or", Z3_OP_IMPLIES: "implies", Z3_OP_NOT: "not"}
+
+
+def _is_implies(expr):
+    # without classifying `expr`, which would recurse down the formula
+    ctx, ast = expr.ctx_ref(), expr.as_ast()
+    return Z3_get_ast_kind(ctx, ast) == Z3_APP_AST and \
+        Z3_get_decl_kind(ctx, Z3_get_app_decl(ctx, ast)) == Z3_OP_IMPLIES
+
+
+class NodeCache:
+    """Classifies Z3 expressions, once per AST id.
+
+    Each node takes a few calls into Z3 and its children are fetched
+    once; an "and" of two converse implications is an "iff", compared
+    by AST id. The nodes keep their expressions alive, so that the ids
+    are not reused while the cache is.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+
+    def node(self, expr) -> Node:
+        key = expr.get_id()
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = self._classify(expr)
+        return node
+
+    def _classify(self, expr) -> Node:
+        ctx, ast = expr.ctx_ref(), expr.as_ast()
+        ast_kind = Z3_get_ast_kind(ctx, ast)
+        if ast_kind == Z3_QUANTIFIER_AST:
+            bound = tuple(expr.var_name(i) for i in range(expr.num_vars()))
+            return Node("quantifier", "∀" if expr.is_forall() else "∃", (expr.body(),), bound, expr)
+        if ast_kind == Z3_VAR_AST:
+            return Node("var", f"Var({Z3_get_index_value(ctx, ast)})", (), (), expr)
+        if ast_kind != Z3_APP_AST or Z3_get_app_num_args(ctx, ast) == 0:
+            return Node("leaf", str(expr), (), (), expr)
+        decl = Z3_get_app_decl(ctx, ast)
+        kind = _CONNECTIVES.get(Z3_get_decl_kind(ctx, decl), "app")
+        children = tuple(expr.children())
+        if kind == "and" and len(children) == 2 and all(map(_is_implies, children)):
+            (a, b), (c, d) = (child.children() for child in children)
+            if a.get_id() == d.get_id() and b.get_id() == c.get_id():
+                kind = "iff"
+        name = expr.decl().name() if kind == "app" else ""
+        return Node(kind, name, children, (), expr)
+
+
+class _Classifier(NodeCache):
+    """A `NodeCache` keeping nothing, for walks that let go of the nodes."""
+
+    def node(self, expr) -> Node:
+        return self._classify(expr)
 
 
 def is_implies_equivalent(impl1, impl2):
     antecedent1, consequent1 = impl1.children()
     antecedent2, consequent2 = impl2.children()
 
-    return antecedent1 == consequent2 and antecedent2 == consequent1
+    return antecedent1.eq(consequent2) and antecedent2.eq(consequent1)
+
+
+def is_iff(expr, cache=None):
+    """Whether `expr` is (p -> q) /\\ (q -> p), classified by `cache` if given."""
+    return (NodeCache() if cache is None else cache).node(expr).kind == "iff"
+
+
+class TestPrettyPrint(unittest.TestCase):
+    def test_conventions(self):
+        P, Q, R = Bools('P Q R')
+        S = DeclareSort('S')
+        x, y = Consts('x y', S)
+        p, q = Function('p', S, BoolSort()), Function('q', S, BoolSort())
+        self.assertEqual(trans_pretty(Or(P, Q)), r"P \/ Q")
+        self.assertEqual(trans_pretty(Implies(And(P, Q), Not(Or(P, R)))), r"(P /\ Q) -> ¬(P \/ R)")
+        self.assertEqual(trans_pretty(And(Implies(P, Q), Implies(Q, P))), "P <-> Q")
+        self.assertEqual(trans_pretty(Not(And(Implies(P, Q), Implies(Q, P)))), "¬(P <-> Q)")
+        self.assertEqual(trans_pretty(ForAll(x, Not(p(x)))), "∀x.(¬p(x))")
+        self.assertEqual(trans_pretty(Not(ForAll(x, Implies(p(x), q(x))))),
+                         "¬(∀x.(p(x) -> q(x)))")
+        self.assertEqual(trans_pretty(Exists(x, And(p(x), x == y))), r"∃x.(p(x) /\ x = y)")
+        cache = NodeCache()
+        self.assertTrue(is_iff(And(Implies(P, Q), Implies(Q, P)), cache))
+        self.assertFalse(is_iff(And(Implies(P, Q), Implies(P, Q)), cache))
+        self.assertEqual(trans_pretty(And(Implies(P, Q), Implies(Q, P)), cache=cache), "P <-> Q")
+        self.assertEqual([c.get_id() for c in cache.node(Implies(P, Q)).children],
+                         [P.get_id(), Q.get_id()])
+
+    def test_shared(self):
+        # a chain of conjunctions like lab3/monster.py, past the recursion limit
+        prop = BoolVal(True)
+        for i in range(5000):
+            prop = And(prop, Bool(f"b_{i}"))
+        text = trans_pretty(prop)
+        self.assertTrue(text.startswith("(" * 4999 + r"True /\ b_0)"))
+        self.assertTrue(text.endswith(r"b_4998) /\ b_4999"))
+        P, Q = Bools('P Q')
+        shared = Or(P, Q)
+        f = And(Implies(shared, P), Implies(Not(shared), Q))
+        self.assertEqual(trans_pretty(f), r"((P \/ Q) -> P) /\ (¬(P \/ Q) -> Q)")
+        out = io.StringIO()
+        write_pretty(f, out, let=True)
+        self.assertEqual(out.getvalue(), "let $1 = P \\/ Q in\n($1 -> P) /\\ (¬$1 -> Q)")
+
+    def test_streaming(self):
+        P, Q, R = Bools('P Q R')
+        f = And(Implies(Or(P, Q), R), Not(And(P, Q, R)))
+        fragments = list(iter_pretty(f))
+        self.assertGreater(len(fragments), 10)
+        self.assertEqual("".join(fragments), trans_pretty(f))
+        out = io.StringIO()
+        pretty_print(f, file=out, max_depth=1)
+        self.assertEqual(out.getvalue(), "(... -> ...) /\\ ¬...\n")
+        out = io.StringIO()
+        pretty_print(f, file=out, max_width=12)
+        self.assertEqual(out.getvalue(), "((P \\/ Q)\n-> R) /\\ ¬(P\n/\\ Q /\\ R)\n")
+
+    def test_footprint(self):
+        # streaming keeps only the subterms waiting on the stack, where
+        # `let` keeps the pieces of every subterm
+        prop = BoolVal(True)
+        for i in range(5000):
+            prop = And(prop, Bool(f"b_{i}"))
+        peaks = []
+        for let in (False, True):
+            tracemalloc.start()
+            try:
+                pretty_print(prop, file=_NullWriter(), let=let)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        self.assertLess(peaks[0], 1000 * 5000)
+        self.assertLess(3 * peaks[0], peaks[1])
+
+
+class _NullWriter:
+    def write(self, text):
+        pass
 
 
-def is_iff(expr):
-    if is_and(expr):
-        conjuncts = expr.children()
-        if len(conjuncts) == 2:
-            left, right = conjuncts
-            return is_implies(left) and is_implies(right) and is_implies_equivalent(left, right)
-    return False
+if __name__ == '__main__':
+    unittest.main()
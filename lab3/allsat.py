@@ -0,0 +1,116 @@
+"""Enumerating and counting the models of Z3 formulas.
+
+The models are projected on a list of atoms: each assignment of the
+atoms that extends to a model of the formula is found once, and is then
+blocked by a clause over the atoms only.
+"""
+
+import os
+import tempfile
+import unittest
+from typing import Iterator
+
+from z3 import *
+
+from dpll import atoms, from_z3
+from solutions import SolutionWriter, read_solutions
+from truth_table import MAX_VARS, truth_table
+
+
+def sat_models(props: list[ExprRef], f: ExprRef,
+               sink: SolutionWriter | None = None) -> Iterator[ModelRef]:
+    """Yield the models of `f`, one per assignment of `props`.
+
+    `f` is asserted once, and after each model only the clause blocking
+    its values of `props` is added, so the solver keeps what it learned
+    and the blocking clauses stay as short as the projection. The values
+    of `props` are also written to `sink`, a "?" `SolutionWriter`.
+    """
+    solver = Solver()
+    solver.add(f)
+    while solver.check() == sat:
+        m = solver.model()
+        values = [is_true(m.eval(p, model_completion=True)) for p in props]
+        if sink is not None:
+            sink.write(values)
+        yield m
+        solver.add(Or([Not(p) if value else p for p, value in zip(props, values)]))
+
+
+def sat_cubes(props: list[ExprRef], f: ExprRef) -> Iterator[dict]:
+    r"""Yield partial assignments of `props` covering the models of `f`.
+
+    Each model is shrunk to the values of `props` that are enough for
+    `f` and all the blocking clauses so far to hold, so the cubes are
+    disjoint and one blocking clause rules out a whole cube. A second
+    solver holds ~f \/ ~block_1 \/ ... chained by selectors, and the
+    unsat core of the model values under it is the cube. When `f` has
+    atoms other than `props`, a model may not shrink at all.
+    """
+    solver = Solver()
+    solver.add(f)
+    lifter = Solver()
+    lifter.set("core.minimize", True)
+    selector = FreshBool()
+    lifter.add(Or(Not(f), selector))
+    while solver.check() == sat:
+        m = solver.model()
+        cube = {p: is_true(m.eval(p, model_completion=True)) for p in props}
+        lits = {p: p if value else Not(p) for p, value in cube.items()}
+        if lifter.check(Not(selector), *lits.values()) == unsat:
+            core = {c.get_id() for c in lifter.unsat_core()}
+            cube = {p: value for p, value in cube.items() if lits[p].get_id() in core}
+        yield cube
+        lits = [lits[p] for p in cube]
+        block = Or([Not(lit) for lit in lits])
+        solver.add(block)
+        new_selector = FreshBool()
+        lifter.add(Or(Not(selector), Not(block), new_selector))
+        selector = new_selector
+
+
+def count_sat(props: list[ExprRef], f: ExprRef) -> int:
+    """The number of assignments of `props` that extend to models of `f`.
+
+    A propositional `f` over at most `truth_table.MAX_VARS` atoms, all
+    in `props`, is counted on its truth table instead of by the solver.
+    """
+    names = [str(p) for p in props]
+    if len(names) <= MAX_VARS and all(is_bool(p) for p in props):
+        try:
+            prop = from_z3(f)
+        except NotImplementedError:
+            prop = None
+        if prop is not None and set(atoms(prop)) <= set(names):
+            return truth_table(prop, names).count()
+    return sum(2 ** (len(props) - len(cube)) for cube in sat_cubes(props, f))
+
+
+class TestSatAll(unittest.TestCase):
+    def test_sat_models(self):
+        a, b, c = Bools('a b c')
+        self.assertEqual(sum(1 for _ in sat_models([a, b, c], Or(a, b, c))), 7)
+        # projected on a, b
+        self.assertEqual(sum(1 for _ in sat_models([a, b], Or(a, b, c))), 4)
+        self.assertEqual(list(sat_models([a], And(a, Not(a)))), [])
+
+    def test_sink(self):
+        a, b, c = Bools('a b c')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "models.sol.gz")
+            with SolutionWriter(path, 2, "?") as sink:
+                self.assertEqual(sum(1 for _ in sat_models([a, b], And(Or(a, b), c), sink)), 3)
+            self.assertEqual(sorted(read_solutions(path)),
+                             [(False, True), (True, False), (True, True)])
+
+    def testsat_cubes(self):
+        a, b, c, d = Bools('a b c d')
+        f = Or(And(a, b, d), And(a, b, Not(c)))
+        for g, expected in ((f, 3), (Not(f), 13), (Or(a, Not(a)), 16)):
+            cubes = list(sat_cubes([a, b, c, d], g))
+            self.assertEqual(count_sat([a, b, c, d], g), expected)
+            self.assertLess(len(cubes), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
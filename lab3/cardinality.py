@@ -0,0 +1,142 @@
+"""Cardinality constraints over Z3 Bool literals.
+
+"At most k of these literals are true" said naively takes a clause for
+every k + 1 of them, or, for "exactly one", an `Or` of n `And`s of n
+literals each. The encodings here add auxiliary atoms to stay small:
+  * "pairwise": no auxiliary atom, a clause for every k + 1 literals;
+  * "sequential": Sinz's sequential counter, registers s_i_j meaning "at
+    least j of the first i literals are true", O(n * k) clauses;
+  * "commander": at most one, the literals in groups of 3 each with a
+    commander atom implied by them, and at most one commander, recursively;
+  * "totalizer": a tree of unary counters, the outputs of a node meaning
+    "at least j of its literals are true", cut at k + 1;
+  * "pb": Z3's native pseudo-Boolean `AtMost` and `PbEq`.
+The auxiliary atoms come from `FreshBool`, so the constraints are
+equisatisfiable: project the models on the literals.
+"""
+
+import itertools
+import unittest
+from math import comb
+from typing import Callable, List
+
+from z3 import *
+
+
+def _pairwise(lits: List[BoolRef], k: int) -> List[BoolRef]:
+    return [Or([Not(lit) for lit in subset]) for subset in itertools.combinations(lits, k + 1)]
+
+
+def _sequential(lits: List[BoolRef], k: int) -> List[BoolRef]:
+    n = len(lits)
+    if k == 0:
+        return [Not(lit) for lit in lits]
+    if n <= k:
+        return []
+    # s[i][j]: at least j + 1 of lits[:i + 1] are true
+    s = [[FreshBool("s") for _ in range(k)] for _ in range(n - 1)]
+    clauses = [Implies(lits[0], s[0][0])]
+    clauses += [Not(s[0][j]) for j in range(1, k)]
+    for i in range(1, n - 1):
+        clauses.append(Implies(lits[i], s[i][0]))
+        clauses.append(Implies(s[i - 1][0], s[i][0]))
+        for j in range(1, k):
+            clauses.append(Implies(And(lits[i], s[i - 1][j - 1]), s[i][j]))
+            clauses.append(Implies(s[i - 1][j], s[i][j]))
+        clauses.append(Or(Not(lits[i]), Not(s[i - 1][k - 1])))
+    clauses.append(Or(Not(lits[n - 1]), Not(s[n - 2][k - 1])))
+    return clauses
+
+
+def _commander(lits: List[BoolRef], k: int) -> List[BoolRef]:
+    if k != 1:
+        raise ValueError("cardinality: the commander encoding is for at most one")
+    clauses = []
+    while len(lits) > 4:
+        commanders = []
+        for g in range(0, len(lits), 3):
+            group = lits[g:g + 3]
+            c = FreshBool("c")
+            clauses += _pairwise(group, 1)
+            clauses += [Implies(lit, c) for lit in group]
+            commanders.append(c)
+        lits = commanders
+    return clauses + _pairwise(lits, 1)
+
+
+def _totalizer(lits: List[BoolRef], k: int) -> List[BoolRef]:
+    if len(lits) <= k:
+        return []
+    clauses = []
+
+    def build(lits: List[BoolRef]) -> List[BoolRef]:
+        """The outputs of the node over `lits`: output j is implied by j + 1 true literals."""
+        if len(lits) == 1:
+            return lits
+        left, right = build(lits[:len(lits) // 2]), build(lits[len(lits) // 2:])
+        outputs = [FreshBool("t") for _ in range(min(len(lits), k + 1))]
+        for i in range(len(left) + 1):
+            for j in range(len(right) + 1):
+                if 0 < i + j <= len(outputs):
+                    premises = ([left[i - 1]] if i else []) + ([right[j - 1]] if j else [])
+                    clauses.append(Implies(And(premises), outputs[i + j - 1]))
+        return outputs
+
+    outputs = build(lits)
+    return clauses + [Not(outputs[k])]
+
+
+def _pb(lits: List[BoolRef], k: int) -> List[BoolRef]:
+    return [AtMost(*lits, k)] if lits else []
+
+
+ENCODINGS: dict[str, Callable[[List[BoolRef], int], List[BoolRef]]] = {
+    "pairwise": _pairwise,
+    "sequential": _sequential,
+    "commander": _commander,
+    "totalizer": _totalizer,
+    "pb": _pb,
+}
+
+
+def at_most_k(lits: List[BoolRef], k: int, encoding: str = "sequential") -> List[BoolRef]:
+    """Constraints saying that at most `k` of `lits` are true, see `ENCODINGS`."""
+    return ENCODINGS[encoding](list(lits), k)
+
+
+def at_most_one(lits: List[BoolRef], encoding: str = "sequential") -> List[BoolRef]:
+    return at_most_k(lits, 1, encoding)
+
+
+def exactly_one(lits: List[BoolRef], encoding: str = "sequential") -> List[BoolRef]:
+    if encoding == "pb":
+        return [PbEq([(lit, 1) for lit in lits], 1)]
+    return [Or(lits)] + at_most_one(lits, encoding)
+
+
+class TestCardinality(unittest.TestCase):
+    def _count(self, lits: List[BoolRef], constraints: List[BoolRef]) -> int:
+        from allsat import sat_models
+        return sum(1 for _ in sat_models(lits, And(constraints)))
+
+    def test_at_most_k(self):
+        for n in range(1, 7):
+            lits = Bools(" ".join(f"x{i}" for i in range(n)))
+            for k in range(3):
+                expected = sum(comb(n, i) for i in range(k + 1))
+                for encoding in ENCODINGS:
+                    if encoding == "commander" and k != 1:
+                        continue
+                    self.assertEqual(self._count(lits, at_most_k(lits, k, encoding)), expected,
+                                     (encoding, n, k))
+
+    def test_exactly_one(self):
+        lits = Bools("x0 x1 x2 x3 x4 x5 x6 x7 x8 x9")
+        for encoding in ENCODINGS:
+            self.assertEqual(self._count(lits, exactly_one(lits, encoding)), 10, encoding)
+        with self.assertRaises(ValueError):
+            at_most_k(lits, 2, "commander")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+"""DIMACS CNF input and output for the lab3 solvers.
+
+The DIMACS CNF format is the one of SAT competitions: an optional
+header `p cnf <variables> <clauses>`, comment lines starting with `c`,
+and clauses written as signed ints terminated by `0`, e.g.
+
+    c (p1 \\/ ~p3) /\\ ~p1
+    p cnf 3 2
+    1 -3 0
+    -1 0
+
+Files are read chunk by chunk straight into a `ClauseDB`, memory-mapped
+when uncompressed, so a problem never exists as `Prop` trees. Files
+ending in `.gz`, `.bz2` or `.xz` are (de)compressed on the fly.
+"""
+
+import bz2
+import gzip
+import lzma
+import mmap
+import os
+import sys
+import tempfile
+import unittest
+from typing import Iterator, List
+
+from dpll import ClauseDB, CdclEngine, Prop, flatten, cnf, nnf, ie, test_prop_2
+
+# the openers of compressed files, by extension
+OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def open_file(path: str, mode: str):
+    """Open `path`, (de)compressing it according to its extension, see `OPENERS`."""
+    return OPENERS.get(os.path.splitext(path)[1], open)(path, mode)
+
+
+def read_chunks(path: str, chunk_size: int) -> Iterator[bytes]:
+    """Yield the contents of `path` in chunks of whole lines."""
+    opener = OPENERS.get(os.path.splitext(path)[1])
+    with (opener or open)(path, "rb") as f:
+        if opener is not None:
+            source = f
+        elif os.fstat(f.fileno()).st_size > 0:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            return
+        with source:
+            rest = b""
+            while chunk := source.read(chunk_size):
+                chunk = rest + chunk
+                end = chunk.rfind(b"\n") + 1
+                rest = chunk[end:]
+                yield chunk[:end]
+            yield rest
+
+
+def read_dimacs(path: str, db: ClauseDB | None = None, chunk_size: int = 1 << 22) -> ClauseDB:
+    """Read the DIMACS CNF file `path` into a `ClauseDB`.
+
+    Parameters
+    ----------
+    path : str
+        The file to read, possibly compressed.
+    db : ClauseDB | None
+        The store to append the clauses to, a new one by default.
+    chunk_size : int
+        How many bytes to parse at a time.
+
+    Returns
+    -------
+    ClauseDB
+        The store, covering at least the variables declared in the header.
+
+    """
+    if db is None:
+        db = ClauseDB()
+    pending = []
+    for chunk in read_chunks(os.fspath(path), chunk_size):
+        done = False
+        if b"c" in chunk or b"p" in chunk or b"%" in chunk:
+            lines = []
+            for line in chunk.split(b"\n"):
+                head = line.lstrip()[:1]
+                if head == b"%":
+                    # the end marker of SATLIB benchmarks
+                    done = True
+                    break
+                if head == b"p":
+                    _, fmt, num_vars, _ = line.split()
+                    if fmt != b"cnf":
+                        raise ValueError(f"read_dimacs: not a CNF file: {line}")
+                    db.num_vars = max(db.num_vars, int(num_vars))
+                elif head != b"c":
+                    lines.append(line)
+            chunk = b"\n".join(lines)
+        pending += map(int, chunk.split())
+        start = 0
+        while True:
+            try:
+                end = pending.index(0, start)
+            except ValueError:
+                break
+            db.add_clause(pending[start:end])
+            start = end + 1
+        del pending[:start]
+        if done:
+            break
+    if pending:
+        db.add_clause(pending)
+    return db
+
+
+def write_dimacs(clauses: List[List[Prop]] | ClauseDB, path: str, batch: int = 1 << 12) -> ClauseDB:
+    """Write clauses to the DIMACS CNF file `path`.
+
+    Parameters
+    ----------
+    clauses : List[List[Prop]] | ClauseDB
+        Clauses generated by `flatten` method, or already numbered.
+    path : str
+        The file to write, compressed according to its extension.
+    batch : int
+        How many clauses to format per write.
+
+    Returns
+    -------
+    ClauseDB
+        The clauses written, whose `names` map variables back to atoms.
+
+    """
+    db = clauses if isinstance(clauses, ClauseDB) else ClauseDB.from_clauses(clauses)
+    with open_file(os.fspath(path), "wb") as f:
+        f.write(f"p cnf {db.num_vars} {len(db)}\n".encode())
+        lines = []
+        for clause in db:
+            lines.append(" ".join(map(str, clause)))
+            if len(lines) == batch:
+                f.write((" 0\n".join(lines) + " 0\n").encode())
+                lines.clear()
+        if lines:
+            f.write((" 0\n".join(lines) + " 0\n").encode())
+    return db
+
+
+class TestDimacs(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        clauses = flatten(cnf(nnf(ie(test_prop_2))))
+        for name in ("prop.cnf", "prop.cnf.gz", "prop.cnf.bz2", "prop.cnf.xz"):
+            path = os.path.join(self.dir.name, name)
+            names = write_dimacs(clauses, path).names
+            db = read_dimacs(path, chunk_size=5)
+            self.assertEqual(db.num_vars, 4)
+            self.assertEqual(db.lits.tolist(), [-1, -2, -1, 3, 4, -2, 4, 3])
+            self.assertEqual(db.offsets.tolist(), [0, 2, 4, 6, 8])
+            db.names = names
+            self.assertEqual(db.to_clauses(), clauses)
+
+    def test_read(self):
+        path = os.path.join(self.dir.name, "php.cnf")
+        with open(path, "w") as f:
+            f.write("c 3 pigeons, 2 holes\n"
+                    "p cnf 7 9\n"
+                    "1 2 0 3 4 0\n5\n6 0\n"
+                    "c no pigeon shares a hole\n"
+                    "-1 -3 0 -1 -5 0 -3 -5 0 -2 -4 0 -2 -6 0 -4 -6 0\n"
+                    "%\n0\n")
+        db = read_dimacs(path, chunk_size=16)
+        self.assertEqual(len(db), 9)
+        self.assertEqual(db.num_vars, 7)
+        self.assertEqual(db[2].tolist(), [5, 6])
+        engine = CdclEngine(db.num_vars)
+        for clause in db:
+            engine.add_clause(clause)
+        self.assertFalse(engine.solve())
+        self.assertEqual(len(read_dimacs(os.path.join(self.dir.name, "php.cnf"))), 9)
+        open(path, "w").close()
+        self.assertEqual(len(read_dimacs(path)), 0)
+
+
+if __name__ == '__main__':
+    # python dimacs.py <file.cnf> solves the file, printing the answer
+    # the way SAT competition solvers do; without arguments, run the tests
+    if len(sys.argv) < 2:
+        unittest.main()
+    db = read_dimacs(sys.argv[1])
+    engine = CdclEngine(db.num_vars)
+    for clause in db:
+        engine.add_clause(clause)
+    if engine.solve():
+        print("s SATISFIABLE")
+        print("v", *(v if engine.value[v] == 1 else -v for v in range(1, db.num_vars + 1)), 0)
+    else:
+        print("s UNSATISFIABLE")
@@ -1,7 +1,11 @@
 import unittest
-from typing import List
-from dataclasses import dataclass
-from functools import reduce
+from typing import Iterable, Iterator, List
+from array import array
+from collections import deque
+from contextlib import nullcontext
+from functools import partial, reduce
+import itertools
+import weakref
 from z3 import *
 
 # In this problem, you will implement the DPLL algorithm as discussed
@@ -21,73 +25,148 @@ P ::= p
 '''
 
 
-@dataclass
+# the live nodes, by (class, *fields); an entry goes away with its node
+_nodes = {}
+
+
+def _forget_node(key, ref):
+    if _nodes.get(key) is ref:
+        del _nodes[key]
+
+
 class Prop:
+    """Base class of propositions.
+
+    Nodes are hash-consed: building a node structurally equal to a live
+    one returns that very node, so a formula is a DAG sharing all its
+    equal subterms, equality is identity and the hash is computed once.
+    Nodes are immutable, and transforms cache their result per node in
+    `_memo` (see `_NodeMemo`).
+    """
+    __slots__ = ("_hash", "_memo", "__weakref__")
+    __match_args__ = ()
+
+    def __new__(cls, *args, **kwargs):
+        if kwargs:
+            args += tuple(kwargs.pop(name) for name in cls.__match_args__[len(args):]
+                          if name in kwargs)
+        key = (cls, *args)
+        ref = _nodes.get(key)
+        node = ref() if ref is not None else None
+        if node is None:
+            fields = cls.__match_args__
+            if len(args) != len(fields) or kwargs:
+                raise TypeError(f"{cls.__name__} expects fields {fields}, got {args} {kwargs}")
+            node = object.__new__(cls)
+            for name, arg in zip(fields, args):
+                object.__setattr__(node, name, arg)
+            object.__setattr__(node, "_hash", hash(key))
+            object.__setattr__(node, "_memo", None)
+            _nodes[key] = weakref.ref(node, partial(_forget_node, key))
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, name) for name in self.__match_args__)
+
     def __repr__(self):
         return self.__str__()
 
 
-@dataclass(repr=False)
 class PVar(Prop):
-    var: str
+    __slots__ = __match_args__ = ("var",)
 
     def __str__(self):
         return self.var
 
-    def __repr__(self):
-        return self.__str__()
-
-    def __hash__(self):
-        return hash(self.var)
-
 
-@dataclass(repr=False)
 class PTrue(Prop):
+    __slots__ = ()
+
     def __str__(self):
         return "True"
 
 
-@dataclass(repr=False)
 class PFalse(Prop):
+    __slots__ = ()
+
     def __str__(self):
         return "False"
 
 
-@dataclass(repr=False)
 class PAnd(Prop):
-    left: Prop
-    right: Prop
+    __slots__ = __match_args__ = ("left", "right")
 
     def __str__(self):
         return f"({self.left} /\\ {self.right})"
 
 
-@dataclass(repr=False)
 class POr(Prop):
-    left: Prop
-    right: Prop
+    __slots__ = __match_args__ = ("left", "right")
 
     def __str__(self):
         return f"({self.left} \\/ {self.right})"
 
 
-@dataclass(repr=False)
 class PImplies(Prop):
-    left: Prop
-    right: Prop
+    __slots__ = __match_args__ = ("left", "right")
 
     def __str__(self):
         return f"({self.left} -> {self.right})"
 
 
-@dataclass(repr=False)
 class PNot(Prop):
-    p: Prop
+    __slots__ = __match_args__ = ("p",)
 
     def __str__(self):
         return f"~{self.p}"
 
 
+class _NodeMemo:
+    """The cache of one transform, kept in the `_memo` of each node."""
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __contains__(self, node: Prop) -> bool:
+        return node._memo is not None and self.name in node._memo
+
+    def __getitem__(self, node: Prop) -> Prop:
+        return node._memo[self.name]
+
+    def __setitem__(self, node: Prop, result: Prop):
+        if node._memo is None:
+            object.__setattr__(node, "_memo", {})
+        node._memo[self.name] = result
+
+
+def _fold(root, expand, combine, cache):
+    """Compute `root` bottom-up with an explicit stack.
+
+    `expand(key)` lists the keys whose results `combine(key, results)`
+    needs. Results are stored in `cache`, so keys shared by several
+    parents are computed once and the depth of the input is unbounded.
+    """
+    stack = [(root, None)]
+    while stack:
+        key, subs = stack.pop()
+        if key in cache:
+            continue
+        if subs is None:
+            subs = expand(key)
+            stack.append((key, subs))
+            stack.extend((sub, None) for sub in reversed(subs))
+            continue
+        cache[key] = combine(key, [cache[sub] for sub in subs])
+    return cache[root]
+
+
 # Exercise 3-1: try to complete the `to_z3()` method to make
 # we can convert the above defined syntax into Z3's representation, so
 # that we can check it's validity easily:
@@ -111,6 +190,50 @@ def to_z3(prop: Prop) -> z3.BoolRef:
             raise NotImplementedError(f"to_z3: unknown prop: {prop}")
 
 
+def from_z3(expr: z3.BoolRef) -> Prop:
+    """Convert a propositional Z3 formula to a `Prop`, the inverse of `to_z3`.
+
+    N-ary conjunctions and disjunctions become balanced trees, and an
+    equality of formulas becomes implications both ways. Subterms are
+    converted once per Z3 AST id, with an explicit stack.
+    """
+    # by AST id, which stays unique while the expressions are kept here
+    exprs = {expr.get_id(): expr}
+
+    def expand(key: int) -> List[int]:
+        e = exprs[key]
+        if not is_bool(e):
+            raise NotImplementedError(f"from_z3: not a formula: {e}")
+        if is_true(e) or is_false(e) or is_const(e):
+            return []
+        children = e.children()
+        for child in children:
+            exprs.setdefault(child.get_id(), child)
+        return [child.get_id() for child in children]
+
+    def combine(key: int, args: List[Prop]) -> Prop:
+        e = exprs[key]
+        if is_true(e):
+            return PTrue()
+        if is_false(e):
+            return PFalse()
+        if is_const(e):
+            return PVar(str(e))
+        if is_not(e):
+            return PNot(args[0])
+        if is_and(e):
+            return _balanced(PAnd, args)
+        if is_or(e):
+            return _balanced(POr, args)
+        if is_implies(e):
+            return PImplies(*args)
+        if is_eq(e):
+            return PAnd(PImplies(*args), PImplies(*reversed(args)))
+        raise NotImplementedError(f"from_z3: unknown expr: {e}")
+
+    return _fold(expr.get_id(), expand, combine, {})
+
+
 #####################
 # Exercise 3-2: try to implement the `ie()` method to do the
 # implication elimination, as we've discussed in the class.
@@ -122,19 +245,31 @@ def to_z3(prop: Prop) -> z3.BoolRef:
 #   C(P->Q)   = ~C(P) \/ C(Q)
 
 def ie(prop: Prop) -> Prop:
-    match prop:
-        case PVar() | PTrue() | PFalse():
-            return prop
-        case PNot(p):
-            return PNot(ie(p))
-        case PAnd(left, right):
-            return PAnd(ie(left), ie(right))
-        case POr(left, right):
-            return POr(ie(left), ie(right))
-        case PImplies(left, right):
-            return POr(PNot(ie(left)), ie(right))
-        case _:
-            raise NotImplementedError(f"ie: unknown prop: {prop}")
+    def expand(p: Prop) -> tuple:
+        match p:
+            case PVar() | PTrue() | PFalse():
+                return ()
+            case PNot(q):
+                return (q,)
+            case PAnd(left, right) | POr(left, right) | PImplies(left, right):
+                return (left, right)
+            case _:
+                raise NotImplementedError(f"ie: unknown prop: {p}")
+
+    def combine(p: Prop, subs: List[Prop]) -> Prop:
+        match p:
+            case PVar() | PTrue() | PFalse():
+                return p
+            case PNot():
+                return PNot(subs[0])
+            case PAnd():
+                return PAnd(*subs)
+            case POr():
+                return POr(*subs)
+            case PImplies():
+                return POr(PNot(subs[0]), subs[1])
+
+    return _fold(prop, expand, combine, _NodeMemo("ie"))
 
 
 # Exercise 3-3: try to implement the `nnf()` method to convert the
@@ -148,28 +283,38 @@ def ie(prop: Prop) -> Prop:
 #   C(~(P/\Q)) = C(~P) \/ C(~Q)
 #   C(~(P\/Q)) = C(~P) /\ C(~Q)
 def nnf(prop_without_implies: Prop) -> Prop:
-    match prop_without_implies:
-        case PVar() | PTrue() | PFalse():
-            return prop_without_implies
-        case PNot(p):
-            match p:
-                case PNot(pp):
-                    return nnf(pp)
-                case PAnd(left, right):
-                    return POr(nnf(PNot(left)), nnf(PNot(right)))
-                case POr(left, right):
-                    return PAnd(nnf(PNot(left)), nnf(PNot(right)))
-                case _:
-                    return PNot(nnf(p))
-        case PAnd(left, right):
-            return PAnd(nnf(left), nnf(right))
-        case POr(left, right):
-            return POr(nnf(left), nnf(right))
-        case PImplies(left, right):
-            raise Exception(
-                "Proposition should not contain implication in NNF conversion")
-        case _:
-            raise NotImplementedError(f"nnf: unknown prop: {prop}")
+    def expand(p: Prop) -> tuple:
+        match p:
+            case PVar() | PTrue() | PFalse():
+                return ()
+            case PNot(PNot(pp)):
+                return (pp,)
+            case PNot(PAnd(left, right) | POr(left, right)):
+                return (PNot(left), PNot(right))
+            case PNot(q):
+                return (q,)
+            case PAnd(left, right) | POr(left, right):
+                return (left, right)
+            case PImplies():
+                raise Exception(
+                    "Proposition should not contain implication in NNF conversion")
+            case _:
+                raise NotImplementedError(f"nnf: unknown prop: {p}")
+
+    def combine(p: Prop, subs: List[Prop]) -> Prop:
+        match p:
+            case PVar() | PTrue() | PFalse():
+                return p
+            case PNot(PNot()):
+                return subs[0]
+            case PNot(PAnd()) | POr():
+                return POr(*subs)
+            case PNot(POr()) | PAnd():
+                return PAnd(*subs)
+            case PNot():
+                return PNot(subs[0])
+
+    return _fold(prop_without_implies, expand, combine, _NodeMemo("nnf"))
 
 
 # Exercise 3-4: try to implement the `cnf()` method to convert the
@@ -185,21 +330,176 @@ def nnf(prop_without_implies: Prop) -> Prop:
 #   D(P, Q)        = P \/ Q
 def cnf(nnf_prop: Prop) -> Prop:
     def cnf_d(left: Prop, right: Prop) -> Prop:
-        match (left, right):
-            case (PAnd(P1, P2), right):
-                return PAnd(cnf_d(P1, right), cnf_d(P2, right))
-            case (left, PAnd(Q1, Q2)):
-                return PAnd(cnf_d(left, Q1), cnf_d(left, Q2))
-            case _:
-                return POr(left, right)
+        def expand(pair: tuple) -> tuple:
+            match pair:
+                case (PAnd(P1, P2), right):
+                    return ((P1, right), (P2, right))
+                case (left, PAnd(Q1, Q2)):
+                    return ((left, Q1), (left, Q2))
+                case _:
+                    return ()
 
-    match nnf_prop:
-        case PAnd(left, right):
-            return PAnd(cnf(left), cnf(right))
-        case POr(left, right):
-            return cnf_d(cnf(left), cnf(right))
+        def combine(pair: tuple, subs: List[Prop]) -> Prop:
+            return PAnd(*subs) if subs else POr(*pair)
+
+        return _fold((left, right), expand, combine, {})
+
+    def expand(p: Prop) -> tuple:
+        match p:
+            case PAnd(left, right) | POr(left, right):
+                return (left, right)
+            case _:
+                return ()
+
+    def combine(p: Prop, subs: List[Prop]) -> Prop:
+        match p:
+            case PAnd():
+                return PAnd(*subs)
+            case POr():
+                return cnf_d(*subs)
+            case _:
+                return p
+
+    return _fold(nnf_prop, expand, combine, _NodeMemo("cnf"))
+
+
+def atoms(prop: Prop) -> List[str]:
+    """Names of the atoms in `prop`, in order of first occurrence."""
+    names = {}
+    # hash-consed nodes shared by several parents are visited once
+    seen = set()
+    stack = [prop]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        match node:
+            case PVar(var):
+                names[var] = None
+            case PNot(p):
+                stack.append(p)
+            case PAnd(left, right) | POr(left, right) | PImplies(left, right):
+                stack.append(right)
+                stack.append(left)
+    return list(names)
+
+
+def _negate(lit: Prop) -> Prop:
+    match lit:
+        case PNot(p):
+            return p
         case _:
-            return nnf_prop
+            return PNot(lit)
+
+
+def _balanced(op, props: List[Prop]) -> Prop:
+    """Join `props` with `op` into a tree of logarithmic depth."""
+    while len(props) > 1:
+        props = [op(props[i], props[i + 1]) if i + 1 < len(props) else props[i]
+                 for i in range(0, len(props), 2)]
+    return props[0]
+
+
+# Tseitin's conversion names every compound subformula x = A op B with
+# a fresh atom and only keeps the clauses that define it:
+#   x <-> A /\ B:  (~x \/ A) /\ (~x \/ B)        /\  (x \/ ~A \/ ~B)
+#   x <-> A \/ B:  (~x \/ A \/ B)               /\  (x \/ ~A) /\ (x \/ ~B)
+#   x <-> A -> B:  (~x \/ ~A \/ B)              /\  (x \/ A) /\ (x \/ ~B)
+# The left column is the "x -> A op B" half, the right one the
+# "A op B -> x" half. Plaisted-Greenbaum's variant only keeps the half
+# matching the polarity the subformula occurs with.
+def tseitin(prop: Prop, polarity: bool = False, fresh: Iterator[str] | None = None) -> Prop:
+    """Convert `prop` to an equisatisfiable CNF of linear size.
+
+    Unlike `cnf`, the result is not equivalent to `prop`: it mentions
+    fresh atoms named `_t0`, `_t1`, ... (skipping names used by `prop`),
+    but every model of it is a model of `prop` and vice versa once those
+    atoms are dropped. Implications need not be eliminated first, and a
+    subformula shared by several parents is only encoded once.
+
+    Parameters
+    ----------
+    prop : Prop
+        Any proposition.
+    polarity : bool
+        Use Plaisted-Greenbaum's polarity-aware encoding, which emits
+        only the defining clauses each subformula actually needs.
+    fresh : Iterator[str] | None
+        Where to take the names of the fresh atoms from instead.
+
+    Returns
+    -------
+    Prop
+        A conjunction of disjunctions of literals, which can be fed to
+        `flatten` directly.
+
+    """
+    if fresh is None:
+        taken = set(atoms(prop))
+        fresh = (name for name in (f"_t{i}" for i in itertools.count()) if name not in taken)
+    lits = {}
+    emitted = set()
+    clauses = []
+    # polarity 1: occurs positively, -1: negatively, 0: both
+    stack = [(prop, 1 if polarity else 0, False)]
+    while stack:
+        node, pol, expanded = stack.pop()
+        key = id(node)
+        signs = (1, -1) if pol == 0 else (pol,)
+        todo = [s for s in signs if (key, s) not in emitted]
+        if not todo:
+            continue
+        match node:
+            case PVar() | PTrue() | PFalse():
+                lits[key] = node
+                emitted.update((key, s) for s in signs)
+                continue
+            case PNot(p):
+                if not expanded:
+                    stack.append((node, pol, True))
+                    stack.append((p, -pol, False))
+                    continue
+                lits[key] = _negate(lits[id(p)])
+                emitted.update((key, s) for s in todo)
+                continue
+            case PAnd(left, right) | POr(left, right) | PImplies(left, right):
+                if not expanded:
+                    stack.append((node, pol, True))
+                    stack.append((right, pol, False))
+                    stack.append((left, -pol if isinstance(node, PImplies) else pol, False))
+                    continue
+            case _:
+                raise NotImplementedError(f"tseitin: unknown prop: {node}")
+        x = lits.get(key)
+        if x is None:
+            x = lits[key] = PVar(next(fresh))
+        a, b = lits[id(node.left)], lits[id(node.right)]
+        nx, na, nb = PNot(x), _negate(a), _negate(b)
+        for s in todo:
+            emitted.add((key, s))
+            match node, s:
+                case PAnd(), 1:
+                    clauses += [[nx, a], [nx, b]]
+                case PAnd(), -1:
+                    clauses.append([x, na, nb])
+                case POr(), 1:
+                    clauses.append([nx, a, b])
+                case POr(), -1:
+                    clauses += [[x, na], [x, nb]]
+                case PImplies(), 1:
+                    clauses.append([nx, na, b])
+                case PImplies(), -1:
+                    clauses += [[x, a], [x, nb]]
+    clauses.append([lits[id(prop)]])
+    return _balanced(PAnd, [_balanced(POr, c) for c in clauses])
+
+
+CNF_METHODS = {
+    "distribute": lambda prop: cnf(nnf(ie(prop))),
+    "tseitin": tseitin,
+    "pg": lambda prop: tseitin(prop, polarity=True),
+}
 
 
 def flatten(cnf_prop: Prop) -> List[List[Prop]]:
@@ -223,40 +523,1004 @@ def flatten(cnf_prop: Prop) -> List[List[Prop]]:
 
     """
 
-    def get_atom_from_disjunction(prop: Prop) -> List[Prop]:
-        match prop:
-            case POr(left, right):
-                return get_atom_from_disjunction(left) + get_atom_from_disjunction(right)
+    def get_atom_from_disjunction(prop: Prop, atoms: List[Prop]) -> List[Prop]:
+        stack = [prop]
+        while stack:
+            match stack.pop():
+                case POr(left, right):
+                    stack.append(right)
+                    stack.append(left)
+                case p:
+                    atoms.append(p)
+        return atoms
+
+    clauses = []
+    stack = [cnf_prop]
+    while stack:
+        match stack.pop():
+            case PAnd(left, right):
+                stack.append(right)
+                stack.append(left)
+            case POr() as p:
+                clauses.append(get_atom_from_disjunction(p, []))
+            case p:
+                clauses.append([p])
+    return clauses
+
+
+########################################
+# A native search engine for the flattened CNF.
+#
+# Variables are numbered from 1 and a literal is a signed int, as in
+# DIMACS: `v` stands for the variable and `-v` for its negation.
+# Per-literal tables are plain lists of length 2n+1 indexed by the
+# literal itself: Python's negative indexing puts `-v` at `2n+1-v`, so
+# `value[lit]` and `value[-lit]` never collide.
+
+class ClauseDB:
+    """Clauses of signed-int literals in compressed sparse row layout.
+
+    All literals sit back to back in the `array('i')` `lits`, and clause
+    `i` is `lits[offsets[i]:offsets[i + 1]]`. Atom names are interned
+    to variables: `names[v - 1]` is the name of variable `v`. This takes
+    4 bytes per literal and 8 per clause, against a list and a `Prop`
+    per literal for the output of `flatten`.
+    """
+
+    def __init__(self):
+        self.lits = array("i")
+        self.offsets = array("q", [0])
+        self.names = []
+        self.var_ids = {}
+        self.num_vars = 0
+
+    def var(self, name: str) -> int:
+        """The variable of atom `name`, numbering it if it is new."""
+        v = self.var_ids.get(name)
+        if v is None:
+            self.names.append(name)
+            v = self.var_ids[name] = self.num_vars = len(self.names)
+        return v
+
+    def name(self, v: int) -> str:
+        return self.names[v - 1] if v <= len(self.names) else f"x{v}"
+
+    def add_clause(self, lits: Iterable[int]):
+        self.lits.extend(lits)
+        self.offsets.append(len(self.lits))
+        start = self.offsets[-2]
+        if start < len(self.lits):
+            self.num_vars = max(self.num_vars, max(map(abs, self.lits[start:])))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> array:
+        return self.lits[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[array]:
+        lits, offsets = self.lits, self.offsets
+        for i in range(len(offsets) - 1):
+            yield lits[offsets[i]:offsets[i + 1]]
+
+    @classmethod
+    def from_clauses(cls, clauses: List[List[Prop]]) -> "ClauseDB":
+        """Number the atoms of flattened CNF clauses.
+
+        Constant literals are folded away: a clause containing `True` (or
+        `~False`) is dropped, `False` (or `~True`) is removed from its
+        clause. Duplicate literals are merged and tautological clauses are
+        dropped, but their atoms are still numbered so they show up in
+        models.
+
+        Parameters
+        ----------
+        clauses : List[List[Prop]]
+            Clauses generated by `flatten` method.
+
+        Returns
+        -------
+        ClauseDB
+            The clauses with every literal as a signed int.
+
+        """
+        db = cls()
+        for clause in clauses:
+            lits = {}
+            satisfied = False
+            for p in clause:
+                match p:
+                    case PTrue() | PNot(PFalse()):
+                        satisfied = True
+                        continue
+                    case PFalse() | PNot(PTrue()):
+                        continue
+                    case PVar(var):
+                        lits[db.var(var)] = None
+                    case PNot(PVar(var)):
+                        lits[-db.var(var)] = None
+                    case _:
+                        raise ValueError(f"ClauseDB: not a literal: {p}")
+            if satisfied or any(-lit in lits for lit in lits):
+                continue
+            db.add_clause(lits)
+        return db
+
+    def literal(self, lit: int) -> Prop:
+        var = PVar(self.name(abs(lit)))
+        return var if lit > 0 else PNot(var)
+
+    def to_clauses(self) -> List[List[Prop]]:
+        """The clauses in the form generated by `flatten` method."""
+        return [[self.literal(lit) for lit in clause] for clause in self]
+
+    def to_prop(self) -> Prop:
+        """The clauses as a CNF `Prop`, an empty clause being `False`."""
+        clauses = [_balanced(POr, [self.literal(lit) for lit in clause]) if clause else PFalse()
+                   for clause in self]
+        return _balanced(PAnd, clauses) if clauses else PTrue()
+
+
+def encode_clauses(clauses: List[List[Prop]]) -> tuple[list[str], list[list[int]]]:
+    """Number the atoms of flattened CNF clauses, see `ClauseDB.from_clauses`.
+
+    Returns
+    -------
+    tuple[list[str], list[list[int]]]
+        The atom names, where `names[v - 1]` is the name of variable `v`,
+        and the clauses as lists of signed ints.
+
+    """
+    db = ClauseDB.from_clauses(clauses)
+    return db.names, [clause.tolist() for clause in db]
+
+
+def luby(i: int) -> int:
+    """The `i`-th element, from 0, of the Luby sequence 1 1 2 1 1 2 4 1 1 2 ..."""
+    size, seq = 1, 0
+    while size < i + 1:
+        seq += 1
+        size = 2 * size + 1
+    while size - 1 != i:
+        size = (size - 1) >> 1
+        seq -= 1
+        i %= size
+    return 1 << seq
+
+
+class _VarHeap:
+    """Binary max-heap of variables ordered by their activity.
+
+    `index[v]` is the position of `v` in `heap`, or -1 when it is not in
+    the heap, so a variable whose activity grows can be moved up in
+    place.
+    """
+
+    def __init__(self, activity: List[float]):
+        self.activity = activity
+        self.heap = []
+        self.index = [-1]
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def grow(self, count: int):
+        self.index.extend([-1] * count)
+
+    def push(self, v: int):
+        if self.index[v] < 0:
+            self.heap.append(v)
+            self.index[v] = len(self.heap) - 1
+            self.increase(v)
+
+    def pop(self) -> int:
+        heap, index = self.heap, self.index
+        top = heap[0]
+        last = heap.pop()
+        index[top] = -1
+        if heap:
+            heap[0] = last
+            index[last] = 0
+            self._down(0)
+        return top
+
+    def increase(self, v: int):
+        """Restore the heap order after the activity of `v` grew."""
+        heap, index, activity = self.heap, self.index, self.activity
+        i = index[v]
+        if i < 0:
+            return
+        while i > 0:
+            parent = (i - 1) >> 1
+            if activity[heap[parent]] >= activity[v]:
+                break
+            heap[i] = heap[parent]
+            index[heap[i]] = i
+            i = parent
+        heap[i] = v
+        index[v] = i
+
+    def _down(self, i: int):
+        heap, index, activity = self.heap, self.index, self.activity
+        v = heap[i]
+        n = len(heap)
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and activity[heap[child + 1]] > activity[heap[child]]:
+                child += 1
+            if activity[heap[child]] <= activity[v]:
+                break
+            heap[i] = heap[child]
+            index[heap[i]] = i
+            i = child
+        heap[i] = v
+        index[v] = i
+
+
+# Decision heuristics:
+#   "static": the first free variable, in numbering order
+#   "vsids":  the free variable with the highest activity; activities are
+#             bumped by 1 for each conflict a variable takes part in, and
+#             all of them are halved every `vsids_period` conflicts
+#   "evsids": like "vsids", but the bump grows by 1/`var_decay` after
+#             each conflict instead, so older conflicts fade smoothly
+BRANCHING = ("static", "vsids", "evsids")
+
+
+class SatEngine:
+    """DPLL search over clauses of signed ints.
+
+    Every clause keeps its two watched literals in positions 0 and 1, so
+    unit propagation only visits the clauses watching the literal that
+    just became false. Pure literals are eliminated at the root, and
+    conflicts are resolved by chronological backtracking: the most recent
+    decision that has not been flipped yet is flipped.
+
+    The variable to branch on is chosen by the `branching` heuristic (see
+    `BRANCHING`), the variables of a conflicting clause counting as taking
+    part in the conflict. With `phase_saving`, a variable is decided with
+    the value it had when it was last unassigned, otherwise False.
+
+    When `proof` is set, e.g. to a `drat.DratWriter`, its `add` and
+    `delete` methods are called with every clause the engine derives or
+    drops, so that a False answer comes with a DRAT refutation: clauses
+    shortened by root assignments, pure literals (which are RAT), the
+    negated decisions of every conflict and the empty clause.
+    """
+
+    # eliminating pure literals is only sound if no clause comes later
+    pure_literals = True
+    var_decay = 0.95
+    vsids_period = 256
+
+    def __init__(self, num_vars: int = 0, branching: str = "evsids", phase_saving: bool = True):
+        if branching not in BRANCHING:
+            raise ValueError(f"unknown branching heuristic: {branching}")
+        self.branching = branching
+        self.phase_saving = phase_saving
+        self.activity = [0.0]
+        self.var_inc = 1.0
+        self.phase = [False]
+        self.order = _VarHeap(self.activity)
+        self.num_vars = 0
+        self.value = [0]
+        self.watches = [[]]
+        # indexed by variable: decision level and implying clause
+        self.level = [0]
+        self.reason = [None]
+        self.clauses = []
+        self.trail = []
+        self.qhead = 0
+        # one entry per decision level: (trail position, literal, flipped)
+        self.decisions = []
+        self.ok = True
+        self.proof = None
+        self.stats = {"branching": branching, "phase_saving": phase_saving,
+                      "decisions": 0, "propagations": 0, "conflicts": 0}
+        self.new_vars(num_vars)
+
+    def new_vars(self, count: int):
+        """Add `count` fresh variables, numbered after the existing ones."""
+        n = self.num_vars + 1
+        # keep `-v` at index `len - v` for every variable
+        self.value[n:n] = [0] * (2 * count)
+        self.watches[n:n] = [[] for _ in range(2 * count)]
+        self.level.extend([0] * count)
+        self.reason.extend([None] * count)
+        self.activity.extend([0.0] * count)
+        self.phase.extend([False] * count)
+        self.order.grow(count)
+        for v in range(n, n + count):
+            self.order.push(v)
+        self.num_vars += count
+
+    def add_clause(self, lits: List[int]):
+        """Add a clause at the root level, simplifying it on the way."""
+        self._cancel_until(0)
+        if not self.ok:
+            return
+        value = self.value
+        clause = []
+        shortened = False
+        # its keys find tautologies in linear time
+        lits = dict.fromkeys(lits)
+        for lit in lits:
+            if -lit in lits or value[lit] == 1:
+                return
+            if value[lit] == 0:
+                clause.append(lit)
+            else:
+                shortened = True
+        if shortened and self.proof is not None:
+            self.proof.add(clause)
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            self._assign(clause[0])
+            if self.propagate() is not None:
+                self._refuted()
+        else:
+            self.clauses.append(clause)
+            self.watches[clause[0]].append(clause)
+            self.watches[clause[1]].append(clause)
+
+    def _assign(self, lit: int, reason: List[int] | None = None):
+        self.value[lit] = 1
+        self.value[-lit] = -1
+        self.level[abs(lit)] = len(self.decisions)
+        self.reason[abs(lit)] = reason
+        self.trail.append(lit)
+
+    def _undo_to(self, pos: int):
+        value, phase, order = self.value, self.phase, self.order
+        for lit in self.trail[pos:]:
+            value[lit] = value[-lit] = 0
+            if self.phase_saving:
+                phase[abs(lit)] = lit > 0
+            order.push(abs(lit))
+        del self.trail[pos:]
+        self.qhead = pos
+
+    def _cancel_until(self, level: int):
+        if len(self.decisions) > level:
+            self._undo_to(self.decisions[level][0])
+            del self.decisions[level:]
+
+    def propagate(self) -> List[int] | None:
+        """Run unit propagation, return the conflicting clause if any."""
+        value = self.value
+        watches = self.watches
+        trail = self.trail
+        while self.qhead < len(trail):
+            false_lit = -trail[self.qhead]
+            self.qhead += 1
+            self.stats["propagations"] += 1
+            ws = watches[false_lit]
+            i = j = 0
+            n = len(ws)
+            while i < n:
+                c = ws[i]
+                i += 1
+                if c[0] == false_lit:
+                    c[0], c[1] = c[1], false_lit
+                first = c[0]
+                if value[first] == 1:
+                    ws[j] = c
+                    j += 1
+                    continue
+                for k in range(2, len(c)):
+                    if value[c[k]] != -1:
+                        c[1], c[k] = c[k], false_lit
+                        watches[c[1]].append(c)
+                        break
+                else:
+                    ws[j] = c
+                    j += 1
+                    if value[first] == -1:
+                        ws[j:] = ws[i:n]
+                        self.qhead = len(trail)
+                        return c
+                    self._assign(first, c)
+            del ws[j:]
+        return None
+
+    def _eliminate_pure(self):
+        """Assign literals occurring with one polarity only, until fixpoint."""
+        value = self.value
+        while True:
+            seen = set()
+            for c in self.clauses:
+                if any(value[lit] == 1 for lit in c):
+                    continue
+                seen.update(lit for lit in c if value[lit] == 0)
+            pure = [lit for lit in seen if -lit not in seen]
+            if not pure:
+                return
+            for lit in pure:
+                if self.proof is not None:
+                    self.proof.add([lit])
+                self._assign(lit)
+            self.propagate()
+
+    def _bump_var(self, v: int):
+        activity = self.activity
+        activity[v] += self.var_inc
+        if activity[v] > 1e100:
+            for u in range(1, self.num_vars + 1):
+                activity[u] *= 1e-100
+            self.var_inc *= 1e-100
+        self.order.increase(v)
+
+    def _decay_vars(self):
+        if self.branching == "evsids":
+            self.var_inc /= self.var_decay
+        elif self.stats["conflicts"] % self.vsids_period == 0:
+            # halving keeps the order, so the heap stays valid
+            activity = self.activity
+            for v in range(1, self.num_vars + 1):
+                activity[v] *= 0.5
+
+    def _pick_branch(self) -> int:
+        value = self.value
+        if self.branching == "static":
+            v = next((v for v in range(1, self.num_vars + 1) if value[v] == 0), 0)
+        else:
+            order = self.order
+            v = 0
+            while order:
+                v = order.pop()
+                if value[v] == 0:
+                    break
+                v = 0
+        if v == 0:
+            return 0
+        return v if self.phase[v] else -v
+
+    def probe(self, lits: List[int]) -> int | None:
+        """Count the assignments implied by `lits` on top of the root.
+
+        The literals are decided in turn, each one followed by unit
+        propagation; None if that runs into a conflict. The engine is
+        back at the root afterwards.
+        """
+        self._cancel_until(0)
+        if not self.ok or self.propagate() is not None:
+            self.ok = False
+            return None
+        start = len(self.trail)
+        value = self.value
+        count = None
+        for lit in lits:
+            if value[lit] == -1:
+                break
+            if value[lit] == 0:
+                self.decisions.append((len(self.trail), lit, False))
+                self._assign(lit)
+                if self.propagate() is not None:
+                    break
+        else:
+            count = len(self.trail) - start
+        self._cancel_until(0)
+        return count
+
+    def _refuted(self):
+        """Record that the clauses are unsatisfiable."""
+        self.ok = False
+        if self.proof is not None:
+            self.proof.add([])
+
+    def solve(self) -> bool:
+        """Search for a model, return whether one exists.
+
+        On success `value[v]` holds the value of every variable `v`.
+        """
+        self._cancel_until(0)
+        if not self.ok or self.propagate() is not None:
+            self._refuted()
+            return False
+        if self.pure_literals:
+            self._eliminate_pure()
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                self.stats["conflicts"] += 1
+                if self.proof is not None:
+                    # the open decisions lead to a conflict, whereas the
+                    # flipped ones follow from the earlier such clauses
+                    self.proof.add([-lit for _, lit, flipped in self.decisions if not flipped])
+                for lit in conflict:
+                    self._bump_var(abs(lit))
+                self._decay_vars()
+                while self.decisions and self.decisions[-1][2]:
+                    self._undo_to(self.decisions.pop()[0])
+                if not self.decisions:
+                    self.ok = False
+                    return False
+                pos, lit, _ = self.decisions.pop()
+                self._undo_to(pos)
+                self.decisions.append((pos, -lit, True))
+                self._assign(-lit)
+                continue
+            lit = self._pick_branch()
+            if lit == 0:
+                return True
+            self.stats["decisions"] += 1
+            self.decisions.append((len(self.trail), lit, False))
+            self._assign(lit)
+
+
+# Restart policies:
+#   "none":    never restart
+#   "luby":    restart after `restart_unit` times the next element of the
+#              Luby sequence conflicts
+#   "glucose": restart when the literal block distance (the number of
+#              decision levels) of the last `lbd_window` learned clauses
+#              is, on average, worse than the overall one by more than
+#              the `lbd_margin` factor
+RESTARTS = ("none", "luby", "glucose")
+
+
+class _Learnt(list):
+    """A learned clause, carrying its activity for clause deletion."""
+    __slots__ = ("activity",)
+
+    def __init__(self, lits, activity=0.0):
+        super().__init__(lits)
+        self.activity = activity
+
+
+class CdclEngine(SatEngine):
+    """Conflict-driven clause learning on top of `SatEngine`.
+
+    A conflict is analyzed back to its first unique implication point,
+    the learned clause is minimized by dropping literals implied by the
+    rest of it, and the search backjumps to the second highest level of
+    the learned clause. Learned clauses are bumped when they take part in
+    a conflict; when there are too many of them, the less active half is
+    deleted.
+
+    Learned clauses follow from the clauses alone, so they are kept
+    from one `solve` to the next, and clauses can be added in between.
+    Assumptions are decided first, one decision level each; when the
+    clauses contradict them, `failed` lists the assumptions to blame.
+    Pure literals are not eliminated, as a clause or an assumption may
+    still contradict them.
+
+    The variables met during conflict analysis are the ones taking part
+    in a conflict for the `branching` heuristic. The search restarts
+    from the root according to the `restarts` policy (see `RESTARTS`),
+    keeping what it learned.
+    """
+
+    pure_literals = False
+    clause_decay = 0.999
+    learnts_growth = 1.1
+    restart_unit = 100
+    lbd_window = 50
+    lbd_margin = 0.8
+
+    def __init__(self, num_vars: int = 0, branching: str = "evsids",
+                 phase_saving: bool = True, restarts: str = "luby"):
+        if restarts not in RESTARTS:
+            raise ValueError(f"unknown restart policy: {restarts}")
+        self.seen = [False]
+        super().__init__(num_vars, branching, phase_saving)
+        self.restarts = restarts
+        self.learnts = []
+        self.clause_inc = 1.0
+        self.max_learnts = 0.0
+        self.failed = []
+        # conflicts since the last restart, recent LBDs and the LBD total
+        self.restart_conflicts = 0
+        self.recent_lbds = deque(maxlen=self.lbd_window)
+        self.lbd_total = 0
+        self.stats.update(restart_policy=restarts, restarts=0,
+                          learned=0, deleted=0, minimized=0)
+
+    def new_vars(self, count: int):
+        super().new_vars(count)
+        self.seen.extend([False] * count)
+
+    def _bump_clause(self, clause: _Learnt):
+        clause.activity += self.clause_inc
+        if clause.activity > 1e20:
+            for c in self.learnts:
+                c.activity *= 1e-20
+            self.clause_inc *= 1e-20
+
+    def _analyze(self, conflict: List[int]) -> tuple[List[int], int]:
+        """Derive the 1-UIP clause of `conflict` and its backjump level."""
+        seen, level, reason, trail = self.seen, self.level, self.reason, self.trail
+        current = len(self.decisions)
+        learnt = [0]
+        pending = 0
+        p = 0
+        idx = len(trail) - 1
+        clause = conflict
+        while True:
+            if isinstance(clause, _Learnt):
+                self._bump_clause(clause)
+            for q in (clause if p == 0 else clause[1:]):
+                v = abs(q)
+                if not seen[v] and level[v] > 0:
+                    seen[v] = True
+                    self._bump_var(v)
+                    if level[v] >= current:
+                        pending += 1
+                    else:
+                        learnt.append(q)
+            while not seen[abs(trail[idx])]:
+                idx -= 1
+            p = trail[idx]
+            idx -= 1
+            clause = reason[abs(p)]
+            seen[abs(p)] = False
+            pending -= 1
+            if pending == 0:
+                break
+        learnt[0] = -p
+
+        size = len(learnt)
+        to_clear = [abs(q) for q in learnt[1:]]
+        levels = 0
+        for q in learnt[1:]:
+            levels |= 1 << (level[abs(q)] & 63)
+        learnt[1:] = [q for q in learnt[1:]
+                      if reason[abs(q)] is None
+                      or not self._redundant(q, levels, to_clear)]
+        self.stats["minimized"] += size - len(learnt)
+        for v in to_clear:
+            seen[v] = False
+
+        if len(learnt) == 1:
+            return learnt, 0
+        top = max(range(1, len(learnt)), key=lambda i: level[abs(learnt[i])])
+        learnt[1], learnt[top] = learnt[top], learnt[1]
+        return learnt, level[abs(learnt[1])]
+
+    def _redundant(self, lit: int, levels: int, to_clear: List[int]) -> bool:
+        """Whether `lit` is implied by the other literals of the learned clause.
+
+        `levels` is a bitmask of the decision levels in the learned clause:
+        a literal from any other level cannot be implied by it.
+        """
+        seen, level, reason = self.seen, self.level, self.reason
+        top = len(to_clear)
+        stack = [lit]
+        while stack:
+            for q in reason[abs(stack.pop())][1:]:
+                v = abs(q)
+                if seen[v] or level[v] == 0:
+                    continue
+                if reason[v] is not None and levels >> (level[v] & 63) & 1:
+                    seen[v] = True
+                    stack.append(q)
+                    to_clear.append(v)
+                else:
+                    for u in to_clear[top:]:
+                        seen[u] = False
+                    del to_clear[top:]
+                    return False
+        return True
+
+    def _learn(self, lits: List[int]):
+        self.stats["learned"] += 1
+        if self.proof is not None:
+            self.proof.add(lits)
+        if len(lits) == 1:
+            self._assign(lits[0])
+            return
+        clause = _Learnt(lits, self.clause_inc)
+        self.learnts.append(clause)
+        self.watches[clause[0]].append(clause)
+        self.watches[clause[1]].append(clause)
+        self._assign(clause[0], clause)
+
+    def _reduce_db(self):
+        """Delete the less active half of the learned clauses.
+
+        Binary clauses and clauses that are the reason of a current
+        assignment are kept.
+        """
+        value, reason = self.value, self.reason
+        self.learnts.sort(key=lambda c: c.activity)
+        half = len(self.learnts) // 2
+        keep, drop = [], []
+        for i, c in enumerate(self.learnts):
+            locked = value[c[0]] == 1 and reason[abs(c[0])] is c
+            if i < half and len(c) > 2 and not locked:
+                drop.append(c)
+            else:
+                keep.append(c)
+        for c in drop:
+            if self.proof is not None:
+                self.proof.delete(c)
+            for lit in (c[0], c[1]):
+                ws = self.watches[lit]
+                ws[:] = [w for w in ws if w is not c]
+        self.learnts = keep
+        self.stats["deleted"] += len(drop)
+
+    def _analyze_final(self, lit: int) -> List[int]:
+        """The assumptions that make the assumption `lit` false."""
+        seen, reason, level = self.seen, self.reason, self.level
+        failed = [lit]
+        if level[abs(lit)] == 0:
+            return failed
+        seen[abs(lit)] = True
+        for q in reversed(self.trail[self.decisions[0][0]:]):
+            v = abs(q)
+            if not seen[v]:
+                continue
+            seen[v] = False
+            if reason[v] is None:
+                failed.append(q)
+            else:
+                for r in reason[v][1:]:
+                    if level[abs(r)] > 0:
+                        seen[abs(r)] = True
+        return failed
+
+    def _restart_due(self, learnt: List[int]) -> bool:
+        """Account for a new learned clause, tell whether to restart now."""
+        self.restart_conflicts += 1
+        match self.restarts:
+            case "luby":
+                return self.restart_conflicts >= luby(self.stats["restarts"]) * self.restart_unit
+            case "glucose":
+                level = self.level
+                lbd = len({level[abs(lit)] for lit in learnt})
+                self.recent_lbds.append(lbd)
+                self.lbd_total += lbd
+                return (len(self.recent_lbds) == self.lbd_window
+                        and sum(self.recent_lbds) / self.lbd_window * self.lbd_margin
+                        > self.lbd_total / self.stats["conflicts"])
+        return False
+
+    def _restart(self):
+        """Go back to the root, keeping the learned clauses."""
+        self.stats["restarts"] += 1
+        self.restart_conflicts = 0
+        self.recent_lbds.clear()
+        self._cancel_until(0)
+
+    def solve(self, assumptions: List[int] = ()) -> bool:
+        """Search for a model where all `assumptions` hold.
+
+        On success `value[v]` holds the value of every variable `v`. An
+        answer of False only holds under the assumptions if `failed` is
+        not empty, otherwise the clauses themselves are unsatisfiable.
+        """
+        self._cancel_until(0)
+        self.failed = []
+        if not self.ok or self.propagate() is not None:
+            self._refuted()
+            return False
+        if self.pure_literals:
+            self._eliminate_pure()
+        self.max_learnts = max(self.max_learnts, len(self.clauses) / 3, 100)
+        value = self.value
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                self.stats["conflicts"] += 1
+                if not self.decisions:
+                    self._refuted()
+                    return False
+                learnt, backjump = self._analyze(conflict)
+                restart = self._restart_due(learnt)
+                self._cancel_until(backjump)
+                self._learn(learnt)
+                self.clause_inc /= self.clause_decay
+                self._decay_vars()
+                if restart:
+                    self._restart()
+                    if not self.ok:
+                        return False
+                continue
+            if len(self.learnts) - len(self.trail) >= self.max_learnts:
+                self._reduce_db()
+                self.max_learnts *= self.learnts_growth
+            lit = 0
+            while len(self.decisions) < len(assumptions):
+                lit = assumptions[len(self.decisions)]
+                if value[lit] == 0:
+                    break
+                if value[lit] == -1:
+                    self.failed = self._analyze_final(lit)
+                    return False
+                # already holds: open an empty level to keep them aligned
+                self.decisions.append((len(self.trail), lit, False))
+                lit = 0
+            if lit == 0:
+                lit = self._pick_branch()
+                if lit == 0:
+                    return True
+            self.stats["decisions"] += 1
+            self.decisions.append((len(self.trail), lit, False))
+            self._assign(lit)
+
+
+ENGINES = {"dpll": SatEngine, "cdcl": CdclEngine}
+
+
+def dpll(prop: Prop, mode: str = "dpll", cnf_method: str = "distribute",
+         preprocess: bool = False, proof: str | None = None, stats: dict | None = None,
+         **options) -> dict | str:
+    """Decide the satisfiability of `prop` with the native search engine.
+
+    `mode` selects the engine from `ENGINES`: "dpll" for chronological
+    backtracking, "cdcl" for conflict-driven clause learning.
+    `cnf_method` selects the conversion from `CNF_METHODS`: "distribute"
+    for the equivalent `cnf`, "tseitin" or "pg" for the linear-size
+    equisatisfiable `tseitin`. With `preprocess`, the clauses are
+    simplified by `preprocess.Preprocessor` before the search. With
+    `proof`, a binary DRAT proof of an "unsat" answer is written to that
+    file, for `drat.check_proof` and the clauses of `cnf_clauses(prop,
+    cnf_method)`. With `stats`, a dict, the counters of the search,
+    e.g. "decisions", "conflicts" and for "cdcl" "restarts" and
+    "learned", are stored in it, with those of the preprocessor. Other
+    options go to the engine, e.g. `branching` or, for "cdcl",
+    `restarts`.
+
+    Returns a model like {"p1": True, "p2": False} if there is one,
+    otherwise the string "unsat".
+    """
+    db = cnf_clauses(prop, cnf_method)
+    clauses = db
+    writer = None
+    if proof is not None:
+        from drat import DratWriter
+        writer = DratWriter(proof)
+    with writer or nullcontext():
+        if preprocess:
+            from preprocess import Preprocessor
+            pre = Preprocessor(db.num_vars)
+            pre.proof = writer
+            for clause in db:
+                pre.add_clause(clause)
+            ok = pre.run()
+            if stats is not None:
+                stats.update(pre.stats)
+            if not ok:
+                return "unsat"
+            clauses = pre.remaining()
+        engine = ENGINES[mode](db.num_vars, **options)
+        engine.proof = writer
+        for clause in clauses:
+            engine.add_clause(clause)
+        ok = engine.solve()
+        if stats is not None:
+            stats.update(engine.stats)
+        if not ok:
+            return "unsat"
+    model = [engine.value[v] == 1 for v in range(db.num_vars + 1)]
+    if preprocess:
+        pre.extend_model(model)
+    return {name: model[db.var_ids[name]] if name in db.var_ids else False
+            for name in atoms(prop)}
+
+
+def cnf_clauses(prop: Prop, cnf_method: str = "distribute") -> ClauseDB:
+    """The numbered clauses `dpll` solves for `prop`, see `CNF_METHODS`."""
+    return ClauseDB.from_clauses(flatten(CNF_METHODS[cnf_method](prop)))
+
+
+class PropSolver:
+    """Incremental satisfiability checks over a growing set of propositions.
+
+    Propositions are converted to clauses as they are added and kept by
+    one `CdclEngine`, so related queries share the propagation of the
+    base formula and every clause learned so far. `push` opens a scope
+    whose propositions `pop` retracts: each scope has a selector atom,
+    its clauses are added as `~selector \\/ clause`, and the selectors of
+    open scopes are assumed while solving. Popping asserts `~selector`,
+    which also disables the learned clauses that depended on the scope.
+    """
+
+    def __init__(self, cnf_method: str = "tseitin", **options):
+        self.engine = CdclEngine(**options)
+        self.cnf_method = cnf_method
+        self.var_ids = {}
+        self.names = []
+        self.scopes = []
+        # variables introduced by the solver, hidden from models: they
+        # are not in `var_ids`, so a user atom never resolves to one
+        self.hidden = set()
+        self.failed = []
+        self._fresh = (name for name in (f"_s{i}" for i in itertools.count())
+                       if name not in self.var_ids)
+
+    def _new_var(self, name: str) -> int:
+        self.engine.new_vars(1)
+        self.names.append(name)
+        return len(self.names)
+
+    def _var(self, name: str) -> int:
+        v = self.var_ids.get(name)
+        if v is None:
+            v = self.var_ids[name] = self._new_var(name)
+        return v
+
+    def _literal(self, lit: Prop, fresh: dict | None = None) -> int:
+        fresh = fresh or {}
+        match lit:
+            case PVar(var):
+                return fresh.get(var) or self._var(var)
+            case PNot(PVar(var)):
+                return -(fresh.get(var) or self._var(var))
             case _:
-                return [prop]
+                raise ValueError(f"PropSolver: not a literal: {lit}")
+
+    def _new_atom(self, fresh: dict) -> str:
+        name = next(self._fresh)
+        v = fresh[name] = self._new_var(name)
+        self.hidden.add(v)
+        return name
+
+    def add_clause(self, clause: List[Prop], fresh: dict | None = None):
+        """Add a clause in the form generated by `flatten` method.
+
+        `fresh` maps the names of the atoms introduced while converting
+        a proposition to their variables.
+        """
+        lits = []
+        for p in clause:
+            match p:
+                case PTrue() | PNot(PFalse()):
+                    return
+                case PFalse() | PNot(PTrue()):
+                    continue
+            lits.append(self._literal(p, fresh))
+        if self.scopes:
+            lits.append(-self.scopes[-1])
+        self.engine.add_clause(lits)
+
+    def add(self, prop: Prop):
+        """Add a proposition, converted by `cnf_method` as in `dpll`."""
+        # the atoms of `prop` are registered first, so that the names of
+        # the fresh atoms skip them
+        for name in atoms(prop):
+            self._var(name)
+        fresh = {}
+        match self.cnf_method:
+            case "tseitin" | "pg":
+                cnf_prop = tseitin(prop, self.cnf_method == "pg",
+                                   iter(lambda: self._new_atom(fresh), None))
+            case method:
+                cnf_prop = CNF_METHODS[method](prop)
+        for clause in flatten(cnf_prop):
+            self.add_clause(clause, fresh)
+
+    def push(self):
+        v = self._new_var(next(self._fresh))
+        self.hidden.add(v)
+        self.scopes.append(v)
+
+    def pop(self):
+        self.engine.add_clause([-self.scopes.pop()])
+
+    def solve(self, assumptions: List[Prop] = ()) -> bool:
+        """Check the propositions added so far, under `assumptions`.
+
+        Assumptions are literals holding for this call only. When the
+        answer is False because of them, `failed` lists the assumptions
+        that cannot hold together.
+        """
+        lits = [self._literal(lit) for lit in assumptions]
+        result = self.engine.solve(self.scopes + lits)
+        failed = set(self.engine.failed)
+        self.failed = [lit for lit, v in zip(assumptions, lits) if v in failed]
+        return result
+
+    def model(self) -> dict:
+        """The model found by the last successful `solve`."""
+        value = self.engine.value
+        return {name: value[v] == 1 for v, name in enumerate(self.names, 1)
+                if v not in self.hidden}
 
-    match cnf_prop:
-        case PAnd(left, right):
-            return flatten(left) + flatten(right)
-        case POr():
-            return [get_atom_from_disjunction(cnf_prop)]
-        case _:
-            return [[cnf_prop]]
-
-
-def dpll(prop: Prop) -> dict:
-    # Challenge: implement the dpll algorithm we've discussed in the lecture
-    # you can deal with flattened cnf which generated by `flatten` method for convenience,
-    # or, as another choice, you can process the original cnf destructure generated by `cnf` method
-    #
-    # your implementation should output the result as dict like :
-    # {"p1": True, "p2": False, "p3": False, "p4": True} if there is solution;
-    # output "unsat" if there is no solution
-    #
-    # feel free to add new method.
-    return {
-        str(p.children()[0]) if is_not(p) else str(p): not is_not(p)
-        for p in reduce(
-            lambda a, b: a+b,
-            [list(map(lambda x: to_z3(x), ps))
-             for ps in flatten(cnf(nnf(ie(prop))))],
-        )
-    }
 
 #####################
 # test cases:
@@ -281,6 +1545,26 @@ class TestDpll(unittest.TestCase):
         self.assertEqual(str(to_z3(test_prop_2)),
                          "Not(And(Or(p1, Not(p2)), Or(p3, Not(p4))))")
 
+    def test_from_z3(self):
+        for prop in (test_prop_1, test_prop_2):
+            self.assertEqual(from_z3(to_z3(prop)), prop)
+        a, b, c = Bools("a b c")
+        self.assertEqual(str(from_z3(And(a, Or(a, b, c), a == Not(b)))),
+                         "((a /\\ ((a \\/ b) \\/ c)) /\\ ((a -> ~b) /\\ (~b -> a)))")
+        # a chain like the one of monster.py, and a DAG of 2 ** 40 paths
+        chain = BoolVal(True)
+        for i in range(3000):
+            chain = And(chain, Bool(f"b_{i}"))
+        self.assertEqual(len(atoms(from_z3(chain))), 3000)
+        dag = a
+        for _ in range(40):
+            dag = Or(And(dag, b), And(c, dag))
+        self.assertEqual(atoms(from_z3(dag)), ["a", "b", "c"])
+        x = Int("x")
+        for expr in (x == 1, And(a, x > 0)):
+            with self.assertRaises(NotImplementedError):
+                from_z3(expr)
+
     def test_ie_1(self):
         self.assertEqual(str(ie(test_prop_1)), "(~p \\/ (~q \\/ p))")
 
@@ -324,6 +1608,181 @@ class TestDpll(unittest.TestCase):
             Not(Not(And(Or(res["p1"], Not(res["p2"])), Or(res["p3"], Not(res["p4"]))))))
         self.assertEqual(str(s.check()), "unsat")
 
+    def test_dpll_unsat(self):
+        # (p \/ q) /\ (p \/ ~q) /\ (~p \/ q) /\ (~p \/ ~q)
+        p, q = PVar("p"), PVar("q")
+        prop = PAnd(PAnd(POr(p, q), POr(p, PNot(q))),
+                    PAnd(POr(PNot(p), q), POr(PNot(p), PNot(q))))
+        self.assertEqual(dpll(prop), "unsat")
+        self.assertEqual(dpll(PAnd(p, PNot(p))), "unsat")
+
+    def test_dpll_backtrack(self):
+        # p -> q, q -> r and r -> ~p force ~p, then p \/ q forces q and r
+        p, q, r = PVar("p"), PVar("q"), PVar("r")
+        prop = PAnd(PAnd(PImplies(p, q), PImplies(q, r)),
+                    PAnd(PImplies(r, PNot(p)), POr(p, q)))
+        res = dpll(prop)
+        self.assertEqual(set(res), {"p", "q", "r"})
+        self.assertFalse(res["p"])
+        self.assertTrue(res["q"] and res["r"])
+
+    def test_dpll_cdcl(self):
+        # 3 pigeons do not fit in 2 holes: h_i_j means pigeon i in hole j
+        h = [[PVar(f"h_{i}_{j}") for j in range(2)] for i in range(3)]
+        prop = reduce(PAnd, [POr(h[i][0], h[i][1]) for i in range(3)])
+        for j in range(2):
+            for i in range(3):
+                for k in range(i):
+                    prop = PAnd(prop, POr(PNot(h[i][j]), PNot(h[k][j])))
+        stats = {}
+        self.assertEqual(dpll(prop, mode="cdcl", stats=stats), "unsat")
+        self.assertGreater(stats["conflicts"], 0)
+        self.assertGreater(stats["learned"], 0)
+        self.assertEqual(stats["restarts"], 0)
+        stats = {}
+        self.assertEqual(dpll(prop, stats=stats), "unsat")
+        self.assertGreater(stats["decisions"], 0)
+        self.assertNotIn("learned", stats)
+        stats = {}
+        self.assertEqual(dpll(prop, mode="cdcl", preprocess=True, stats=stats), "unsat")
+        self.assertEqual(stats["clauses_before"], 9)
+        res = dpll(test_prop_2, mode="cdcl")
+        self.assertTrue(not (res["p1"] or not res["p2"])
+                        or not (res["p3"] or not res["p4"]))
+
+    def test_heuristics(self):
+        self.assertEqual([luby(i) for i in range(15)],
+                         [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8])
+        # 6 queens, q_i_j meaning a queen on row i and column j
+        n = 6
+        q = [[PVar(f"q_{i}_{j}") for j in range(n)] for i in range(n)]
+        clauses = [reduce(POr, row) for row in q]
+        for i1, j1, i2, j2 in itertools.product(range(n), repeat=4):
+            if (i1, j1) < (i2, j2) and (i1 == i2 or j1 == j2 or abs(i1 - i2) == abs(j1 - j2)):
+                clauses.append(POr(PNot(q[i1][j1]), PNot(q[i2][j2])))
+        prop = reduce(PAnd, clauses)
+        for branching in BRANCHING:
+            for phase_saving in (False, True):
+                res = dpll(prop, branching=branching, phase_saving=phase_saving)
+                self.assertEqual(sum(res.values()), n)
+                for restarts in RESTARTS:
+                    engine = CdclEngine(n * n, branching, phase_saving, restarts)
+                    engine.restart_unit = 1
+                    engine.lbd_window = 2
+                    for clause in ClauseDB.from_clauses(flatten(prop)):
+                        engine.add_clause(clause)
+                    self.assertTrue(engine.solve())
+                    self.assertEqual(sum(v == 1 for v in engine.value[1:n * n + 1]), n)
+                    self.assertEqual(engine.stats["restart_policy"], restarts)
+
+    def test_tseitin(self):
+        # (a0 /\ b0) \/ ... \/ (a19 /\ b19) distributes to 2^20 clauses
+        prop = reduce(POr, [PAnd(PVar(f"a{i}"), PVar(f"b{i}")) for i in range(20)])
+        self.assertEqual(len(flatten(tseitin(prop))), 3 * 20 + 3 * 19 + 1)
+        self.assertEqual(len(flatten(tseitin(prop, polarity=True))), 2 * 20 + 19 + 1)
+        for method in ("tseitin", "pg"):
+            res = dpll(prop, cnf_method=method)
+            self.assertEqual(len(res), 40)
+            self.assertTrue(any(res[f"a{i}"] and res[f"b{i}"] for i in range(20)))
+            self.assertEqual(dpll(PNot(PImplies(test_prop_1, PVar("r"))),
+                                 cnf_method=method)["r"], False)
+            self.assertEqual(dpll(PNot(test_prop_1), cnf_method=method), "unsat")
+
+    def test_hash_consing(self):
+        p = PAnd(PVar("p"), PNot(PVar("q")))
+        self.assertIs(p, PAnd(PVar("p"), PNot(PVar("q"))))
+        self.assertIs(test_prop_2.p.left.left, PVar(var="p1"))
+        self.assertNotEqual(PAnd(PVar("p"), PVar("q")), POr(PVar("p"), PVar("q")))
+        self.assertIs(cnf(nnf(ie(test_prop_2))), cnf(nnf(ie(test_prop_2))))
+        self.assertIs(nnf(ie(test_prop_2))._memo["cnf"], cnf(nnf(ie(test_prop_2))))
+        with self.assertRaises(AttributeError):
+            p.left = PVar("r")
+
+    def test_clause_db(self):
+        db = ClauseDB.from_clauses(flatten(cnf(nnf(ie(test_prop_2)))))
+        self.assertEqual(db.names, ["p1", "p3", "p4", "p2"])
+        self.assertEqual(db.lits.tolist(), [-1, -2, -1, 3, 4, -2, 4, 3])
+        self.assertEqual(db.offsets.tolist(), [0, 2, 4, 6, 8])
+        self.assertEqual(str(db.to_clauses()),
+                         "[[~p1, ~p3], [~p1, p4], [p2, ~p3], [p2, p4]]")
+        self.assertIs(db.to_prop(), cnf(nnf(ie(test_prop_2))))
+        self.assertEqual(len(ClauseDB.from_clauses(flatten(cnf(nnf(ie(test_prop_1)))))), 0)
+
+    def test_prop_solver(self):
+        p, q, r = PVar("p"), PVar("q"), PVar("r")
+        s = PropSolver()
+        s.add(PImplies(p, q))
+        s.add(PImplies(q, r))
+        self.assertTrue(s.solve([p]))
+        self.assertEqual(s.model(), {"p": True, "q": True, "r": True})
+        self.assertFalse(s.solve([p, q, PNot(r)]))
+        self.assertEqual(s.failed, [p, PNot(r)])
+        # p -> r is valid under the base theory
+        s.push()
+        s.add(PNot(PImplies(p, r)))
+        self.assertFalse(s.solve())
+        s.pop()
+        self.assertTrue(s.solve([PNot(r)]))
+        # enumerate the 4 models of the base theory
+        models = []
+        while s.solve():
+            models.append(s.model())
+            s.add_clause([PNot(x) if models[-1][str(x)] else x for x in (p, q, r)])
+        self.assertEqual(len(models), 4)
+        self.assertFalse(s.solve([PNot(p)]))
+        self.assertEqual(s.failed, [])
+
+    def test_prop_solver_names(self):
+        # user atoms named like the selectors and the Tseitin atoms stay
+        # apart from them, whether added before or after
+        s0, s1, s2 = PVar("_s0"), PVar("_s1"), PVar("_s2")
+        for cnf_method in ("tseitin", "pg", "distribute"):
+            s = PropSolver(cnf_method)
+            s.push()
+            s.add(POr(PAnd(s0, s1), PAnd(PNot(s0), s2)))
+            self.assertFalse(s.solve([PNot(s1), PNot(s2)]))
+            s.pop()
+            s.add(PAnd(s0, PNot(s1)))
+            self.assertTrue(s.solve())
+            model = s.model()
+            self.assertEqual(set(model), {"_s0", "_s1", "_s2"})
+            self.assertEqual((model["_s0"], model["_s1"]), (True, False))
+            s.push()
+            s.add(POr(PAnd(PVar("_s3"), PVar("_s4")), PNot(s0)))
+            self.assertTrue(s.solve())
+            self.assertEqual(set(s.model()), {"_s0", "_s1", "_s2", "_s3", "_s4"})
+
+    def test_incremental_engine(self):
+        # 1 is pure in [1, 2], but neither an assumption nor a later
+        # clause may be refuted by fixing it
+        engine = CdclEngine(2)
+        engine.add_clause([1, 2])
+        self.assertTrue(engine.solve([-1]))
+        self.assertEqual(engine.value[2], 1)
+        engine = CdclEngine(2)
+        engine.add_clause([1, 2])
+        self.assertTrue(engine.solve())
+        engine.add_clause([-1])
+        self.assertTrue(engine.solve())
+        self.assertEqual((engine.value[1], engine.value[2]), (-1, 1))
+
+    def test_deep_prop(self):
+        # a left-deep chain like the one of lab3/monster.py, far deeper
+        # than the recursion limit
+        N = 20000
+        prop = PTrue()
+        for i in range(N):
+            prop = PAnd(prop, PVar(f"b_{i}"))
+        clauses = flatten(cnf(nnf(ie(PNot(PNot(prop))))))
+        self.assertEqual(len(clauses), N + 1)
+        self.assertEqual(str(clauses[:3]), "[[True], [b_0], [b_1]]")
+        res = dpll(prop, mode="cdcl")
+        self.assertTrue(len(res) == N and all(res.values()))
+        self.assertEqual(len(flatten(tseitin(prop))), 3 * N + 1)
+        clause = flatten(cnf(nnf(ie(PNot(prop)))))
+        self.assertEqual(len(clause), 1)
+        self.assertEqual(len(clause[0]), N + 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,510 @@
+"""DRAT proofs of unsatisfiability for the lab3 solvers.
+
+A DRAT proof lists the clauses a solver derives ("a") and drops ("d")
+on its way to the empty clause. Each derived clause C must be RUP
+(reverse unit propagation: the clauses so far and the negation of C
+propagate to a conflict) or RAT on its first literal p (every resolvent
+of C with a clause containing ~p is RUP). Proofs are written in the
+binary format of drat-trim: a byte "a" or "d", then the literals, each
+mapped to 2 * v for v and 2 * v + 1 for ~v and written 7 bits at a time,
+low bits first, with the high bit set on all bytes but the last, then a
+0 byte.
+
+`DratWriter` logs proofs for `dpll.dpll(prop, proof=path)`, and
+`DratChecker` streams them back and checks them backward from the empty
+clause, only checking the clauses the refutation depends on. These
+clauses give the unsatisfiable core of the input, and a trimmed LRAT
+proof, where every clause lists the clauses that propagate it, which
+simple checkers can verify without searching.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import unittest
+from typing import Iterable, Iterator, List
+
+from dimacs import open_file, read_chunks, read_dimacs
+from dpll import (ClauseDB, CdclEngine, PNot, SatEngine, cnf_clauses, dpll, test_prop_1,
+                  test_prop_2)
+
+
+def _encode(buf: bytearray, lits: Iterable[int]):
+    for lit in lits:
+        u = 2 * lit if lit > 0 else 1 - 2 * lit
+        while u > 127:
+            buf.append(u & 127 | 128)
+            u >>= 7
+        buf.append(u)
+    buf.append(0)
+
+
+class DratWriter:
+    """Writes a binary DRAT proof to `path`, `buffer_size` bytes at a time.
+
+    The file is compressed according to its extension, see `dimacs`.
+    Use it as a context manager, or `close` it to flush the buffer.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 16):
+        self.file = open_file(os.fspath(path), "wb")
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+
+    def add(self, lits: Iterable[int]):
+        self.buffer.append(0x61)
+        _encode(self.buffer, lits)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def delete(self, lits: Iterable[int]):
+        self.buffer.append(0x64)
+        _encode(self.buffer, lits)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_steps(path: str, chunk_size: int, parts: dict) -> Iterator[tuple[int, List[List[int]]]]:
+    """Yield the steps of a binary proof, as (tag, lists of numbers).
+
+    A step is a tag byte followed by `parts[tag]` lists, each ended by 0.
+    """
+    tag = None
+    lists = []
+    numbers = []
+    u = shift = 0
+    for chunk in read_chunks(os.fspath(path), chunk_size):
+        for byte in chunk:
+            if tag is None:
+                if byte not in parts:
+                    raise ValueError(f"not a binary proof: {path}")
+                tag = byte
+                continue
+            u |= (byte & 127) << shift
+            if byte & 128:
+                shift += 7
+                continue
+            if u == 0:
+                lists.append(numbers)
+                numbers = []
+                if len(lists) == parts[tag]:
+                    yield tag, lists
+                    tag = None
+                    lists = []
+            else:
+                numbers.append(-(u >> 1) if u & 1 else u >> 1)
+            u = shift = 0
+    if tag is not None:
+        raise ValueError(f"truncated proof: {path}")
+
+
+def read_drat(path: str, chunk_size: int = 1 << 22) -> Iterator[tuple[bool, List[int]]]:
+    """Yield the steps of the binary DRAT proof `path`, as (deletion, literals)."""
+    for tag, (lits,) in _read_steps(path, chunk_size, {0x61: 1, 0x64: 1}):
+        yield tag == 0x64, lits
+
+
+class DratChecker:
+    """Checks a DRAT proof against the clauses of a `ClauseDB`.
+
+    Clauses are numbered from 1 in the order they come: the input ones
+    first, then the ones the proof adds. A first pass replays the proof
+    up to the empty clause; the check then goes backward, undoing the
+    steps, and only checks the clauses marked as used by a later check,
+    starting from the conflict of the empty clause. Each check propagates
+    from scratch with two watched literals per clause, marking the
+    clauses that took part in the conflict.
+    """
+
+    def __init__(self, db: ClauseDB):
+        self.num_inputs = len(db)
+        self.num_vars = db.num_vars
+        self.clauses = [None]
+        # the first literal of each clause as added, the RAT pivot: the
+        # watches reorder the clauses themselves
+        self.pivots = [0]
+        self.active = [False]
+        self.units = set()
+        self.watches = {}
+        # the active clauses by their literals, to find the deleted ones
+        self.index = {}
+        self.steps = []
+        self.marked = set()
+        # clause -> the clauses propagating it, in order, for LRAT
+        self.hints = {}
+        self.stats = {"lemmas": 0, "deletions": 0, "missed_deletions": 0,
+                      "checked": 0, "rat": 0}
+        for clause in db:
+            self._add(clause.tolist())
+
+    def _add(self, lits: List[int]) -> int:
+        clause = list(dict.fromkeys(lits))
+        cid = len(self.clauses)
+        self.clauses.append(clause)
+        self.pivots.append(clause[0] if clause else 0)
+        self.active.append(False)
+        self.num_vars = max(self.num_vars, max(map(abs, clause), default=0))
+        if len(clause) >= 2:
+            self.watches.setdefault(clause[0], []).append(cid)
+            self.watches.setdefault(clause[1], []).append(cid)
+        self._activate(cid)
+        return cid
+
+    def _key(self, lits: Iterable[int]) -> tuple:
+        return tuple(sorted(set(lits)))
+
+    def _activate(self, cid: int):
+        self.active[cid] = True
+        if len(self.clauses[cid]) == 1:
+            self.units.add(cid)
+        self.index.setdefault(self._key(self.clauses[cid]), []).append(cid)
+
+    def _deactivate(self, cid: int):
+        self.active[cid] = False
+        self.units.discard(cid)
+        self.index[self._key(self.clauses[cid])].remove(cid)
+
+    def _propagate(self, assumed: List[int]) -> List[int] | None:
+        """Propagate the active clauses from `assumed`.
+
+        Returns None without a conflict, otherwise the clauses taking
+        part in it, in the order they propagated, the conflict last.
+        """
+        clauses, active, watches = self.clauses, self.active, self.watches
+        value = {}
+        reason = {}
+        trail = []
+        conflict = None
+        for lit in assumed:
+            if value.get(lit) is False:
+                # the clause checked is a tautology
+                return []
+            if lit not in value:
+                value[lit], value[-lit] = True, False
+                trail.append(lit)
+        for cid in self.units:
+            lit = clauses[cid][0]
+            if value.get(lit) is False:
+                conflict = cid
+                break
+            if lit not in value:
+                value[lit], value[-lit] = True, False
+                reason[abs(lit)] = cid
+                trail.append(lit)
+        head = 0
+        while conflict is None and head < len(trail):
+            false_lit = -trail[head]
+            head += 1
+            ws = watches.get(false_lit, ())
+            kept = []
+            for i, cid in enumerate(ws):
+                c = clauses[cid]
+                if not active[cid] or conflict is not None:
+                    kept.append(cid)
+                    continue
+                if c[0] == false_lit:
+                    c[0], c[1] = c[1], false_lit
+                first = c[0]
+                if value.get(first) is True:
+                    kept.append(cid)
+                    continue
+                for k in range(2, len(c)):
+                    if value.get(c[k]) is not False:
+                        c[1], c[k] = c[k], false_lit
+                        watches.setdefault(c[1], []).append(cid)
+                        break
+                else:
+                    kept.append(cid)
+                    if value.get(first) is False:
+                        conflict = cid
+                    else:
+                        value[first], value[-first] = True, False
+                        reason[abs(first)] = cid
+                        trail.append(first)
+            if ws:
+                ws[:] = kept
+        if conflict is None:
+            return None
+        # the clauses the conflict depends on, following the reasons back
+        used = {conflict}
+        stack = [conflict]
+        while stack:
+            for lit in clauses[stack.pop()]:
+                cid = reason.get(abs(lit))
+                if cid is not None and cid not in used:
+                    used.add(cid)
+                    stack.append(cid)
+        order = [reason[abs(lit)] for lit in trail if reason.get(abs(lit)) in used]
+        order.append(conflict)
+        return order
+
+    def _verify(self, cid: int) -> bool:
+        """Check clause `cid` against the active clauses, marking what it uses."""
+        lemma = self.clauses[cid]
+        used = self._propagate([-lit for lit in lemma])
+        if used is not None:
+            self.marked.update(used)
+            self.hints[cid] = used
+            return True
+        if not lemma:
+            return False
+        # RAT on the first literal: check every resolvent on it
+        pivot = self.pivots[cid]
+        hints = []
+        for other in range(1, len(self.clauses)):
+            if not self.active[other] or -pivot not in self.clauses[other]:
+                continue
+            resolvent = lemma + [lit for lit in self.clauses[other] if lit != -pivot]
+            used = self._propagate([-lit for lit in resolvent])
+            if used is None:
+                return False
+            self.marked.add(other)
+            self.marked.update(used)
+            hints += [-other] + used
+        self.hints[cid] = hints
+        self.stats["rat"] += 1
+        return True
+
+    def check(self, steps: Iterable[tuple[bool, List[int]]]) -> bool:
+        """Check the proof `steps`, as given by `read_drat`.
+
+        Returns whether the steps refute the clauses, after which `core`
+        and `write_lrat` give the clauses and lemmas used.
+        """
+        for deletion, lits in steps:
+            if deletion:
+                ids = self.index.get(self._key(lits))
+                if not ids:
+                    self.stats["missed_deletions"] += 1
+                    continue
+                cid = ids[-1]
+                self._deactivate(cid)
+                self.steps.append((True, cid))
+                self.stats["deletions"] += 1
+            else:
+                cid = self._add(lits)
+                self.steps.append((False, cid))
+                self.stats["lemmas"] += 1
+                if not lits:
+                    break
+        # the clauses left must propagate to a conflict, unless one is empty
+        empty = [cid for cid in self.index.get((), ()) if cid <= self.num_inputs]
+        used = empty[:1] or self._propagate([])
+        if used is None:
+            return False
+        self.marked.update(used)
+        self.final = used
+        for deletion, cid in reversed(self.steps):
+            if deletion:
+                self._activate(cid)
+                continue
+            self._deactivate(cid)
+            if cid in self.marked and self.clauses[cid]:
+                self.stats["checked"] += 1
+                if not self._verify(cid):
+                    return False
+        return True
+
+    def core(self) -> List[int]:
+        """The indices in the input of the clauses used by the refutation."""
+        return sorted(cid - 1 for cid in self.marked if cid <= self.num_inputs)
+
+    def write_lrat(self, path: str):
+        """Write the used lemmas as a binary LRAT proof to `path`.
+
+        Each lemma is written as "a", its number, its literals, 0, the
+        numbers of the clauses propagating it, negated for the clauses
+        of a RAT check, and 0, all encoded like DRAT literals.
+        """
+        buf = bytearray()
+        with open_file(os.fspath(path), "wb") as f:
+            for deletion, cid in self.steps:
+                if deletion or cid not in self.marked or not self.clauses[cid]:
+                    continue
+                pivot = self.pivots[cid]
+                buf.append(0x61)
+                _encode(buf, [cid, pivot] + [lit for lit in self.clauses[cid] if lit != pivot])
+                _encode(buf, self.hints[cid])
+                if len(buf) >= 1 << 16:
+                    f.write(buf)
+                    buf.clear()
+            buf.append(0x61)
+            _encode(buf, [len(self.clauses)])
+            _encode(buf, self.final)
+            f.write(buf)
+
+
+def check_proof(db: ClauseDB, path: str) -> DratChecker | None:
+    """Check the binary DRAT proof `path` of the clauses of `db`.
+
+    Returns the checker, for its `core` and `write_lrat`, if the proof
+    refutes the clauses, otherwise None.
+    """
+    checker = DratChecker(db)
+    return checker if checker.check(read_drat(path)) else None
+
+
+def read_lrat(path: str, chunk_size: int = 1 << 22) -> Iterator[tuple[int, List[int], List[int]]]:
+    """Yield the lemmas of the binary LRAT proof `path`, as (number, literals, hints)."""
+    for tag, lists in _read_steps(path, chunk_size, {0x61: 2, 0x64: 1}):
+        if tag == 0x61:
+            (cid, *lits), hints = lists
+            yield cid, lits, hints
+
+
+class TestDrat(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "proof.drat")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_format(self):
+        with DratWriter(self.path, buffer_size=4) as writer:
+            writer.add([1, -2, 100])
+            writer.delete([-63, 64])
+            writer.add([])
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), bytes([0x61, 2, 5, 200, 1, 0, 0x64, 127, 128, 1, 0, 0x61, 0]))
+        self.assertEqual(list(read_drat(self.path, chunk_size=3)),
+                         [(False, [1, -2, 100]), (True, [-63, 64]), (False, [])])
+
+    def test_check(self):
+        # (p \/ q) /\ (p \/ ~q) /\ (~p \/ r) /\ (~p \/ ~r) /\ s
+        db = ClauseDB()
+        for clause in ([1, 2], [1, -2], [-1, 3], [-1, -3], [4]):
+            db.add_clause(clause)
+        with DratWriter(self.path) as writer:
+            writer.add([1])
+            writer.delete([2, 1])
+            writer.add([])
+        checker = check_proof(db, self.path)
+        self.assertEqual(checker.core(), [0, 1, 2, 3])
+        self.assertEqual(checker.stats["deletions"], 1)
+        # ~s is neither RUP nor RAT
+        with DratWriter(self.path) as writer:
+            writer.add([-4])
+            writer.add([])
+        self.assertIsNone(check_proof(db, self.path))
+        # a fresh variable is RAT
+        db = ClauseDB()
+        for clause in ([-1, -2], [-1, 2], [1, 3], [1, -3]):
+            db.add_clause(clause)
+        with DratWriter(self.path) as writer:
+            writer.add([6])
+            writer.add([-6, 1])
+            writer.add([])
+        checker = check_proof(db, self.path)
+        self.assertEqual(checker.stats["rat"], 1)
+        self.assertEqual(checker.core(), [0, 1, 2, 3])
+        # the pure literal p is RAT, but the clauses are satisfiable
+        db = ClauseDB()
+        for clause in ([1, 2], [-2, 3], [-3, -2]):
+            db.add_clause(clause)
+        with DratWriter(self.path) as writer:
+            writer.add([1])
+            writer.add([-2])
+            writer.add([])
+        self.assertIsNone(check_proof(db, self.path))
+        # a lemma stays RAT on its first literal after the watches reorder it
+        db = ClauseDB()
+        db.add_clause([-1, 6])
+        for signs in range(8):
+            db.add_clause([v if signs >> (v - 1) & 1 else -v for v in (1, 2, 3)])
+        checker = DratChecker(db)
+        cid = checker._add([5, 1])
+        checker._propagate([-5, 2, 3])
+        self.assertEqual(checker.clauses[cid], [1, 5])
+        checker._deactivate(cid)
+        self.assertTrue(checker._verify(cid))
+
+    def test_dpll(self):
+        prop = PNot(test_prop_1)
+        for mode in ("dpll", "cdcl"):
+            for cnf_method in ("distribute", "tseitin"):
+                for preprocess in (False, True):
+                    self.assertEqual(dpll(prop, mode, cnf_method, preprocess, proof=self.path), "unsat")
+                    checker = check_proof(cnf_clauses(prop, cnf_method), self.path)
+                    self.assertIsNotNone(checker)
+        self.assertNotEqual(dpll(test_prop_2, proof=self.path), "unsat")
+        self.assertIsNone(check_proof(cnf_clauses(test_prop_2), self.path))
+
+    def test_random(self):
+        rng = random.Random(1)
+        lrat = os.path.join(self.dir.name, "proof.lrat")
+        refuted = 0
+        for _ in range(100):
+            num_vars = rng.randint(3, 10)
+            db = ClauseDB()
+            for _ in range(rng.randint(num_vars, 6 * num_vars)):
+                db.add_clause([rng.choice([1, -1]) * rng.randint(1, num_vars)
+                               for _ in range(rng.randint(1, 3))])
+            for engine_class in (SatEngine, CdclEngine):
+                engine = engine_class(db.num_vars)
+                engine.proof = DratWriter(self.path)
+                for clause in db:
+                    engine.add_clause(clause)
+                sat = engine.solve()
+                engine.proof.close()
+                checker = check_proof(db, self.path)
+                self.assertEqual(checker is None, sat)
+                if sat:
+                    continue
+                refuted += 1
+                core = ClauseDB()
+                for i in checker.core():
+                    core.add_clause(db[i])
+                engine = CdclEngine(db.num_vars)
+                for clause in core:
+                    engine.add_clause(clause)
+                self.assertFalse(engine.solve())
+                # replay the LRAT proof: every lemma propagates from its hints
+                checker.write_lrat(lrat)
+                clauses = {i + 1: set(db[i]) for i in range(len(db))}
+                for cid, clause, hints in read_lrat(lrat):
+                    if all(h > 0 for h in hints):
+                        assigned = {-lit for lit in clause}
+                        for h in hints:
+                            free = [lit for lit in clauses[h] if -lit not in assigned]
+                            self.assertLessEqual(len(free), 1)
+                            if not free:
+                                break
+                            assigned.add(free[0])
+                        else:
+                            self.fail("no conflict")
+                    clauses[cid] = clause
+        self.assertGreater(refuted, 20)
+
+
+if __name__ == '__main__':
+    # python drat.py <file.cnf> <proof.drat> [<proof.lrat>] checks the
+    # proof, printing the size of the core and optionally writing the
+    # trimmed LRAT proof; without arguments, run the tests
+    if len(sys.argv) < 3:
+        unittest.main()
+    db = read_dimacs(sys.argv[1])
+    checker = check_proof(db, sys.argv[2])
+    if checker is None:
+        print("s NOT VERIFIED")
+        sys.exit(1)
+    print("s VERIFIED")
+    print(f"c core: {len(checker.core())} of {len(db)} clauses, "
+          f"{checker.stats['checked']} of {checker.stats['lemmas']} lemmas checked")
+    if len(sys.argv) > 3:
+        checker.write_lrat(sys.argv[3])
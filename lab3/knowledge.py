@@ -0,0 +1,526 @@
+"""Knowledge compilation of propositions, for many queries on one formula.
+
+A formula is compiled once into a form where counting its models,
+conditioning it on some values, checking an assignment and enumerating
+its models all take time linear in the compiled size (or per model):
+  * `BDD` builds reduced ordered binary decision diagrams, with a unique
+    table so that each function is a single node and a computed table
+    caching the results of `apply`;
+  * `DDNNFCompiler` traces the search of `sharpsat.ModelCounter` into a
+    smooth d-DNNF circuit, `DDNNF`, where decisions become deterministic
+    "or" nodes and independent components decomposable "and" nodes.
+BDDs are canonical for a variable order but can blow up where d-DNNF
+does not, e.g. on formulas splitting into components.
+"""
+
+import itertools
+import operator
+import random
+import unittest
+from collections import Counter
+from typing import Iterable, Iterator, List
+
+from dpll import (ClauseDB, PAnd, PFalse, PImplies, PNot, POr, PTrue, PVar, Prop, _fold,
+                  atoms, cnf_clauses, test_prop_1, test_prop_2)
+from sharpsat import ModelCounter
+
+
+def _children(p: Prop) -> tuple:
+    match p:
+        case PVar() | PTrue() | PFalse():
+            return ()
+        case PNot(q):
+            return (q,)
+        case PAnd(left, right) | POr(left, right) | PImplies(left, right):
+            return (left, right)
+        case _:
+            raise NotImplementedError(f"knowledge: unknown prop: {p}")
+
+
+class BDD:
+    """A manager of reduced ordered binary decision diagrams.
+
+    Nodes are ints: 0 and 1 are the constants False and True, and node
+    `u` tests the variable `order[level[u]]`, going on to `low[u]` when
+    it is False and to `high[u]` when it is True. Variables added later
+    come last in the order.
+    """
+
+    _OPS = {"and": operator.and_, "or": operator.or_, "xor": operator.xor,
+            "implies": lambda a, b: (1 - a) | b}
+
+    def __init__(self, order: Iterable[str] = ()):
+        self.order = []
+        self.index = {}
+        self.level = [-1, -1]
+        self.low = [0, 1]
+        self.high = [0, 1]
+        # (level, low, high) -> node, and (op, u, v) -> node
+        self.unique = {}
+        self.computed = {}
+        for name in order:
+            self.var(name)
+
+    def _level(self, u: int) -> int:
+        return self.level[u] if u > 1 else len(self.order)
+
+    def _node(self, level: int, low: int, high: int) -> int:
+        if low == high:
+            return low
+        key = (level, low, high)
+        u = self.unique.get(key)
+        if u is None:
+            u = self.unique[key] = len(self.low)
+            self.level.append(level)
+            self.low.append(low)
+            self.high.append(high)
+        return u
+
+    def var(self, name: str) -> int:
+        """The node of the atom `name`."""
+        if name not in self.index:
+            self.index[name] = len(self.order)
+            self.order.append(name)
+        return self._node(self.index[name], 0, 1)
+
+    def apply(self, op: str, u: int, v: int) -> int:
+        """Combine `u` and `v` with "and", "or", "xor" or "implies"."""
+        if u <= 1 and v <= 1:
+            return self._OPS[op](u, v)
+        if op == "and":
+            if u == 0 or v == 0:
+                return 0
+            if u == 1 or u == v:
+                return v
+            if v == 1:
+                return u
+        elif op == "or":
+            if u == 1 or v == 1:
+                return 1
+            if u == 0 or u == v:
+                return v
+            if v == 0:
+                return u
+        if op != "implies" and u > v:
+            u, v = v, u
+        key = (op, u, v)
+        result = self.computed.get(key)
+        if result is None:
+            lu, lv = self._level(u), self._level(v)
+            top = min(lu, lv)
+            u0, u1 = (self.low[u], self.high[u]) if lu == top else (u, u)
+            v0, v1 = (self.low[v], self.high[v]) if lv == top else (v, v)
+            result = self._node(top, self.apply(op, u0, v0), self.apply(op, u1, v1))
+            self.computed[key] = result
+        return result
+
+    def neg(self, u: int) -> int:
+        return self.apply("xor", u, 1)
+
+    def from_prop(self, prop: Prop) -> int:
+        """The node of `prop`, adding its atoms to the order as they come."""
+        def combine(p: Prop, subs: List[int]) -> int:
+            match p:
+                case PVar(var):
+                    return self.var(var)
+                case PTrue():
+                    return 1
+                case PFalse():
+                    return 0
+                case PNot():
+                    return self.neg(subs[0])
+                case PAnd():
+                    return self.apply("and", *subs)
+                case POr():
+                    return self.apply("or", *subs)
+                case PImplies():
+                    return self.apply("implies", *subs)
+
+        return _fold(prop, _children, combine, {})
+
+    def from_clauses(self, db: ClauseDB) -> int:
+        """The node of the conjunction of the clauses of `db`."""
+        result = 1
+        for clause in db:
+            node = 0
+            for lit in clause:
+                v = self.var(db.names[abs(lit) - 1])
+                node = self.apply("or", node, v if lit > 0 else self.neg(v))
+            result = self.apply("and", result, node)
+        return result
+
+    def _post_order(self, u: int) -> List[int]:
+        """The inner nodes below `u`, each after its children."""
+        order = []
+        seen = {0, 1}
+        stack = [(u, False)]
+        while stack:
+            w, expanded = stack.pop()
+            if expanded:
+                order.append(w)
+            elif w not in seen:
+                seen.add(w)
+                stack.append((w, True))
+                stack.append((self.high[w], False))
+                stack.append((self.low[w], False))
+        return order
+
+    def size(self, u: int) -> int:
+        return len(self._post_order(u))
+
+    def count(self, u: int) -> int:
+        """The number of models of `u` over all the variables of the order."""
+        level, low, high = self._level, self.low, self.high
+        counts = {0: 0, 1: 1}
+        for w in self._post_order(u):
+            lw = level(w)
+            counts[w] = ((counts[low[w]] << (level(low[w]) - lw - 1))
+                         + (counts[high[w]] << (level(high[w]) - lw - 1)))
+        return counts[u] << level(u)
+
+    def restrict(self, u: int, assignment: dict) -> int:
+        """Condition `u` on the values of `assignment`, a dict from names to bools."""
+        levels = {self.index[name]: value for name, value in assignment.items()}
+        results = {0: 0, 1: 1}
+        for w in self._post_order(u):
+            if self.level[w] in levels:
+                results[w] = results[self.high[w] if levels[self.level[w]] else self.low[w]]
+            else:
+                results[w] = self._node(self.level[w], results[self.low[w]], results[self.high[w]])
+        return results[u]
+
+    def evaluate(self, u: int, assignment: dict) -> bool:
+        """The value of `u` under `assignment`, which gives all the variables."""
+        while u > 1:
+            u = self.high[u] if assignment[self.order[self.level[u]]] else self.low[u]
+        return u == 1
+
+    def models(self, u: int) -> Iterator[dict]:
+        """Yield the models of `u` over all the variables of the order."""
+        n = len(self.order)
+        stack = [(u, 0, ())]
+        while stack:
+            w, level, values = stack.pop()
+            if w == 0:
+                continue
+            if level == n:
+                yield dict(zip(self.order, values))
+            elif self._level(w) == level:
+                stack.append((self.high[w], level + 1, values + (True,)))
+                stack.append((self.low[w], level + 1, values + (False,)))
+            else:
+                stack.append((w, level + 1, values + (True,)))
+                stack.append((w, level + 1, values + (False,)))
+
+
+class DDNNF:
+    """A smooth d-DNNF circuit over the variables named by `names`.
+
+    Nodes are ints with a `kind` and `args`: "lit" nodes hold a literal,
+    "free" nodes a variable v, standing for v \\/ ~v, "and" nodes children
+    over disjoint variables and "or" nodes children without common
+    models over the same variables. 0 is the empty "or", False, and 1
+    the empty "and", True. Equal nodes are shared through a unique table.
+    Variable v is named `names[v - 1]`, and the `hidden` ones, determined
+    by the others, are left out of models.
+    """
+
+    def __init__(self, names: List[str], hidden: Iterable[str] = ()):
+        self.names = names
+        self.var_ids = {name: v for v, name in enumerate(names, 1)}
+        self.hidden = set(hidden)
+        self.kind = ["or", "and"]
+        self.args = [(), ()]
+        self.unique = {}
+
+    def _node(self, kind: str, args: tuple) -> int:
+        key = (kind, args)
+        u = self.unique.get(key)
+        if u is None:
+            u = self.unique[key] = len(self.kind)
+            self.kind.append(kind)
+            self.args.append(args)
+        return u
+
+    def literal(self, lit: int) -> int:
+        return self._node("lit", lit)
+
+    def free(self, v: int) -> int:
+        return self._node("free", v)
+
+    def conjoin(self, children: List[int]) -> int:
+        if 0 in children:
+            return 0
+        children = tuple(c for c in children if c != 1)
+        return children[0] if len(children) == 1 else self._node("and", children)
+
+    def disjoin(self, children: List[int]) -> int:
+        children = tuple(c for c in children if c != 0)
+        return children[0] if len(children) == 1 else self._node("or", children)
+
+    def _post_order(self, u: int) -> List[int]:
+        order = []
+        seen = set()
+        stack = [(u, False)]
+        while stack:
+            w, expanded = stack.pop()
+            if expanded:
+                order.append(w)
+            elif w not in seen:
+                seen.add(w)
+                stack.append((w, True))
+                if self.kind[w] in ("and", "or"):
+                    stack.extend((c, False) for c in self.args[w])
+        return order
+
+    def size(self, u: int) -> int:
+        return len(self._post_order(u))
+
+    def _values(self, assignment: dict | None) -> dict:
+        return {self.var_ids[name]: value for name, value in (assignment or {}).items()}
+
+    def count(self, u: int, assignment: dict | None = None) -> int:
+        """The number of models of `u` agreeing with `assignment`.
+
+        Models range over all the variables, hidden ones included, and
+        `assignment` maps names to bools: the circuit is conditioned on it.
+        """
+        values = self._values(assignment)
+        counts = {}
+        for w in self._post_order(u):
+            match self.kind[w]:
+                case "lit":
+                    lit = self.args[w]
+                    counts[w] = int(values.get(abs(lit), lit > 0) == (lit > 0))
+                case "free":
+                    counts[w] = 1 if self.args[w] in values else 2
+                case "and":
+                    counts[w] = 1
+                    for c in self.args[w]:
+                        counts[w] *= counts[c]
+                case "or":
+                    counts[w] = sum(counts[c] for c in self.args[w])
+        return counts[u]
+
+    def evaluate(self, u: int, assignment: dict) -> bool:
+        """Whether `assignment`, giving all the variables that are not hidden, is a model."""
+        return self.count(u, assignment) > 0
+
+    def models(self, u: int, assignment: dict | None = None) -> Iterator[dict]:
+        """Yield the models of `u` agreeing with `assignment`, without hidden variables."""
+        values = self._values(assignment)
+        # (nodes left to expand, values chosen so far), both as linked
+        # lists (head, tail), so that pushing a branch copies neither
+        stack = [((u, None), None)]
+        while stack:
+            todo, model = stack.pop()
+            if todo is None:
+                chosen = {}
+                while model is not None:
+                    (v, value), model = model
+                    chosen[v] = value
+                yield {self.names[v - 1]: value for v, value in sorted(chosen.items())
+                       if self.names[v - 1] not in self.hidden}
+                continue
+            w, rest = todo
+            match self.kind[w]:
+                case "lit":
+                    lit = self.args[w]
+                    if values.get(abs(lit), lit > 0) == (lit > 0):
+                        stack.append((rest, ((abs(lit), lit > 0), model)))
+                case "free":
+                    v = self.args[w]
+                    for value in ((values[v],) if v in values else (True, False)):
+                        stack.append((rest, ((v, value), model)))
+                case "and":
+                    for c in reversed(self.args[w]):
+                        rest = (c, rest)
+                    stack.append((rest, model))
+                case "or":
+                    for c in reversed(self.args[w]):
+                        stack.append(((c, rest), model))
+
+
+class DDNNFCompiler(ModelCounter):
+    """Compiles clauses into a `DDNNF` by tracing an exhaustive search.
+
+    The search is the one of `ModelCounter` with every variable
+    projected: a decision on v becomes an "or" of the two branches, each
+    an "and" of the literals propagated, the variables that vanished as
+    "free" nodes and the circuits of the components left. The component
+    cache holds circuits, which makes them shared nodes.
+    """
+
+    def __init__(self, ddnnf: DDNNF):
+        super().__init__(range(1, len(ddnnf.names) + 1))
+        self.ddnnf = ddnnf
+
+    def compile(self, clauses: Iterable[Iterable[int]]) -> int:
+        formula = self._formula(clauses)
+        missing = self.projection - self._projected(formula)
+        return self.ddnnf.conjoin([self._count(formula)]
+                                  + [self.ddnnf.free(v) for v in sorted(missing)])
+
+    def _counting(self, clauses: List[tuple], units: Iterable[int], occurs: dict | None = None):
+        ddnnf = self.ddnnf
+        if occurs is None:
+            occurs = self._occurrences(clauses)
+        before = {abs(lit) for lit in occurs}
+        simplified = self._simplify(clauses, units, occurs)
+        if simplified is None:
+            return 0
+        clauses, true, after = simplified
+        vanished = before - after - {abs(lit) for lit in true}
+        children = [ddnnf.literal(lit) for lit in sorted(true, key=abs)]
+        children += [ddnnf.free(v) for v in sorted(vanished)]
+        for component in self._components(clauses):
+            node = yield self._splitting(component)
+            if node == 0:
+                return 0
+            children.append(node)
+        return ddnnf.conjoin(children)
+
+    def _splitting(self, clauses: List[tuple]):
+        key = tuple(sorted(tuple(sorted(clause)) for clause in clauses))
+        node = self.cache.get(key)
+        if node is not None:
+            self.stats["cache_hits"] += 1
+            return node
+        self.stats["components"] += 1
+        occurs = self._occurrences(clauses)
+        occurrences = Counter()
+        for lit, indices in occurs.items():
+            occurrences[abs(lit)] += len(indices)
+        v = max(occurrences, key=occurrences.__getitem__)
+        self.stats["decisions"] += 1
+        node = self.ddnnf.disjoin([(yield self._counting(clauses, (v,), occurs)),
+                                   (yield self._counting(clauses, (-v,), occurs))])
+        self.cache[key] = node
+        return node
+
+
+def compile_bdd(prop: Prop, order: Iterable[str] | None = None) -> tuple[BDD, int]:
+    """Compile `prop` into a BDD, with the atoms in `order`, by default as they come."""
+    bdd = BDD(atoms(prop) if order is None else order)
+    return bdd, bdd.from_prop(prop)
+
+
+def compile_ddnnf(prop: Prop, cnf_method: str = "tseitin") -> tuple[DDNNF, int]:
+    """Compile `prop` into a d-DNNF, through its clauses.
+
+    With "tseitin", the atoms the conversion introduces are hidden: they
+    are defined by the others, so they change no count. Plaisted-
+    Greenbaum's "pg" does not define them and is not accepted.
+    """
+    if cnf_method == "pg":
+        raise ValueError("compile_ddnnf: the atoms of pg are not defined by the others")
+    db = cnf_clauses(prop, cnf_method)
+    names = atoms(prop)
+    ddnnf = DDNNF(db.names + [name for name in names if name not in db.var_ids],
+                  set(db.names) - set(names))
+    root = DDNNFCompiler(ddnnf).compile(clause.tolist() for clause in db)
+    return ddnnf, root
+
+
+def _random_prop(rng: random.Random, names: List[str], depth: int) -> Prop:
+    if depth == 0 or rng.random() < 0.2:
+        return PVar(rng.choice(names))
+    op = rng.choice([PAnd, POr, PImplies, PNot])
+    if op is PNot:
+        return PNot(_random_prop(rng, names, depth - 1))
+    return op(_random_prop(rng, names, depth - 1), _random_prop(rng, names, depth - 1))
+
+
+def _evaluate(prop: Prop, model: dict) -> bool:
+    def combine(p: Prop, subs: List[bool]) -> bool:
+        match p:
+            case PVar(var):
+                return model[var]
+            case PTrue() | PFalse():
+                return isinstance(p, PTrue)
+            case PNot():
+                return not subs[0]
+            case PAnd():
+                return subs[0] and subs[1]
+            case POr():
+                return subs[0] or subs[1]
+            case PImplies():
+                return not subs[0] or subs[1]
+
+    return _fold(prop, _children, combine, {})
+
+
+class TestKnowledge(unittest.TestCase):
+    def test_bdd(self):
+        bdd, f = compile_bdd(test_prop_2)
+        self.assertEqual(bdd.count(f), 7)
+        self.assertEqual(bdd.count(bdd.neg(f)), 9)
+        self.assertEqual(bdd.restrict(f, {"p1": False, "p2": True}), 1)
+        # p1 is free in the restriction
+        self.assertEqual(bdd.count(bdd.restrict(f, {"p1": False})), 10)
+        self.assertTrue(bdd.evaluate(f, {"p1": False, "p2": True, "p3": False, "p4": False}))
+        self.assertEqual(len(list(bdd.models(f))), 7)
+        # canonical: the clauses of f give the same node
+        self.assertEqual(bdd.from_clauses(cnf_clauses(test_prop_2)), f)
+        self.assertEqual(bdd.from_prop(PImplies(PVar("p1"), PVar("p2"))),
+                         bdd.from_prop(POr(PNot(PVar("p1")), PVar("p2"))))
+        self.assertEqual(bdd.from_prop(test_prop_1), 1)
+
+    def test_ddnnf(self):
+        ddnnf, f = compile_ddnnf(test_prop_2)
+        self.assertEqual(ddnnf.count(f), 7)
+        self.assertEqual(ddnnf.count(f, {"p1": False}), 5)
+        self.assertTrue(ddnnf.evaluate(f, {"p1": False, "p2": True, "p3": False, "p4": False}))
+        self.assertFalse(ddnnf.evaluate(f, {"p1": False, "p2": False, "p3": False, "p4": False}))
+        models = list(ddnnf.models(f))
+        self.assertEqual(len(models), 7)
+        self.assertTrue(all(set(m) == {"p1", "p2", "p3", "p4"} for m in models))
+        ddnnf, f = compile_ddnnf(PNot(test_prop_1), "distribute")
+        self.assertEqual(f, 0)
+        # 30 independent (x \/ y) /\ (~x \/ ~z), linear in d-DNNF
+        db = ClauseDB()
+        for i in range(30):
+            db.add_clause([3 * i + 1, 3 * i + 2])
+            db.add_clause([-3 * i - 1, -3 * i - 3])
+        ddnnf = DDNNF([f"v{v}" for v in range(1, 91)])
+        f = DDNNFCompiler(ddnnf).compile(clause.tolist() for clause in db)
+        self.assertEqual(ddnnf.count(f), 4 ** 30)
+        self.assertLess(ddnnf.size(f), 300)
+        # x1 -> x2 -> ... -> x800, deeper than the recursion limit
+        n = 800
+        ddnnf = DDNNF([f"x{v}" for v in range(1, n + 1)])
+        f = DDNNFCompiler(ddnnf).compile([-i, i + 1] for i in range(1, n))
+        self.assertEqual(ddnnf.count(f), n + 1)
+        models = list(ddnnf.models(f, {"x400": False}))
+        # the models are x_j = j >= k, for k from 401 to n + 1
+        self.assertEqual(len(models), n - 399)
+        self.assertEqual(sorted(sum(m.values()) for m in models), list(range(n - 399)))
+
+    def test_random(self):
+        rng = random.Random(3)
+        names = ["a", "b", "c", "d", "e"]
+        for _ in range(100):
+            prop = _random_prop(rng, names, 5)
+            bdd, u = compile_bdd(prop, names)
+            ddnnf, f = compile_ddnnf(prop)
+            assignments = [dict(zip(names, values))
+                           for values in itertools.product([False, True], repeat=len(names))]
+            expected = [m for m in assignments if _evaluate(prop, m)]
+            self.assertEqual(bdd.count(u), len(expected))
+            self.assertEqual(sorted(map(sorted, map(dict.items, bdd.models(u)))),
+                             sorted(map(sorted, map(dict.items, expected))))
+            # atoms missing from prop are free in the count of ddnnf
+            present = atoms(prop)
+            projected = {tuple(m[name] for name in present) for m in expected}
+            self.assertEqual(ddnnf.count(f), len(projected))
+            self.assertEqual(sorted(tuple(m[name] for name in present) for m in ddnnf.models(f)),
+                             sorted(projected))
+            condition = {"a": True} if "a" in present else {}
+            self.assertEqual(ddnnf.count(f, condition),
+                             len({p for p in projected if not condition or p[present.index("a")]}))
+            self.assertEqual(bdd.count(bdd.restrict(u, {"a": True})),
+                             2 * sum(1 for m in expected if m["a"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
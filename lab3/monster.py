@@ -1,5 +1,12 @@
+import os
+import sys
+
 from z3 import *
 
+# stream the text of the proposition instead of building it whole
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lab2"))
+from pro_print import pretty_print
+
 N = 100000
 
 prop = True
@@ -9,5 +16,5 @@ for i in range(N):
 
 # feed the large proposition to your solver. you can also
 # generate other propositions.
-print(prop)
+pretty_print(prop, max_width=120)
 
@@ -0,0 +1,444 @@
+"""Parallel solving of lab3 clause sets on a pool of processes.
+
+Two ways to use several cores:
+  * `portfolio` runs differently configured solvers on the same clauses,
+    Z3 with various tactics and seeds next to the native `CdclEngine`
+    and `SatEngine` with various heuristics, and takes the first answer;
+  * `cube_and_conquer` splits the search on variables chosen by
+    lookahead into cubes, conjunctions of literals covering every
+    assignment, and solves the clauses under each cube as assumptions.
+The native engines share their short learned clauses through a
+`ClauseExchange` in shared memory, taking in the ones of the others at
+every restart and before every cube. Z3 keeps its clauses to itself.
+"""
+
+import math
+import multiprocessing
+import os
+import unittest
+from collections import Counter
+from typing import Iterable, List
+
+import z3
+
+from dpll import (ClauseDB, CdclEngine, SatEngine, CNF_METHODS, PNot, Prop, atoms, flatten,
+                  test_prop_1, test_prop_2)
+
+
+class ClauseExchange:
+    """An append-only buffer of clauses in shared memory.
+
+    Each clause is stored as its sender, its literals and a 0. Readers
+    keep their own position in the buffer, and clauses that do not fit
+    anymore are dropped.
+    """
+
+    def __init__(self, capacity: int = 1 << 20, ctx=multiprocessing):
+        self.buf = ctx.RawArray("i", capacity)
+        self.size = ctx.Value("q", 0)
+
+    def publish(self, sender: int, lits: List[int]):
+        with self.size.get_lock():
+            start = self.size.value
+            end = start + len(lits) + 2
+            if end > len(self.buf):
+                return
+            self.buf[start] = sender
+            self.buf[start + 1:end - 1] = lits
+            self.buf[end - 1] = 0
+            self.size.value = end
+
+    def collect(self, reader: int, pos: int) -> tuple[List[List[int]], int]:
+        """The clauses published since `pos` by others than `reader`, and the new position."""
+        with self.size.get_lock():
+            end = self.size.value
+        data = self.buf[pos:end]
+        clauses = []
+        start = 0
+        while start < len(data):
+            stop = data.index(0, start + 1)
+            if data[start] != reader:
+                clauses.append(data[start + 1:stop])
+            start = stop + 1
+        return clauses, end
+
+    def __len__(self) -> int:
+        """How many ints are in the buffer."""
+        return self.size.value
+
+
+class _SharingEngine(CdclEngine):
+    """A `CdclEngine` publishing its short learned clauses to an exchange."""
+
+    share_size = 3
+
+    def __init__(self, num_vars: int, exchange: ClauseExchange | None, **options):
+        super().__init__(num_vars, **options)
+        self.exchange = exchange
+        self.sender = os.getpid()
+        self.exchange_pos = 0
+        self.stats.update(exported=0, imported=0)
+
+    def _learn(self, lits: List[int]):
+        super()._learn(lits)
+        if self.exchange is not None and len(lits) <= self.share_size:
+            self.exchange.publish(self.sender, lits)
+            self.stats["exported"] += 1
+
+    def import_clauses(self):
+        """Add the clauses the other engines published, at the root."""
+        if self.exchange is None:
+            return
+        clauses, self.exchange_pos = self.exchange.collect(self.sender, self.exchange_pos)
+        for clause in clauses:
+            self.add_clause(clause)
+        self.stats["imported"] += len(clauses)
+
+    def _restart(self):
+        super()._restart()
+        self.import_clauses()
+
+
+# The solvers of the default portfolio, as (kind, options):
+#   "z3":   a Z3 solver, from the tactic named by `tactic` if any,
+#           with the random `seed`
+#   "cdcl": a `CdclEngine`, sharing clauses, with the given options
+#   "dpll": a `SatEngine` with the given options
+PORTFOLIO = (
+    ("z3", {"seed": 0}),
+    ("cdcl", {"branching": "evsids", "restarts": "luby"}),
+    ("z3", {"tactic": "sat", "seed": 1}),
+    ("cdcl", {"branching": "vsids", "restarts": "glucose"}),
+    ("z3", {"tactic": "qffd", "seed": 2}),
+    ("cdcl", {"branching": "evsids", "phase_saving": False, "restarts": "glucose"}),
+    ("z3", {"tactic": "sat", "seed": 3}),
+    ("dpll", {"branching": "evsids"}),
+)
+
+# the answer of a solver that gave up, e.g. a Z3 tactic that failed
+UNKNOWN = "unknown"
+
+# per-process state of the pool workers, set by `_init_worker`
+_worker = {}
+
+
+def _init_worker(lits, offsets, num_vars: int, exchange: ClauseExchange | None, options: dict):
+    _worker.update(lits=lits, offsets=offsets, num_vars=num_vars,
+                   exchange=exchange, options=options, engine=None)
+
+
+def _clauses() -> Iterable[List[int]]:
+    lits, offsets = _worker["lits"], _worker["offsets"]
+    return (lits[offsets[i]:offsets[i + 1]].tolist() for i in range(len(offsets) - 1))
+
+
+def _solve_z3(tactic: str | None = None, seed: int = 0) -> List[bool] | str | None:
+    z3.set_param("sat.random_seed", seed)
+    z3.set_param("smt.random_seed", seed)
+    xs = [None] + [z3.Bool(f"x{v}") for v in range(1, _worker["num_vars"] + 1)]
+    solver = z3.Tactic(tactic).solver() if tactic else z3.Solver()
+    for clause in _clauses():
+        solver.add(z3.Or([xs[lit] if lit > 0 else z3.Not(xs[-lit]) for lit in clause])
+                   if clause else z3.BoolVal(False))
+    result = solver.check()
+    if result == z3.unknown:
+        return UNKNOWN
+    if result == z3.unsat:
+        return None
+    m = solver.model()
+    return [False] + [z3.is_true(m.eval(x, model_completion=True)) for x in xs[1:]]
+
+
+def _run_config(config: tuple[int, str, dict]) -> tuple[int, List[bool] | str | None, dict]:
+    i, kind, options = config
+    if kind == "z3":
+        return i, _solve_z3(**options), {}
+    if kind == "cdcl":
+        engine = _SharingEngine(_worker["num_vars"], _worker["exchange"], **options)
+    else:
+        engine = SatEngine(_worker["num_vars"], **options)
+    for clause in _clauses():
+        engine.add_clause(clause)
+    if not engine.solve():
+        return i, None, engine.stats
+    return i, [engine.value[v] == 1 for v in range(engine.num_vars + 1)], engine.stats
+
+
+def _solve_cube(cube: List[int]) -> tuple[List[bool] | None, bool]:
+    """Solve the clauses under `cube`, with the engine of this worker.
+
+    Returns the model if any, and whether the clauses themselves are
+    found unsatisfiable.
+    """
+    engine = _worker["engine"]
+    if engine is None:
+        engine = _worker["engine"] = _SharingEngine(
+            _worker["num_vars"], _worker["exchange"], **_worker["options"])
+        for clause in _clauses():
+            engine.add_clause(clause)
+    engine.import_clauses()
+    if engine.solve(cube):
+        return [engine.value[v] == 1 for v in range(engine.num_vars + 1)], False
+    return None, not engine.failed
+
+
+def _pool(db: ClauseDB, processes: int | None, share: bool, options: dict | None = None):
+    ctx = multiprocessing.get_context()
+    exchange = ClauseExchange(ctx=ctx) if share else None
+    pool = ctx.Pool(processes, _init_worker,
+                    (db.lits, db.offsets, db.num_vars, exchange, options or {}))
+    return pool, exchange
+
+
+def portfolio(db: ClauseDB, configs: Iterable[tuple[str, dict]] = PORTFOLIO,
+              processes: int | None = None, share: bool = True) -> tuple[List[bool] | str | None, dict]:
+    """Run the solvers of `configs` on the clauses of `db` in parallel.
+
+    Parameters
+    ----------
+    db : ClauseDB
+        The clauses to solve.
+    configs : Iterable[tuple[str, dict]]
+        The solvers to run, see `PORTFOLIO`.
+    processes : int | None
+        How many solvers run at once, all the cores by default.
+    share : bool
+        Whether the native CDCL engines exchange learned clauses.
+
+    Returns
+    -------
+    tuple[List[bool] | str | None, dict]
+        The model found first, where `model[v]` is the value of variable
+        `v`, or None if the clauses are unsatisfiable, or `UNKNOWN` if
+        every solver gave up; and stats naming the solver that answered.
+        Solvers giving up never win.
+
+    """
+    configs = [(i, kind, options) for i, (kind, options) in enumerate(configs)]
+    processes = min(processes or os.cpu_count(), len(configs))
+    pool, exchange = _pool(db, processes, share)
+    model, winner, stats = UNKNOWN, None, {}
+    with pool:
+        for i, model, stats in pool.imap_unordered(_run_config, configs):
+            if model != UNKNOWN:
+                _, kind, options = configs[i]
+                winner = (kind, options)
+                break
+    return model, {"winner": winner, "shared": len(exchange) if share else 0, **stats}
+
+
+def _split(engine: SatEngine, cube: List[int], ranked: List[int],
+           candidates: int) -> tuple[int | None, List[int]]:
+    """Look ahead on the free variables of `ranked` under `cube`.
+
+    Returns the variable to split on, 0 if there is none left or None
+    if the cube is refuted, and the cube extended by failed literals.
+    """
+    base = engine.probe(cube)
+    if base is None:
+        return None, cube
+    best, best_score = 0, -1
+    tried = 0
+    for v in ranked:
+        if tried == candidates:
+            break
+        if v in cube or -v in cube:
+            continue
+        tried += 1
+        pos, neg = engine.probe(cube + [v]), engine.probe(cube + [-v])
+        if pos is None and neg is None:
+            return None, cube
+        if pos is None or neg is None:
+            cube = cube + [v if neg is None else -v]
+            continue
+        score = (pos - base + 1) * (neg - base + 1)
+        if score > best_score:
+            best, best_score = v, score
+    return best, cube
+
+
+def lookahead_cubes(db: ClauseDB, depth: int, candidates: int = 32) -> tuple[List[List[int]], int]:
+    """Split the assignments of the variables of `db` into cubes.
+
+    At every node of a binary tree of height `depth`, the most frequent
+    `candidates` free variables are looked ahead: each of their values
+    is propagated, and the variable whose two values imply the most
+    assignments, by the product of both counts, is split on. A value
+    leading to a conflict is a failed literal, the other value is added
+    to the cube; a node where both values of a variable fail is refuted.
+
+    Returns
+    -------
+    tuple[List[List[int]], int]
+        The cubes left, as lists of literals, and how many were refuted.
+
+    """
+    engine = SatEngine(db.num_vars)
+    engine.pure_literals = False
+    for clause in db:
+        engine.add_clause(clause)
+    ranked = [v for v, _ in Counter(map(abs, db.lits)).most_common()]
+    cubes, refuted = [], 0
+    stack = [([], depth)]
+    while stack:
+        cube, height = stack.pop()
+        if height == 0:
+            v, cube = (0, cube) if engine.probe(cube) is not None else (None, cube)
+        else:
+            v, cube = _split(engine, cube, ranked, candidates)
+        if v is None:
+            refuted += 1
+        elif v == 0:
+            cubes.append(cube)
+        else:
+            stack.append((cube + [-v], height - 1))
+            stack.append((cube + [v], height - 1))
+    return cubes, refuted
+
+
+def cube_and_conquer(db: ClauseDB, depth: int | None = None, processes: int | None = None,
+                     share: bool = True, **options) -> tuple[List[bool] | None, dict]:
+    """Solve the clauses of `db` by cubes, in parallel.
+
+    The cubes of `lookahead_cubes` go to a pool of workers, each keeping
+    one `CdclEngine` (with `options`) from cube to cube and solving the
+    clauses under the cube as assumptions. `depth` defaults to enough
+    for about four cubes per worker.
+
+    Returns
+    -------
+    tuple[List[bool] | None, dict]
+        The model found first, where `model[v]` is the value of variable
+        `v`, or None if the clauses are unsatisfiable; and stats.
+
+    """
+    processes = processes or os.cpu_count()
+    if depth is None:
+        depth = math.ceil(math.log2(processes)) + 2
+    cubes, refuted = lookahead_cubes(db, depth)
+    stats = {"cubes": len(cubes), "refuted": refuted, "solved": 0}
+    if not cubes:
+        return None, stats
+    pool, exchange = _pool(db, min(processes, len(cubes)), share, options)
+    model = None
+    with pool:
+        for model, unsat in pool.imap_unordered(_solve_cube, cubes):
+            stats["solved"] += 1
+            if model is not None or unsat:
+                break
+    stats["shared"] = len(exchange) if share else 0
+    return model, stats
+
+
+PARALLEL_MODES = {"portfolio": portfolio, "cubes": cube_and_conquer}
+
+
+def parallel_dpll(prop: Prop, mode: str = "portfolio", cnf_method: str = "tseitin",
+                  processes: int | None = None, **options) -> dict | str:
+    """Decide the satisfiability of `prop` on several processes.
+
+    `mode` is "portfolio" or "cubes", see `PARALLEL_MODES`; other options
+    go to the function of the mode. Returns a model like `dpll` does,
+    otherwise the string "unsat", or "unknown" if every solver gave up.
+    """
+    db = ClauseDB.from_clauses(flatten(CNF_METHODS[cnf_method](prop)))
+    model, _ = PARALLEL_MODES[mode](db, processes=processes, **options)
+    if model is None:
+        return "unsat"
+    if model == UNKNOWN:
+        return UNKNOWN
+    return {name: model[db.var_ids[name]] if name in db.var_ids else False
+            for name in atoms(prop)}
+
+
+def _pigeonhole(holes: int) -> ClauseDB:
+    """`holes + 1` pigeons in `holes` holes, unsatisfiable."""
+    var = lambda p, h: p * holes + h + 1
+    db = ClauseDB()
+    for p in range(holes + 1):
+        db.add_clause([var(p, h) for h in range(holes)])
+    for h in range(holes):
+        for p in range(holes + 1):
+            for q in range(p):
+                db.add_clause([-var(p, h), -var(q, h)])
+    return db
+
+
+def _satisfies(model: List[bool], db: ClauseDB) -> bool:
+    return all(any(model[lit] if lit > 0 else not model[-lit] for lit in clause) for clause in db)
+
+
+class TestPortfolio(unittest.TestCase):
+    def test_exchange(self):
+        exchange = ClauseExchange(capacity=12)
+        exchange.publish(1, [1, -2])
+        exchange.publish(2, [3])
+        exchange.publish(1, [-4, 5, 6])
+        # does not fit anymore
+        exchange.publish(2, [7, 8, 9])
+        self.assertEqual(exchange.collect(2, 0), ([[1, -2], [-4, 5, 6]], 12))
+        self.assertEqual(exchange.collect(1, 4), ([[3]], 12))
+
+    def test_lookahead_cubes(self):
+        db = _pigeonhole(3)
+        db.add_clause([1, 5, 9])
+        cubes, refuted = lookahead_cubes(db, 3)
+        self.assertEqual(cubes, [])
+        self.assertGreater(refuted, 0)
+        # the cubes cover all the models of the clauses
+        db = ClauseDB()
+        for clause in ([1, 2, 3], [-1, -2], [-2, 4], [-3, -4, 5], [1, -5]):
+            db.add_clause(clause)
+        cubes, _ = lookahead_cubes(db, 2)
+        for bits in range(1 << 5):
+            model = [False] + [bool(bits >> i & 1) for i in range(5)]
+            if _satisfies(model, db):
+                self.assertTrue(any(all(model[lit] if lit > 0 else not model[-lit] for lit in cube)
+                                    for cube in cubes))
+
+    def test_portfolio(self):
+        configs = [("dpll", {}), ("cdcl", {"restarts": "glucose"}), ("z3", {"tactic": "sat", "seed": 1})]
+        for config in configs:
+            model, stats = portfolio(_pigeonhole(4), [config], processes=1)
+            self.assertIsNone(model)
+            self.assertEqual(stats["winner"], config)
+        # without the first pigeon there is a hole for each
+        sat = ClauseDB()
+        for clause in list(_pigeonhole(4))[1:]:
+            sat.add_clause(clause.tolist())
+        for config in configs:
+            model, _ = portfolio(sat, [config], processes=1)
+            self.assertTrue(_satisfies(model, sat))
+        model, stats = portfolio(sat, processes=2)
+        self.assertTrue(_satisfies(model, sat))
+        self.assertIn(stats["winner"], PORTFOLIO)
+        # the "skip" tactic answers unknown, which must not win
+        model, stats = portfolio(_pigeonhole(3), [("z3", {"tactic": "skip"}), ("dpll", {})],
+                                 processes=1)
+        self.assertIsNone(model)
+        self.assertEqual(stats["winner"], ("dpll", {}))
+        model, stats = portfolio(_pigeonhole(3), [("z3", {"tactic": "skip"})], processes=1)
+        self.assertEqual(model, UNKNOWN)
+        self.assertIsNone(stats["winner"])
+
+    def test_cube_and_conquer(self):
+        model, stats = cube_and_conquer(_pigeonhole(5), processes=2)
+        self.assertIsNone(model)
+        self.assertEqual(stats["solved"], stats["cubes"])
+        self.assertGreater(stats["shared"], 0)
+        sat = ClauseDB()
+        for clause in list(_pigeonhole(5))[1:]:
+            sat.add_clause(clause.tolist())
+        model, stats = cube_and_conquer(sat, depth=3, processes=2, restarts="glucose")
+        self.assertTrue(_satisfies(model, sat))
+
+    def test_parallel_dpll(self):
+        for mode in PARALLEL_MODES:
+            self.assertEqual(parallel_dpll(PNot(test_prop_1), mode, processes=2), "unsat")
+            res = parallel_dpll(test_prop_2, mode, processes=2)
+            self.assertTrue(not (res["p1"] or not res["p2"])
+                            or not (res["p3"] or not res["p4"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
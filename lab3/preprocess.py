@@ -0,0 +1,259 @@
+"""CNF preprocessing for the lab3 solvers.
+
+Shrinks a clause set before search, the way SatELite does:
+  * tautologies and duplicate literals are dropped as clauses come in;
+  * a clause C subsumes any clause D containing it, D is dropped (this
+    also drops duplicate clauses and clauses satisfied by a unit);
+  * if C subsumes D except for one literal l which appears negated in
+    D, resolving them on l gives D without ~l, so ~l is dropped from D
+    (self-subsuming resolution, which also propagates units);
+  * a variable v is eliminated by replacing all the clauses it occurs in
+    with their resolvents on v, as long as that does not add clauses
+    (bounded variable elimination).
+The result is equisatisfiable, and `extend_model` turns a model of it
+into a model of the original clauses.
+"""
+
+import random
+import unittest
+from typing import Iterable, List
+
+from dpll import ClauseDB, CdclEngine, PVar, PNot, dpll, test_prop_1, test_prop_2
+
+
+class Preprocessor:
+    """Simplifies clauses of signed ints, with occurrence lists.
+
+    `occurs[lit]` is the set of the indices of the clauses containing
+    `lit`, and removed clauses are None in `clauses`. Variables in
+    `frozen` are never eliminated, e.g. when they are projected on or
+    more clauses about them will come. Like for the engines, `proof`
+    can be set to log every clause added or removed, in DRAT.
+    """
+
+    # do not try to eliminate variables with more resolution pairs
+    max_pairs = 400
+    max_resolvent = 20
+
+    def __init__(self, num_vars: int = 0, frozen: Iterable[int] = ()):
+        self.num_vars = num_vars
+        self.frozen = set(frozen)
+        self.clauses = []
+        self.occurs = {}
+        self.queue = []
+        self.ok = True
+        self.proof = None
+        # (witness literal, clause) for every clause removed by elimination
+        self.eliminated = []
+        self.stats = {"tautologies": 0, "subsumed": 0, "strengthened": 0,
+                      "eliminated_vars": 0, "clauses_before": 0, "clauses_after": 0}
+
+    def add_clause(self, lits: Iterable[int]):
+        clause = set(lits)
+        self.stats["clauses_before"] += 1
+        if any(-lit in clause for lit in clause):
+            self.stats["tautologies"] += 1
+            return
+        self._attach(clause)
+
+    def _attach(self, clause: set):
+        if not clause:
+            self.ok = False
+        self.num_vars = max(self.num_vars, max(map(abs, clause), default=0))
+        i = len(self.clauses)
+        self.clauses.append(clause)
+        for lit in clause:
+            self.occurs.setdefault(lit, set()).add(i)
+        self.queue.append(i)
+
+    def _detach(self, i: int):
+        if self.proof is not None:
+            self.proof.delete(self.clauses[i])
+        for lit in self.clauses[i]:
+            self.occurs[lit].discard(i)
+        self.clauses[i] = None
+
+    def _forward_subsumed(self, clause: set) -> bool:
+        """Whether some clause subsumes `clause`."""
+        clauses = self.clauses
+        for lit in clause:
+            for j in self.occurs.get(lit, ()):
+                if len(clauses[j]) <= len(clause) and clauses[j] <= clause:
+                    return True
+        return False
+
+    def _backward(self, i: int):
+        """Subsume and strengthen other clauses with clause `i`."""
+        clauses, occurs = self.clauses, self.occurs
+        clause = clauses[i]
+        pivot = min(clause, key=lambda lit: len(occurs.get(lit, ())) + len(occurs.get(-lit, ())))
+        for j in list(occurs.get(pivot, set()) | occurs.get(-pivot, set())):
+            other = clauses[j]
+            if j == i or other is None or len(other) < len(clause):
+                continue
+            missing = clause - other
+            if not missing:
+                self._detach(j)
+                self.stats["subsumed"] += 1
+            elif len(missing) == 1:
+                (lit,) = missing
+                if -lit in other:
+                    if self.proof is not None:
+                        self.proof.add(other - {-lit})
+                        self.proof.delete(other)
+                    other.discard(-lit)
+                    occurs[-lit].discard(j)
+                    self.stats["strengthened"] += 1
+                    if not other:
+                        self.ok = False
+                    self.queue.append(j)
+
+    def _simplify(self):
+        while self.queue and self.ok:
+            i = self.queue.pop()
+            if self.clauses[i] is not None and self.clauses[i]:
+                self._backward(i)
+
+    def _eliminate(self, v: int) -> bool:
+        """Eliminate `v` by resolution if that does not add clauses."""
+        clauses = self.clauses
+        pos, neg = list(self.occurs.get(v, ())), list(self.occurs.get(-v, ()))
+        if len(pos) * len(neg) > self.max_pairs:
+            return False
+        resolvents = []
+        for i in pos:
+            for j in neg:
+                resolvent = (clauses[i] - {v}) | (clauses[j] - {-v})
+                if any(-lit in resolvent for lit in resolvent):
+                    continue
+                if len(resolvent) > self.max_resolvent:
+                    return False
+                resolvents.append(resolvent)
+                if len(resolvents) > len(pos) + len(neg):
+                    return False
+        if self.proof is not None:
+            for resolvent in resolvents:
+                self.proof.add(resolvent)
+        for i in pos:
+            self.eliminated.append((v, list(clauses[i])))
+            self._detach(i)
+        for j in neg:
+            self.eliminated.append((-v, list(clauses[j])))
+            self._detach(j)
+        for resolvent in resolvents:
+            if not self._forward_subsumed(resolvent):
+                self._attach(resolvent)
+            elif self.proof is not None:
+                self.proof.delete(resolvent)
+        self.stats["eliminated_vars"] += 1
+        return True
+
+    def run(self, eliminate: bool = True) -> bool:
+        """Simplify the clauses, return False if they are found unsatisfiable."""
+        self._simplify()
+        if eliminate:
+            occurs = self.occurs
+            candidates = [v for v in range(1, self.num_vars + 1) if v not in self.frozen]
+            candidates.sort(key=lambda v: len(occurs.get(v, ())) * len(occurs.get(-v, ())))
+            for v in candidates:
+                if not self.ok:
+                    break
+                if self._eliminate(v):
+                    self._simplify()
+        self.stats["clauses_after"] = len(self.remaining())
+        return self.ok
+
+    def remaining(self) -> List[List[int]]:
+        """The simplified clauses."""
+        return [sorted(c, key=abs) for c in self.clauses if c is not None]
+
+    def extend_model(self, model: List[bool]):
+        """Extend a model of the simplified clauses to the original ones.
+
+        `model[v]` is the value of variable `v`; the values of eliminated
+        variables are overwritten, undoing the eliminations in reverse.
+        """
+        for witness, clause in reversed(self.eliminated):
+            if not any(model[lit] if lit > 0 else not model[-lit] for lit in clause):
+                model[abs(witness)] = witness > 0
+
+
+def preprocess(db: ClauseDB, frozen: Iterable[int] = ()) -> tuple[ClauseDB, Preprocessor]:
+    """Simplify the clauses of `db`, see `Preprocessor`.
+
+    Returns the simplified clauses, with the same variables and names,
+    and the preprocessor to extend their models with. The clauses are
+    unsatisfiable if they contain an empty clause.
+    """
+    pre = Preprocessor(db.num_vars, frozen)
+    for clause in db:
+        pre.add_clause(clause)
+    pre.run()
+    result = ClauseDB()
+    result.names, result.var_ids, result.num_vars = db.names, db.var_ids, db.num_vars
+    for clause in pre.remaining() if pre.ok else [[]]:
+        result.add_clause(clause)
+    return result, pre
+
+
+class TestPreprocess(unittest.TestCase):
+    def test_redundant(self):
+        # [[~p, ~q, p]] is a tautology
+        db, pre = preprocess(ClauseDB.from_clauses([[PNot(PVar("p")), PNot(PVar("q")), PVar("p")]]))
+        self.assertEqual(len(db), 0)
+        pre = Preprocessor()
+        for clause in ([1, 2, -2], [1, 2], [2, 1, 1], [1, 2, 3], [-1, 2], [3, 4], [-3, 4, 5]):
+            pre.add_clause(clause)
+        self.assertTrue(pre.run(eliminate=False))
+        # [1, 2] subsumes [2, 1, 1] and [1, 2, 3], [-1, 2] strengthens it
+        # to [2], and [3, 4] strengthens [-3, 4, 5] to [4, 5]
+        self.assertEqual(sorted(pre.remaining()), [[2], [3, 4], [4, 5]])
+        self.assertEqual(pre.stats["tautologies"], 1)
+        pre.add_clause([-2])
+        self.assertFalse(pre.run())
+
+    def test_elimination(self):
+        # p1 <-> p2 and p2 <-> p3, with p1 and ~p3 in different clauses
+        clauses = [[-1, 2], [1, -2], [-2, 3], [2, -3], [1, 4], [-3, 5]]
+        pre = Preprocessor(frozen=[4, 5])
+        for clause in clauses:
+            pre.add_clause(clause)
+        self.assertTrue(pre.run())
+        self.assertEqual(pre.remaining(), [[4, 5]])
+        model = [False, False, False, False, False, True]
+        pre.extend_model(model)
+        self.assertTrue(all(any(model[lit] if lit > 0 else not model[-lit] for lit in c)
+                            for c in clauses))
+
+    def test_dpll(self):
+        self.assertEqual(dpll(PNot(test_prop_1), preprocess=True), "unsat")
+        res = dpll(test_prop_2, mode="cdcl", preprocess=True)
+        self.assertTrue(not (res["p1"] or not res["p2"])
+                        or not (res["p3"] or not res["p4"]))
+
+    def test_random(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            num_vars = rng.randint(1, 12)
+            clauses = [[rng.choice([1, -1]) * rng.randint(1, num_vars)
+                        for _ in range(rng.randint(1, 4))] for _ in range(rng.randint(1, 50))]
+            engine = CdclEngine(num_vars)
+            for clause in clauses:
+                engine.add_clause(clause)
+            expected = engine.solve()
+            pre = Preprocessor(num_vars)
+            for clause in clauses:
+                pre.add_clause(clause)
+            engine = CdclEngine(num_vars)
+            for clause in pre.remaining() if pre.run() else [[]]:
+                engine.add_clause(clause)
+            self.assertEqual(engine.solve(), expected)
+            if expected:
+                model = [engine.value[v] == 1 for v in range(num_vars + 1)]
+                pre.extend_model(model)
+                self.assertTrue(all(any(model[lit] if lit > 0 else not model[-lit] for lit in c)
+                                    for c in clauses))
+
+
+if __name__ == '__main__':
+    unittest.main()
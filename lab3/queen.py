@@ -1,120 +1,109 @@
+import itertools
 import time
+from contextlib import nullcontext
+from typing import Iterator, List
 from z3 import *
 
 
-def four_queen():
+def four_queen(N: int = 100, encoding: str = "sequential", limit: int | None = None,
+               symmetry: bool = True, output: str | None = None) -> int:
+    """Count the N-queens solutions with Z3, from up to `limit` models.
+
+    The "exactly one" and "at most one" constraints are written with
+    `encoding` from `cardinality.ENCODINGS`. With `symmetry`, most of
+    the non-canonical solutions are ruled out, and each model counts for
+    its orbit, all of whose images are then blocked, see `symmetry`; the
+    `limit` is then on orbits. With `output`, the column of the queen on
+    each row of every solution is written to that file, see `solutions`.
+    """
+    from cardinality import at_most_one, exactly_one
+    from solutions import SolutionWriter, typecode_for
+    from symmetry import excluded, images
+    from allsat import sat_models
+
     solver = Solver()
     # the basic data structure:
-    N = 100
     board = [[Bool('b_{}_{}'.format(i, j)) for j in range(N)]
              for i in range(N)]
 
     # constraint 1: each row has just one queen:
     for i in range(N):
-        rows = []
-        for j in range(N):
-            current_row = []
-            current_row.append(board[i][j])
-            for k in range(N):
-                if k != j:
-                    current_row.append(Not(board[i][k]))
-            rows.append(And(current_row))
-        solver.add(Or(rows))
-
-    # Challenge: add constraints which describe each column has just one queen
+        solver.add(exactly_one(board[i], encoding))
+
     # constraint 2: each column has just one queen:
-    for i in range(N):
-        cols = []
-        for j in range(N):
-            current_col = []
-            current_col.append(board[j][i])
-            for k in range(N):
-                if k != j:
-                    current_col.append(Not(board[k][i]))
-            cols.append(And(current_col))
-        solver.add(Or(cols))
-
-    # Challenge: add constraints which describe each diagonal has at most one queen
-    # constraint 3: each diagonal has at most one queen:
+    for j in range(N):
+        solver.add(exactly_one([board[i][j] for i in range(N)], encoding))
 
+    # constraint 3: each diagonal has at most one queen:
     # NOTE: diagnoal_hash(x, y) = x-y
-    # the first diagonal starts from (0, N-1)
-    diag = []
-    for i in range(2*N-1):
-        diagonals = []
-        for x in range(N):
-            y = x - i + N-1
-            if y < 0 or y >= N:
-                continue
-            current_diagonal = []
-            current_diagonal.append(board[x][y])
-            for _x in range(N):
-                if _x == x:
-                    continue
-                _y = _x - i + N-1
-                if _y < 0 or _y >= N:
-                    continue
-                current_diagonal.append(Not(board[_x][_y]))
-            diagonals.append(And(current_diagonal))
-        current_diagonal = []
-        for x in range(N):
-            y = x - i + N-1
-            if y < 0 or y >= N:
-                continue
-            current_diagonal.append(Not(board[x][y]))
-        diagonals.append(And(current_diagonal))
-        solver.add(Or(diagonals))
-
-    # Challenge: add constraints which describe each anti-diagonal has at most one queen
-    # constraint 4: each anti-diagonal has at most one queen:
+    for d in range(1 - N, N):
+        solver.add(at_most_one([board[x][x - d] for x in range(N) if 0 <= x - d < N], encoding))
 
+    # constraint 4: each anti-diagonal has at most one queen:
     # NOTE: anti_diagnoal_hash(x, y) = x+y
-    # the first anti_diagonal starts from (0, 0)
-    anti_diag = []
-    for i in range(2*N-1):
-        anti_diagonals = []
-        for x in range(N):
-            y = i - x
-            if y < 0 or y >= N:
-                continue
-            current_anti_diagonal = []
-            current_anti_diagonal.append(board[x][y])
-            for _x in range(N):
-                if _x == x:
-                    continue
-                _y = i - _x
-                if _y < 0 or _y >= N:
-                    continue
-                current_anti_diagonal.append(Not(board[_x][_y]))
-            anti_diagonals.append(And(current_anti_diagonal))
-        current_anti_diagonal = []
-        for x in range(N):
-            y = i - x
-            if y < 0 or y >= N:
-                continue
-            current_anti_diagonal.append(Not(board[x][y]))
-        anti_diagonals.append(And(current_anti_diagonal))
-        solver.add(Or(anti_diagonals))
+    for d in range(2 * N - 1):
+        solver.add(at_most_one([board[x][d - x] for x in range(N) if 0 <= d - x < N], encoding))
 
-    count = 0
-    while solver.check() == sat:
-        m = solver.model()
-        # print(m)
-        count += 1
-        block = []
-        for i in range(N):
-            for j in range(N):
-                if m.eval(board[i][j], True):
-                    board[i][j] = board[i][j]
-                else:
-                    board[i][j] = Not(board[i][j])
-                block.append(board[i][j])
-        new_prop = Not(And(block))
-        solver.add(new_prop)
+    if symmetry:
+        for k, (i, j) in excluded(N):
+            solver.add(Not(And(board[0][k], board[i][j])))
+
+    def columns(m: ModelRef) -> tuple:
+        return tuple(next(j for j in range(N) if is_true(m.eval(board[i][j]))) for i in range(N))
 
+    def orbits() -> Iterator[List[tuple]]:
+        # one model per orbit: every image of a solution is blocked at once
+        while solver.check() == sat:
+            orbit = sorted(set(images(columns(solver.model()))))
+            yield orbit
+            for image in orbit:
+                solver.add(Not(And([board[i][j] for i, j in enumerate(image)])))
+
+    if symmetry:
+        solutions = (image for orbit in itertools.islice(orbits(), limit) for image in orbit)
+    else:
+        props = [b for row in board for b in row]
+        models = itertools.islice(sat_models(props, And(solver.assertions())), limit)
+        solutions = map(columns, models)
+
+    count = 0
+    with SolutionWriter(output, N, typecode_for(N - 1)) if output else nullcontext() as sink:
+        for solution in solutions:
+            count += 1
+            if sink is not None:
+                sink.write(solution)
     print("number of result: ", count)
+    return count
+
+
+def benchmark_encodings(N: int, limit: int | None = None):
+    """Time `four_queen` with each of the cardinality encodings."""
+    from cardinality import ENCODINGS
+
+    for encoding in ENCODINGS:
+        start = time.time()
+        count = four_queen(N, encoding, limit)
+        print(f"{encoding}: {count} solutions of {N}-queens in {time.time() - start:.3f}s")
+
+
+def n_queen_count(N: int) -> int:
+    """Count the N-queens solutions with the #SAT counter, without enumerating."""
+    from sharpsat import ModelCounter
+
+    def var(i, j):
+        return i * N + j + 1
+
+    # a queen in each row, and no two queens on a line
+    clauses = [[var(i, j) for j in range(N)] for i in range(N)]
+    cells = [(i, j) for i in range(N) for j in range(N)]
+    for a, (i, j) in enumerate(cells):
+        for k, l in cells[:a]:
+            if i == k or j == l or i - j == k - l or i + j == k + l:
+                clauses.append([-var(i, j), -var(k, l)])
+    return ModelCounter(range(1, N * N + 1)).count(clauses)
 
 
 if __name__ == '__main__':
     # Four Queen should have 2 set of solutions
-    four_queen()
+    four_queen(4)
+    benchmark_encodings(8)
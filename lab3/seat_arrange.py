@@ -92,6 +92,9 @@ def seat_arrangement():
     if model.evaluate(c3):
         print("Carol", end='')
     print("\n")
+    # 9 atoms: counting all the solutions on the truth table is one pass
+    from truth_table import truth_table
+    print("the number of solutions: ", truth_table(And(solver.assertions())).count())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,286 @@
+"""Projected model counting (#SAT) for lab3 clause sets.
+
+Counts how many assignments of some projected variables extend to a
+model of the clauses, without enumerating them:
+  * DPLL branches on projected variables only, with unit propagation,
+    and a literal of another variable occurring with one polarity only
+    satisfies its clauses for free;
+  * the clauses left are split into connected components, which share
+    no variable, so their counts multiply;
+  * the count of every component is cached under its sorted clauses,
+    a canonical form of the clause set, since the same components come
+    back again and again in different branches;
+  * a component without projected variables only needs a satisfiability
+    check, done by `CdclEngine`.
+With all the variables projected, this is plain model counting.
+"""
+
+import itertools
+import random
+import sys
+import unittest
+from collections import Counter
+from typing import Iterable, List
+
+from dpll import (ClauseDB, CdclEngine, PAnd, PImplies, PNot, POr, PVar, Prop, atoms,
+                  cnf_clauses, test_prop_1, test_prop_2)
+from truth_table import MAX_VARS, truth_table
+
+
+class ModelCounter:
+    """Counts the assignments of the `projection` variables extending to models.
+
+    The cache is kept from one `count` to the next, for the same
+    projection.
+    """
+
+    def __init__(self, projection: Iterable[int]):
+        self.projection = frozenset(projection)
+        self.cache = {}
+        self.stats = {"decisions": 0, "components": 0, "cache_hits": 0, "sat_checks": 0}
+
+    def count(self, clauses: Iterable[Iterable[int]]) -> int:
+        formula = self._formula(clauses)
+        return self._count(formula) << len(self.projection - self._projected(formula))
+
+    def _formula(self, clauses: Iterable[Iterable[int]]) -> List[tuple]:
+        """The clauses as tuples, without duplicate literals and tautologies."""
+        formula = []
+        for clause in clauses:
+            clause = tuple(dict.fromkeys(clause))
+            if not any(-lit in clause for lit in clause):
+                formula.append(clause)
+        return formula
+
+    def _projected(self, clauses: List[tuple]) -> set:
+        projection = self.projection
+        return {abs(lit) for clause in clauses for lit in clause if abs(lit) in projection}
+
+    def _occurrences(self, clauses: List[tuple]) -> dict:
+        """The indices of the clauses of each literal."""
+        occurs = {}
+        for i, clause in enumerate(clauses):
+            for lit in clause:
+                occurs.setdefault(lit, []).append(i)
+        return occurs
+
+    def _simplify(self, clauses: List[tuple], units: Iterable[int],
+                  occurs: dict) -> tuple[List[tuple], set, set] | None:
+        """Propagate `units` and the unit clauses, then the pure literals.
+
+        Returns the clauses left, the literals made true and the projected
+        variables left, or None on a conflict. Both steps go through the
+        `occurs` of the literals whose clauses change, and the index is
+        shared by the two branches of a decision.
+        """
+        free = [len(clause) for clause in clauses]
+        satisfied = [False] * len(clauses)
+        true = set()
+        queue = [*units, *(clause[0] for clause in clauses if len(clause) == 1)]
+        while queue:
+            lit = queue.pop()
+            if lit in true:
+                continue
+            if -lit in true:
+                return None
+            true.add(lit)
+            for i in occurs.get(lit, ()):
+                satisfied[i] = True
+            for i in occurs.get(-lit, ()):
+                if satisfied[i]:
+                    continue
+                free[i] -= 1
+                if free[i] == 0:
+                    return None
+                if free[i] == 1:
+                    queue.append(next(q for q in clauses[i] if -q not in true))
+        # pure literals of the other variables satisfy their clauses,
+        # which may make more literals pure
+        live = Counter(lit for i, clause in enumerate(clauses) if not satisfied[i]
+                       for lit in clause if -lit not in true)
+        projection = self.projection
+        pure = [lit for lit in live if -lit not in live and abs(lit) not in projection]
+        while pure:
+            for i in occurs[pure.pop()]:
+                if satisfied[i]:
+                    continue
+                satisfied[i] = True
+                for lit in clauses[i]:
+                    if -lit in true:
+                        continue
+                    live[lit] -= 1
+                    if live[lit] == 0 and live[-lit] > 0 and abs(lit) not in projection:
+                        pure.append(-lit)
+        clauses = [clause if free[i] == len(clause) else tuple(lit for lit in clause if -lit not in true)
+                   for i, clause in enumerate(clauses) if not satisfied[i]]
+        return clauses, true, {abs(lit) for lit, n in live.items() if n and abs(lit) in projection}
+
+    def _count(self, clauses: List[tuple], units: Iterable[int] = ()) -> int:
+        """Count the assignments of the projected variables of `clauses`, under `units`.
+
+        The components are split with an explicit stack of `_counting`
+        and `_splitting` generators, each yielding the subproblems whose
+        counts it needs, so the number of decisions is not bounded by
+        the recursion limit.
+        """
+        stack = [self._counting(clauses, units)]
+        result = None
+        while stack:
+            try:
+                stack.append(stack[-1].send(result))
+                result = None
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+        return result
+
+    def _counting(self, clauses: List[tuple], units: Iterable[int], occurs: dict | None = None):
+        if occurs is None:
+            occurs = self._occurrences(clauses)
+        before = {abs(lit) for lit in occurs if abs(lit) in self.projection}
+        simplified = self._simplify(clauses, units, occurs)
+        if simplified is None:
+            return 0
+        clauses, true, after = simplified
+        result = 1 << len(before - after - {abs(lit) for lit in true})
+        for component in self._components(clauses):
+            result *= yield self._splitting(component)
+            if result == 0:
+                break
+        return result
+
+    def _components(self, clauses: List[tuple]) -> Iterable[List[tuple]]:
+        parent = {}
+
+        def find(v):
+            while parent.setdefault(v, v) != v:
+                parent[v] = v = parent[parent[v]]
+            return v
+
+        for clause in clauses:
+            root = find(abs(clause[0]))
+            for lit in clause[1:]:
+                other = find(abs(lit))
+                if other != root:
+                    parent[other] = root
+        groups = {}
+        for clause in clauses:
+            groups.setdefault(find(abs(clause[0])), []).append(clause)
+        return groups.values()
+
+    def _splitting(self, clauses: List[tuple]):
+        key = tuple(sorted(tuple(sorted(clause)) for clause in clauses))
+        count = self.cache.get(key)
+        if count is not None:
+            self.stats["cache_hits"] += 1
+            return count
+        self.stats["components"] += 1
+        occurs = self._occurrences(clauses)
+        occurrences = Counter()
+        for lit, indices in occurs.items():
+            if abs(lit) in self.projection:
+                occurrences[abs(lit)] += len(indices)
+        if not occurrences:
+            count = int(self._satisfiable(clauses))
+        else:
+            v = max(occurrences, key=occurrences.__getitem__)
+            self.stats["decisions"] += 1
+            count = ((yield self._counting(clauses, (v,), occurs))
+                     + (yield self._counting(clauses, (-v,), occurs)))
+        self.cache[key] = count
+        return count
+
+    def _satisfiable(self, clauses: List[tuple]) -> bool:
+        self.stats["sat_checks"] += 1
+        ids = {}
+        numbered = [[ids.setdefault(abs(lit), len(ids) + 1) * (1 if lit > 0 else -1)
+                     for lit in clause] for clause in clauses]
+        engine = CdclEngine(len(ids))
+        for clause in numbered:
+            engine.add_clause(clause)
+        return engine.solve()
+
+
+def count_models(db: ClauseDB, projection: Iterable[int] | None = None) -> int:
+    """The number of assignments of `projection` that extend to models of `db`.
+
+    `projection` defaults to all the variables of `db`.
+    """
+    if projection is None:
+        projection = range(1, db.num_vars + 1)
+    return ModelCounter(projection).count(clause.tolist() for clause in db)
+
+
+def count_prop(prop: Prop, projection: Iterable[str] | None = None,
+               cnf_method: str = "tseitin") -> int:
+    """The number of assignments of the atoms `projection` satisfying `prop`.
+
+    `projection` defaults to the atoms of `prop`; the atoms introduced
+    by the CNF conversion are projected away. With all the atoms
+    projected, and at most `truth_table.MAX_VARS` of them, the models are
+    counted on the truth table instead.
+    """
+    names = atoms(prop) if projection is None else list(projection)
+    if len(names) <= MAX_VARS and set(atoms(prop)) <= set(names):
+        return truth_table(prop, names).count()
+    db = cnf_clauses(prop, cnf_method)
+    ids = [db.var_ids[name] for name in names if name in db.var_ids]
+    return count_models(db, ids) << (len(names) - len(ids))
+
+
+class TestSharpSat(unittest.TestCase):
+    def test_count(self):
+        # p -> (q -> p) is valid, ~((p1 -> p2) /\ (p3 -> p4)) has 16 - 9 models
+        self.assertEqual(count_prop(test_prop_1), 4)
+        self.assertEqual(count_prop(PNot(test_prop_1)), 0)
+        self.assertEqual(count_prop(test_prop_2), 7)
+        self.assertEqual(count_prop(test_prop_2, cnf_method="distribute"), 7)
+        self.assertEqual(count_prop(PVar("p"), ["p", "q"]), 2)
+        # projected on p, q: (p \/ q) /\ (r -> ~p)
+        prop = PAnd(POr(PVar("p"), PVar("q")), PImplies(PVar("r"), PNot(PVar("p"))))
+        self.assertEqual(count_prop(prop), 4)
+        self.assertEqual(count_prop(prop, ["p", "q"]), 3)
+
+    def test_components(self):
+        # 30 independent copies of (x \/ y) /\ (~x \/ ~z): 4 models each
+        db = ClauseDB()
+        for i in range(30):
+            x, y, z = 3 * i + 1, 3 * i + 2, 3 * i + 3
+            db.add_clause([x, y])
+            db.add_clause([-x, -z])
+        counter = ModelCounter(range(1, db.num_vars + 1))
+        self.assertEqual(counter.count(clause.tolist() for clause in db), 4 ** 30)
+        self.assertEqual(counter.stats["decisions"], 30)
+        # both values of x leave the component of c, d and e:
+        # (x \/ a) /\ (~x \/ b) /\ (a \/ b \/ c) /\ (c \/ d) /\ (d \/ e)
+        counter = ModelCounter(range(1, 7))
+        self.assertEqual(counter.count([[1, 2], [-1, 3], [2, 3, 4], [4, 5], [5, 6]]), 20)
+        self.assertEqual(counter.stats["cache_hits"], 1)
+
+    def test_deep(self):
+        # x1 -> x2 -> ... -> xn has n + 1 models, counted n decisions deep
+        n = 300
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(200)
+        try:
+            count = ModelCounter(range(1, n + 1)).count([[-i, i + 1] for i in range(1, n)])
+        finally:
+            sys.setrecursionlimit(limit)
+        self.assertEqual(count, n + 1)
+
+    def test_random(self):
+        rng = random.Random(2)
+        for _ in range(200):
+            num_vars = rng.randint(1, 8)
+            clauses = [[rng.choice([1, -1]) * rng.randint(1, num_vars)
+                        for _ in range(rng.randint(1, 3))] for _ in range(rng.randint(0, 12))]
+            projection = [v for v in range(1, num_vars + 1) if rng.random() < 0.6]
+            expected = set()
+            for values in itertools.product([False, True], repeat=num_vars):
+                if all(any(values[abs(lit) - 1] == (lit > 0) for lit in clause) for clause in clauses):
+                    expected.add(tuple(values[v - 1] for v in projection))
+            self.assertEqual(ModelCounter(projection).count(clauses), len(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
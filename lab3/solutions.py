@@ -0,0 +1,175 @@
+"""Compact files of solutions, written and read as streams.
+
+Enumerations can find far more solutions than fit in memory, or than
+are worth printing as Z3 models. A solution file holds fixed-size
+binary records of `width` values each, after a header:
+  * "SOL1", the typecode of the values and the width, see `_HEADER`;
+  * typecode "B", "H" or "I" for unsigned ints of 1, 2 or 4 bytes, e.g.
+    the column of the queen on each row;
+  * typecode "?" for bools, packed 8 to a byte, e.g. the values of the
+    atoms of a model.
+The file is compressed according to its extension, like DIMACS files,
+and is read back lazily, through `mmap` when it is not compressed.
+"""
+
+import array
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import unittest
+from typing import Iterable, Iterator, Sequence
+
+from dimacs import OPENERS, open_file
+
+_MAGIC = b"SOL1"
+_HEADER = struct.Struct("<4scI")
+# the values are little-endian, like the header
+_SWAP = sys.byteorder != "little"
+
+
+def _record_size(typecode: str, width: int) -> int:
+    return (width + 7) // 8 if typecode == "?" else array.array(typecode).itemsize * width
+
+
+def typecode_for(max_value: int) -> str:
+    """The smallest typecode holding the values up to `max_value`."""
+    for typecode in "BHI":
+        if max_value < 1 << 8 * array.array(typecode).itemsize:
+            return typecode
+    raise ValueError(f"solutions: values up to {max_value} do not fit in 4 bytes")
+
+
+class SolutionWriter:
+    """Writes solutions of `width` values to `path`, `buffer_size` bytes at a time.
+
+    Use it as a context manager, or `close` it to flush the buffer.
+    """
+
+    def __init__(self, path: str, width: int, typecode: str = "B", buffer_size: int = 1 << 16):
+        if typecode not in "?BHI":
+            raise ValueError(f"solutions: unknown typecode: {typecode}")
+        if width <= 0:
+            raise ValueError(f"solutions: records of {width} values")
+        self.file = open_file(os.fspath(path), "wb")
+        self.width = width
+        self.typecode = typecode
+        self.count = 0
+        self.buffer = bytearray(_HEADER.pack(_MAGIC, typecode.encode(), width))
+        self.buffer_size = buffer_size
+
+    def write(self, values: Sequence[int]):
+        if len(values) != self.width:
+            raise ValueError(f"solutions: {len(values)} values in a record of {self.width}")
+        if self.typecode == "?":
+            packed = 0
+            for i, value in enumerate(values):
+                if value:
+                    packed |= 1 << i
+            self.buffer += packed.to_bytes((self.width + 7) // 8, "little")
+        else:
+            values = array.array(self.typecode, values)
+            if _SWAP:
+                values.byteswap()
+            self.buffer += values.tobytes()
+        self.count += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_solutions(path: str, chunk_size: int = 1 << 22) -> Iterator[tuple]:
+    """Yield the solutions of the file `path`, as tuples of ints or bools."""
+    path = os.fspath(path)
+    opener = OPENERS.get(os.path.splitext(path)[1])
+    with (opener or open)(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size or header[:4] != _MAGIC:
+            raise ValueError(f"not a solution file: {path}")
+        _, typecode, width = _HEADER.unpack(header)
+        typecode = typecode.decode()
+        if typecode not in "?BHI" or width == 0:
+            raise ValueError(f"not a solution file: {path}")
+        size = _record_size(typecode, width)
+        if opener is None:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            source.seek(_HEADER.size)
+        else:
+            source = f
+        with source:
+            # whole records per chunk
+            chunk_size = max(size, chunk_size // max(size, 1) * size)
+            while chunk := source.read(chunk_size):
+                if len(chunk) % size:
+                    chunk += source.read(size - len(chunk) % size)
+                    if len(chunk) % size:
+                        raise ValueError(f"truncated solution file: {path}")
+                if typecode == "?":
+                    for start in range(0, len(chunk), size):
+                        packed = int.from_bytes(chunk[start:start + size], "little")
+                        yield tuple(bool(packed >> i & 1) for i in range(width))
+                else:
+                    values = array.array(typecode, chunk)
+                    if _SWAP:
+                        values.byteswap()
+                    for start in range(0, len(values), width):
+                        yield tuple(values[start:start + width])
+
+
+def write_solutions(path: str, solutions: Iterable[Sequence[int]], width: int,
+                    typecode: str = "B") -> int:
+    """Write `solutions` to `path`, return how many there were."""
+    with SolutionWriter(path, width, typecode) as writer:
+        for solution in solutions:
+            writer.write(solution)
+    return writer.count
+
+
+class TestSolutions(unittest.TestCase):
+    def test_roundtrip(self):
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            for typecode, max_value in (("B", 255), ("H", 1000), ("I", 1 << 20), ("?", 1)):
+                solutions = [tuple(rng.randint(0, max_value) for _ in range(13)) for _ in range(500)]
+                if typecode == "?":
+                    solutions = [tuple(map(bool, s)) for s in solutions]
+                for name in ("s.sol", "s.sol.gz", "s.sol.xz"):
+                    path = os.path.join(tmp, name)
+                    self.assertEqual(write_solutions(path, solutions, 13, typecode), 500)
+                    self.assertEqual(list(read_solutions(path, chunk_size=100)), solutions)
+            path = os.path.join(tmp, "empty.sol")
+            write_solutions(path, [], 4)
+            self.assertEqual(list(read_solutions(path)), [])
+            self.assertEqual(typecode_for(99), "B")
+            self.assertEqual(typecode_for(300), "H")
+            with SolutionWriter(path, 2) as writer, self.assertRaises(ValueError):
+                writer.write([1])
+            with self.assertRaises(ValueError):
+                SolutionWriter(path, 0)
+            # little-endian whatever the host
+            write_solutions(path, [(1, 2)], 2, "H")
+            with open(path, "rb") as f:
+                self.assertEqual(f.read()[_HEADER.size:], b"\x01\x00\x02\x00")
+            with open(path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, b"B", 0) + b"\x00")
+            with self.assertRaises(ValueError):
+                list(read_solutions(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
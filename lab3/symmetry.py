@@ -0,0 +1,104 @@
+"""Symmetries of the N-queens board, to count solutions by orbits.
+
+A solution is a tuple `q` with a queen on (i, q[i]) for each row i. The
+8 rotations and reflections of the board map solutions to solutions,
+so it is enough to find one solution of each orbit and add up the
+orbit sizes, 8 unless the solution is symmetric. The canonical solution
+of an orbit is its least image in lex order. The first queen of an
+image is on the border of the board, so the queen on the first row of
+a canonical solution is the closest of all the border queens to a
+corner, along the border: `excluded` lists the pairs of cells this
+rules out, as constraints for the searches.
+"""
+
+import itertools
+import unittest
+from typing import Iterable, Iterator, List, Sequence
+
+# (i, j) -> the image of (i, j), on a board of side m + 1
+_SYMMETRIES = [
+    lambda i, j, m: (i, j),
+    lambda i, j, m: (i, m - j),
+    lambda i, j, m: (m - i, j),
+    lambda i, j, m: (m - i, m - j),
+    lambda i, j, m: (j, i),
+    lambda i, j, m: (m - j, m - i),
+    lambda i, j, m: (j, m - i),
+    lambda i, j, m: (m - j, i),
+]
+
+
+def images(q: Sequence[int]) -> List[tuple]:
+    """The images of the solution `q` by the 8 symmetries, with repeats."""
+    m = len(q) - 1
+    result = []
+    for symmetry in _SYMMETRIES:
+        image = [0] * len(q)
+        for i, j in enumerate(q):
+            a, b = symmetry(i, j, m)
+            image[a] = b
+        result.append(tuple(image))
+    return result
+
+
+def is_canonical(q: Sequence[int]) -> bool:
+    return tuple(q) == min(images(q))
+
+
+def orbit_size(q: Sequence[int]) -> int:
+    return len(set(images(q)))
+
+
+def count_by_orbits(solutions: Iterable[Sequence[int]]) -> int:
+    """The number of solutions in the orbits of the canonical ones among `solutions`."""
+    return sum(orbit_size(q) for q in solutions if is_canonical(q))
+
+
+def corner_distance(i: int, j: int, n: int) -> int | None:
+    """How far (i, j) is from a corner along the border, None inside the board."""
+    distances = []
+    if i in (0, n - 1):
+        distances.append(min(j, n - 1 - j))
+    if j in (0, n - 1):
+        distances.append(min(i, n - 1 - i))
+    return min(distances, default=None)
+
+
+def excluded(n: int) -> Iterator[tuple[int, tuple[int, int]]]:
+    """Yield (k, (i, j)) when no canonical solution has queens on both (0, k) and (i, j).
+
+    (i, j) is (0, k) itself when k is past the middle of the first row.
+    """
+    border = [(i, j) for i in range(n) for j in range(n) if i in (0, n - 1) or j in (0, n - 1)]
+    for k in range(n):
+        for i, j in border:
+            if corner_distance(i, j, n) < k and (i != 0 or j == k):
+                yield k, (i, j)
+
+
+def _solutions(n: int) -> Iterator[tuple]:
+    for q in itertools.permutations(range(n)):
+        if len({i + j for i, j in enumerate(q)}) == n and len({i - j for i, j in enumerate(q)}) == n:
+            yield q
+
+
+class TestSymmetry(unittest.TestCase):
+    def test_orbits(self):
+        for n, expected, canonical in ((1, 1, 1), (4, 2, 1), (5, 10, 2), (6, 4, 1), (8, 92, 12)):
+            solutions = list(_solutions(n))
+            self.assertEqual(len(solutions), expected)
+            self.assertEqual(count_by_orbits(solutions), expected)
+            self.assertEqual(sum(map(is_canonical, solutions)), canonical)
+
+    def test_excluded(self):
+        for n in range(1, 9):
+            pairs = list(excluded(n))
+            for q in _solutions(n):
+                if is_canonical(q):
+                    self.assertFalse(any(q[0] == k and q[i] == j for k, (i, j) in pairs))
+        # the first queen of 8-queens is on the left half of the first row
+        self.assertEqual({k for k, cell in excluded(8) if cell == (0, k)}, {4, 5, 6, 7})
+
+
+if __name__ == '__main__':
+    unittest.main()
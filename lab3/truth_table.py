@@ -0,0 +1,173 @@
+"""Vectorized truth tables for propositions with few atoms.
+
+Up to twenty-odd atoms, evaluating a formula on every assignment at
+once beats any search. Row r of the table assigns atom i the bit i of
+r, and a column holds the value of a formula on all the rows, packed 64
+rows per uint64 word. The column of an atom is a fixed bit pattern, and
+each connective is one NumPy bitwise operation on whole columns, so a
+single pass over the formula gives its satisfiability, validity, model
+count and models.
+"""
+
+import tracemalloc
+import unittest
+from typing import Iterable, Iterator, List
+
+import numpy as np
+import z3
+
+from dpll import (PAnd, PFalse, PImplies, PNot, POr, PTrue, PVar, Prop, _fold, atoms,
+                  from_z3, test_prop_1, test_prop_2)
+
+# callers fall back to a solver above this many atoms: a column takes
+# 2 ** MAX_VARS bits, for every node whose parents are not all computed
+MAX_VARS = 20
+
+_ONES = np.uint64(0xFFFFFFFFFFFFFFFF)
+# the columns of the atoms 0 to 5 within a word
+_PATTERNS = [0xAAAAAAAAAAAAAAAA, 0xCCCCCCCCCCCCCCCC, 0xF0F0F0F0F0F0F0F0,
+             0xFF00FF00FF00FF00, 0xFFFF0000FFFF0000, 0xFFFFFFFF00000000]
+
+
+class TruthTable:
+    """The column of a formula over the atoms `names`, atom i being bit i of a row."""
+
+    def __init__(self, names: List[str], column: np.ndarray):
+        self.names = names
+        self.column = column
+
+    def count(self) -> int:
+        """The number of models."""
+        return int(np.bitwise_count(self.column).sum())
+
+    def satisfiable(self) -> bool:
+        return bool(self.column.any())
+
+    def valid(self) -> bool:
+        return self.count() == 1 << len(self.names)
+
+    def models(self) -> Iterator[dict]:
+        """Yield the models, in the order of their rows."""
+        bits = np.unpackbits(self.column.view(np.uint8), bitorder="little")
+        for row in np.flatnonzero(bits).tolist():
+            yield {name: bool(row >> i & 1) for i, name in enumerate(self.names)}
+
+
+def _column(i: int, words: int) -> np.ndarray:
+    if i < 6:
+        return np.full(words, _PATTERNS[i], dtype=np.uint64)
+    return np.where(np.arange(words) >> (i - 6) & 1, _ONES, np.uint64(0))
+
+
+def truth_table(expr: Prop | z3.BoolRef, names: Iterable[str] | None = None) -> TruthTable:
+    """The truth table of a `Prop` or of a propositional Z3 formula.
+
+    `names` orders the atoms, by default as they come in `expr`; it must
+    contain them all, and the others are free.
+    """
+    prop = from_z3(expr) if isinstance(expr, z3.ExprRef) else expr
+    names = atoms(prop) if names is None else list(names)
+    index = {name: i for i, name in enumerate(names)}
+    words = max(1, (1 << len(names)) >> 6)
+    # the rows past 2 ** len(names) in a single word are not assignments
+    rows = _ONES >> np.uint64(64 - (1 << len(names))) if len(names) < 6 else _ONES
+    columns = {}
+    cache = {}
+
+    def expand(p: Prop) -> tuple:
+        match p:
+            case PVar() | PTrue() | PFalse():
+                return ()
+            case PNot(q):
+                return (q,)
+            case PAnd(left, right) | POr(left, right) | PImplies(left, right):
+                return (left, right)
+            case _:
+                raise NotImplementedError(f"truth_table: unknown prop: {p}")
+
+    # the column of a node is dropped once all its parents have used it
+    parents = {}
+    stack = [prop]
+    while stack:
+        for sub in expand(stack.pop()):
+            if sub not in parents:
+                stack.append(sub)
+            parents[sub] = parents.get(sub, 0) + 1
+
+    def combine(p: Prop, subs: List[np.ndarray]) -> np.ndarray:
+        for sub in expand(p):
+            parents[sub] -= 1
+            if parents[sub] == 0:
+                del cache[sub]
+        match p:
+            case PVar(var):
+                if var not in columns:
+                    if var not in index:
+                        raise ValueError(f"truth_table: {var} is not in the names")
+                    columns[var] = _column(index[var], words)
+                return columns[var]
+            case PTrue():
+                return np.full(words, _ONES)
+            case PFalse():
+                return np.zeros(words, dtype=np.uint64)
+            case PNot():
+                return ~subs[0]
+            case PAnd():
+                return subs[0] & subs[1]
+            case POr():
+                return subs[0] | subs[1]
+            case PImplies():
+                return ~subs[0] | subs[1]
+
+    return TruthTable(names, _fold(prop, expand, combine, cache) & rows)
+
+
+class TestTruthTable(unittest.TestCase):
+    def test_table(self):
+        table = truth_table(test_prop_1)
+        self.assertTrue(table.valid())
+        self.assertEqual(table.count(), 4)
+        self.assertFalse(truth_table(PNot(test_prop_1)).satisfiable())
+        table = truth_table(test_prop_2)
+        self.assertEqual(table.count(), 7)
+        self.assertFalse(table.valid())
+        for model in table.models():
+            self.assertTrue(not (model["p1"] or not model["p2"])
+                            or not (model["p3"] or not model["p4"]))
+        self.assertEqual(len(list(table.models())), 7)
+        self.assertEqual(truth_table(PVar("p"), ["q", "p"]).count(), 2)
+        self.assertEqual(list(truth_table(PTrue(), []).models()), [{}])
+
+    def test_z3(self):
+        a, b, c, d = z3.Bools('a b c d')
+        f = z3.Or(z3.And(a, b, d), z3.And(a, b, z3.Not(c)))
+        self.assertEqual(truth_table(f).count(), 3)
+        self.assertEqual(truth_table(z3.Not(f)).count(), 13)
+        # an xor chain over several words
+        xs = z3.Bools(' '.join(f"x{i}" for i in range(10)))
+        parity = xs[0]
+        for x in xs[1:]:
+            parity = z3.Or(z3.And(parity, z3.Not(x)), z3.And(z3.Not(parity), x))
+        table = truth_table(parity)
+        self.assertEqual(table.count(), 512)
+        self.assertTrue(all(sum(m.values()) % 2 == 1 for m in table.models()))
+
+    def test_memory(self):
+        # 10000 nodes over 20 atoms, but only a few columns of 128 KiB at once
+        xs = [PVar(f"x{i}") for i in range(20)]
+        prop = xs[0]
+        for i in range(1, 5000):
+            prop = PAnd(prop, xs[i % 20])
+            if i % 2:
+                prop = POr(prop, PNot(xs[i * 7 % 20]))
+        tracemalloc.start()
+        try:
+            truth_table(prop, [f"x{i}" for i in range(20)]).count()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 64 << 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,8 @@ what they can do."""
 
 from z3 import *
 
+from allsat import sat_models
+
 ########################################
 #  Use Z3 as solver
 
@@ -253,29 +255,6 @@ print(solver.check())
 print(solver.model())
 
 
-def _sat_all(props: list[ExprRef], f: ExprRef) -> list:
-    from functools import reduce
-    from copy import deepcopy
-
-    f = deepcopy(f)
-    solver = Solver()
-    solver.add(f)
-    result = []
-    while solver.check() == sat:
-        m = solver.model()
-        result.append(m)
-        block = []
-        for prop in props:
-            prop_is_true = m.eval(prop, model_completion=True)
-            if prop_is_true:
-                new_prop = prop
-            else:
-                new_prop = Not(prop)
-            block.append(new_prop)
-        f = And(f, Not(reduce(lambda a, b: And(a, b), block)))
-        solver.add(f)
-    return result
-
 # Exercise 1-6
 # Now it's your turn, let's wrap all these facility into a nice function:
 # Read and understand the src, then complete the lost part.
@@ -288,15 +267,16 @@ def sat_all(props, f):
         props {BoolRef} -- Proposition list
         f {Boolref} -- logical express that consist of props
     """
-    result = _sat_all(props, f)
     print("the given proposition: ", f)
-    print("the number of solutions: ", len(result))
 
     def print_model(m):
         print(sorted([(d, m[d]) for d in m], key=lambda x: str(x[0])))
 
-    for m in result:
+    count = 0
+    for m in sat_models(props, f):
         print_model(m)
+        count += 1
+    print("the number of solutions: ", count)
 
 
 print("-------------Exercise 1-6------------------")
@@ -1,4 +1,6 @@
 from typing import List
+import os
+import sys
 import unittest
 
 from z3 import *
@@ -7,6 +9,9 @@ import calc
 import tac
 from counter import counter
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lab2"))
+from pro_print import pretty_print
+
 
 ###############################################
 # a compiler from Calc to Tac.
@@ -128,7 +133,9 @@ class TestTV(unittest.TestCase):
         #                  _tac_f_4 == f_mul(_tac_f_3, s1),
         #                  _tac_f_5 == _tac_f_4),
         #              _calc_f_1 == _tac_f_5))]
-        print(solver)
+        # streamed by the printer of lab2, without building the text whole
+        for assertion in solver.assertions():
+            pretty_print(assertion, max_width=100)
         self.assertEqual(str(solver.check()), "unsat")
 
 
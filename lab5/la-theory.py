@@ -284,6 +284,41 @@ assert (count_zero_la(l3) == 2)
 assert (count_zero_la(l4) == 3)
 
 
+# Counting does not need a solution per zero: with x_i meaning "e_i is
+# the zero picked", the 0-1 constraints are propositional, and the lab3
+# #SAT counter counts their solutions without enumerating them. The
+# "exactly one x_i" constraint is a sequential counter, where the fresh
+# s_i means "some x_j with j <= i is 1"; counting projects them away.
+def count_zero_sat(l):
+    import os
+    import sys
+    lab3 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lab3")
+    if lab3 not in sys.path:
+        sys.path.append(lab3)
+    from sharpsat import ModelCounter
+
+    n = len(l)
+    # x_i is variable i + 1, s_i is variable n + i + 1
+    x = [i + 1 for i in range(n)]
+    s = [n + i + 1 for i in range(n)]
+    clauses = [x[:]]
+    for i in range(n):
+        clauses.append([-x[i], s[i]])
+        if i > 0:
+            clauses.append([-s[i - 1], s[i]])
+            clauses.append([-x[i], -s[i - 1]])
+        # x_1*e_1 + ... + x_n*e_n = 0 with a single x_i = 1: e_i = 0
+        if l[i] != 0:
+            clauses.append([-x[i]])
+    return ModelCounter(x).count(clauses)
+
+
+assert (count_zero_sat(l1) == 0)
+assert (count_zero_sat(l2) == 1)
+assert (count_zero_sat(l3) == 2)
+assert (count_zero_sat(l4) == 3)
+
+
 def random_10():
     import random
     return random.randint(0, 10)
@@ -296,6 +331,10 @@ def test_long_input(len: int):
     count_zero_la(l)
     end = time.time()
     print(f"for input length {len}, solver costs {end - start} sec")
+    start = time.time()
+    count_zero_sat(l)
+    end = time.time()
+    print(f"for input length {len}, #SAT counter costs {end - start} sec")
 
 
 # for input length 10, solver costs 0.02593827247619629 sec
@@ -7,11 +7,29 @@ many solutions exist.
 
 """
 
+import multiprocessing
+import os
+import sys
 import time
+from contextlib import nullcontext
 from z3 import *
 
+# the SAT tools live in lab3: symmetry breaking and the #SAT counter
+_LAB3 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lab3")
+if _LAB3 not in sys.path:
+    sys.path.append(_LAB3)
 
-def n_queen_la(board_size: int, verbose: bool = False) -> int:
+from solutions import SolutionWriter, typecode_for
+from symmetry import corner_distance, excluded, images, is_canonical
+
+
+def _solution_sink(output: str | None, n: int):
+    """A writer of the column of the queen on each row to `output`, if any."""
+    return SolutionWriter(output, n, typecode_for(n - 1)) if output else nullcontext()
+
+
+def n_queen_la(board_size: int, verbose: bool = False, symmetry: bool = True,
+               output: str | None = None) -> int:
     solver = Solver()
     n = board_size
 
@@ -45,25 +63,46 @@ def n_queen_la(board_size: int, verbose: bool = False) -> int:
         solver.add(
             sum([board[i][k-i] for i in range(n) if i <= k and k-i < n]) <= 1)
 
+    # with symmetry, rule out most of the solutions that are not the least
+    # of their rotations and reflections, and find one solution per orbit
+    if symmetry:
+        for k, (i, j) in excluded(n):
+            solver.add(board[0][k] + board[i][j] <= 1)
+
     # count the number of solutions
     solution_count = 0
 
     start = time.time()
-    while solver.check() == sat:
-        solution_count += 1
-        model = solver.model()
-
-        if verbose:
-            # print the solution
-            print([(row_index, col_index) for row_index, row in enumerate(board)
-                   for col_index, flag in enumerate(row) if model[flag] == 1])
-
-        # generate constraints from solution
-        solution_cons = [(flag == 1)
-                         for row in board for flag in row if model[flag] == 1]
-
-        # add solution to the solver to get new solution
-        solver.add(Not(And(solution_cons)))
+    with _solution_sink(output, n) as sink:
+        while solver.check() == sat:
+            solution_count += 1
+            model = solver.model()
+
+            if verbose:
+                # print the solution
+                print([(row_index, col_index) for row_index, row in enumerate(board)
+                       for col_index, flag in enumerate(row) if model[flag] == 1])
+
+            solution = [next(col for col in range(n) if model[board[row][col]] == 1)
+                        for row in range(n)]
+            if symmetry:
+                # count the whole orbit, and block all of it
+                orbit = set(images(solution))
+                solution_count += len(orbit) - 1
+                for image in orbit:
+                    if sink is not None:
+                        sink.write(image)
+                    solver.add(Not(And([board[row][col] == 1 for row, col in enumerate(image)])))
+                continue
+            if sink is not None:
+                sink.write(solution)
+
+            # generate constraints from solution
+            solution_cons = [(flag == 1)
+                             for row in board for flag in row if model[flag] == 1]
+
+            # add solution to the solver to get new solution
+            solver.add(Not(And(solution_cons)))
 
     print(
         f"n_queen_la solve {board_size}-queens by {(time.time() - start):.6f}s")
@@ -96,36 +135,56 @@ def n_queen_bt(board_size: int, verbose: bool = False) -> int:
     return len(solutions)
 
 
-def n_queen_dfs(board_size: int):
+def n_queen_dfs(board_size: int, symmetry: bool = True, output: str | None = None):
     n = board_size
     col: list[bool] = [False] * n
     diag: list[bool] = [False] * (2*n - 1)
     anti_diag: list[bool] = [False] * (2*n - 1)
+    queens: list[int] = []
     cnt = 0
 
     def _dfs(x: int, y: int):
         nonlocal cnt
         if x >= n:
             if y == 0:
-                cnt += 1
+                # with symmetry, a canonical solution counts for its orbit
+                if not symmetry:
+                    found = [queens]
+                elif is_canonical(queens):
+                    found = sorted(set(images(queens)))
+                else:
+                    found = []
+                cnt += len(found)
+                if sink is not None:
+                    for solution in found:
+                        sink.write(solution)
             return
         _diag = x - y + n - 1
         _anti_diag = x+y
         if col[y] or diag[_diag] or anti_diag[_anti_diag]:
             return
+        # in a canonical solution, no border queen is closer to a corner
+        # than the one of the first row
+        if symmetry:
+            distance = corner_distance(x, y, n)
+            if distance is not None and distance < (queens[0] if queens else y):
+                return
 
         col[y] = True
         diag[_diag] = True
         anti_diag[_anti_diag] = True
+        queens.append(y)
         for _y in range(n):
             _dfs(x+1, _y)
+        queens.pop()
         anti_diag[_anti_diag] = False
         diag[_diag] = False
         col[y] = False
 
     start = time.time()
-    for _y in range(n):
-        _dfs(0, _y)
+    with _solution_sink(output, n) as sink:
+        for _y in range(n):
+            _dfs(0, _y)
     end = time.time()
 
     print(f"n_queen_dfs solve {board_size}-queens by {(end - start):.6f}s")
@@ -133,7 +192,77 @@ def n_queen_dfs(board_size: int):
     return cnt
 
 
-def n_queen_la_opt(board_size: int, verbose: bool = False) -> int:
+def _n_queen_bits_task(task: tuple[int, int, int, int, int]) -> tuple[int, int, int, float]:
+    """Count the completions of a board of the first rows, with bitmasks.
+
+    `cols`, `diag` and `anti` have a bit set for each column of the next
+    row under attack along a column, diagonal or anti-diagonal. Returns
+    the pid of the worker, the number of solutions times `weight`, the
+    number of queens placed and the time taken.
+    """
+    n, weight, cols, diag, anti = task
+    start = time.time()
+    full = (1 << n) - 1
+    solutions = nodes = 0
+    stack = [(cols, diag, anti)]
+    while stack:
+        cols, diag, anti = stack.pop()
+        if cols == full:
+            solutions += 1
+            continue
+        free = full & ~(cols | diag | anti)
+        while free:
+            bit = free & -free
+            free ^= bit
+            nodes += 1
+            stack.append((cols | bit, (diag | bit) << 1 & full, (anti | bit) >> 1))
+    return os.getpid(), solutions * weight, nodes, time.time() - start
+
+
+def n_queen_bits(board_size: int, processes: int | None = None, verbose: bool = False) -> int:
+    n = board_size
+    full = (1 << n) - 1
+
+    # The board reflected left to right has as many solutions, so the first
+    # queen only goes on the left half, counted twice, or in the middle
+    # column. Each placement of the first two queens is a task for the pool.
+    tasks = []
+    for first in range((n + 1) // 2):
+        weight = 1 if 2 * first + 1 == n else 2
+        bit = 1 << first
+        cols, diag, anti = bit, bit << 1 & full, bit >> 1
+        free = full & ~(cols | diag | anti) if n > 1 else 0
+        if not free:
+            tasks.append((n, weight, cols, diag, anti))
+        while free:
+            bit = free & -free
+            free ^= bit
+            tasks.append((n, weight, cols | bit, (diag | bit) << 1 & full, (anti | bit) >> 1))
+
+    start = time.time()
+    workers = {}
+    with multiprocessing.Pool(processes) as pool:
+        for pid, solutions, nodes, elapsed in pool.imap_unordered(_n_queen_bits_task, tasks):
+            stats = workers.setdefault(pid, {"tasks": 0, "solutions": 0, "nodes": 0, "seconds": 0.0})
+            stats["tasks"] += 1
+            stats["solutions"] += solutions
+            stats["nodes"] += nodes
+            stats["seconds"] += elapsed
+    solution_count = sum(stats["solutions"] for stats in workers.values())
+
+    if verbose:
+        # print the work done by each worker
+        for pid, stats in sorted(workers.items()):
+            print(f"worker {pid}: {stats['tasks']} tasks, {stats['solutions']} solutions, "
+                  f"{stats['nodes']} queens placed in {stats['seconds']:.3f}s")
+    print(
+        f"n_queen_bits solve {board_size}-queens by {(time.time() - start):.6f}s "
+        f"with {len(workers)} workers")
+    return solution_count
+
+
+def n_queen_la_opt(board_size: int, verbose: bool = False, symmetry: bool = True,
+                   output: str | None = None) -> int:
     solver = Solver()
     n = board_size
 
@@ -152,28 +281,69 @@ def n_queen_la_opt(board_size: int, verbose: bool = False) -> int:
     solver.add([If(i == j, True, And(queens[i] - queens[j] != i - j, queens[i] - queens[j] != j - i))
                 for i in range(n) for j in range(i)])
 
+    # with symmetry, find one solution per orbit, as in n_queen_la()
+    if symmetry:
+        solver.add([Not(And(queens[0] == k, queens[i] == j)) for k, (i, j) in excluded(n)])
+
     # count the number of solutions
     solution_count = 0
     start = time.time()
 
-    while solver.check() == sat:
-        solution_count += 1
-        model = solver.model()
+    with _solution_sink(output, n) as sink:
+        while solver.check() == sat:
+            solution_count += 1
+            model = solver.model()
+
+            if verbose:
+                # print the solutions
+                print([(index, model[queen])
+                      for index, queen in enumerate(queens)])
+
+            solution = [model[queen].as_long() for queen in queens]
+            if symmetry:
+                orbit = set(images(solution))
+                solution_count += len(orbit) - 1
+                for image in orbit:
+                    if sink is not None:
+                        sink.write(image)
+                    solver.add(Not(And([queen == col for queen, col in zip(queens, image)])))
+                continue
+            if sink is not None:
+                sink.write(solution)
+
+            # generate constraints from solution
+            solution_cons = [(queen == model[queen]) for queen in queens]
+
+            # add solution to the solver to get new solution
+            solver.add(Not(And(solution_cons)))
 
-        if verbose:
-            # print the solutions
-            print([(index, model[queen])
-                  for index, queen in enumerate(queens)])
+    print(
+        f"n_queen_la_opt solve {board_size}-queens by {(time.time() - start):.6f}s")
 
-        # generate constraints from solution
-        solution_cons = [(queen == model[queen]) for queen in queens]
+    return solution_count
 
-        # add solution to the solver to get new solution
-        solver.add(Not(And(solution_cons)))
 
-    print(
-        f"n_queen_la_opt solve {board_size}-queens by {(time.time() - start):.6f}s")
+def _lab3_queen():
+    """lab3/queen.py, whose module name this file shadows."""
+    module = sys.modules.get("lab3_queen")
+    if module is None:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("lab3_queen", os.path.join(_LAB3, "queen.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules["lab3_queen"] = module
+    return module
+
 
+def n_queen_sharpsat(board_size: int) -> int:
+    # the clauses and the #SAT counter of lab3's n_queen_count
+    n_queen_count = _lab3_queen().n_queen_count
+
+    # count the number of solutions, without enumerating them
+    start = time.time()
+    solution_count = n_queen_count(board_size)
+    print(
+        f"n_queen_sharpsat solve {board_size}-queens by {(time.time() - start):.6f}s")
     return solution_count
 
 
@@ -181,10 +351,12 @@ if __name__ == '__main__':
     # 8-queen problem has 92 solutions
     print("--------------- N = 8 ---------------")
     N = 8
+    print(n_queen_bits(N))
     print(n_queen_bt(N))
     print(n_queen_dfs(N))
     print(n_queen_la(N))
     print(n_queen_la_opt(N))
+    print(n_queen_sharpsat(N))
 
     '''
     n_queen_bt solve 8-queens by 0.030147s
@@ -202,6 +374,7 @@ if __name__ == '__main__':
     # which one is faster? What conclusion you can draw from the result?
     print("--------------- N = 10 ---------------")
     N = 10
+    print(n_queen_bits(N))
     print(n_queen_bt(N))
     print(n_queen_dfs(N))
     print(n_queen_la(N))
@@ -223,6 +396,7 @@ if __name__ == '__main__':
     # What's your observation? What conclusion you can draw?
     print("--------------- N = 16 ---------------")
     N = 16
+    print(n_queen_bits(N, verbose=True))
     print(n_queen_bt(N))
     print(n_queen_dfs(N))
     print(n_queen_la(N))